@@ -31,6 +31,10 @@ import pyworkflow.utils as pwutils
 
 from .constants import *
 
+# The helpers used by the protocols (and their dependencies) are only
+# imported when first needed, so importing the plugin during discovery
+# stays cheap
+
 
 _logo = "simple_logo.png"
 _references = ['Elmlund2013']
@@ -40,33 +44,142 @@ class Plugin(pyworkflow.em.Plugin):
     _homeVar = SIMPLE_HOME
     _pathVars = [SIMPLE_HOME]
     _supportedVersions = ['2.1']
+    # Environ computed for every SIMPLE_HOME
+    _environs = {}
 
     @classmethod
     def _defineVariables(cls):
         cls._defineEmVar(SIMPLE_HOME, 'simple-2.1')
         cls._defineVar(SIMPLE_PRIME, 'simple_prime')
+        # Converted input stacks are shared between runs through this
+        # cache, its size is given in MB. It is disabled (0) by default,
+        # set e.g. SIMPLE_CACHE_SIZE = 10240 to keep up to 10 GB of stacks
+        cls._defineVar(SIMPLE_CACHE,
+                       os.path.join(os.environ.get('SCIPION_USER_DATA',
+                                                   os.path.expanduser('~')),
+                                    'tmp', 'simple_cache'))
+        cls._defineVar(SIMPLE_CACHE_SIZE, '0')
+        # Memory and disk (in GB) that a run may use, 0 to take the
+        # memory of this host and the free space of the project disk
+        cls._defineVar(SIMPLE_MAX_MEMORY, '0')
+        cls._defineVar(SIMPLE_MAX_DISK, '0')
+        # Command to submit a batch of simple_prime runs to the queue
+        # system, e.g. 'sbatch -c %(cores)d -J %(name)s %(script)s', with
+        # the cores of every batch and the seconds a run may wait to be
+        # batched with others
+        cls._defineVar(SIMPLE_BATCH_SUBMIT, '')
+        cls._defineVar(SIMPLE_BATCH_CORES, '32')
+        cls._defineVar(SIMPLE_BATCH_WAIT, '60')
+        # Command telling if a batch is still in the queue (exit code 0)
+        # before it starts, e.g. 'squeue -h -n %(name)s | grep -q .', and
+        # the hours a run may wait for its batch (0 for no limit)
+        cls._defineVar(SIMPLE_BATCH_STATUS, '')
+        cls._defineVar(SIMPLE_BATCH_TIMEOUT, '0')
+        # Command to start the workers of a distributed run on the nodes,
+        # e.g. 'mpirun -np %(workers)d --map-by ppr:1:node %(command)s'
+        # (empty to start them as local processes), and the local folder
+        # of the nodes where they stage the input (empty for the system
+        # temporary folder)
+        cls._defineVar(SIMPLE_WORKER_LAUNCH, '')
+        cls._defineVar(SIMPLE_WORKER_SCRATCH, '')
 
     @classmethod
     def getEnviron(cls):
-        """ Return the environ settings to run Simple programs. """
-        environ = pwutils.Environ(os.environ)
+        """ Return the environ settings to run Simple programs. They are
+        computed once for every SIMPLE_HOME and a copy is returned. """
+        home = cls.getHome()
+        if home not in cls._environs:
+            environ = pwutils.Environ(os.environ)
 
-        SIMPLEBIN = cls.getHome('bin')
-        environ.update({
-            'SIMPLEBIN': SIMPLEBIN,
-            'SIMPLEPATH': cls.getHome(),
-            'SIMPLESYS': cls.getHome(),
-            'PATH': SIMPLEBIN + os.pathsep + cls.getHome('apps')
-        },
-            position=pwutils.Environ.BEGIN)
+            SIMPLEBIN = cls.getHome('bin')
+            environ.update({
+                'SIMPLEBIN': SIMPLEBIN,
+                'SIMPLEPATH': cls.getHome(),
+                'SIMPLESYS': cls.getHome(),
+                'PATH': SIMPLEBIN + os.pathsep + cls.getHome('apps')
+            },
+                position=pwutils.Environ.BEGIN)
+            cls._environs[home] = environ
 
-        return environ
+        return pwutils.Environ(cls._environs[home])
 
     @classmethod
     def getProgram(cls):
         """ Return the simple_prime binary that will be used. """
         return os.path.join(cls.getHome('bin'), cls.getVar(SIMPLE_PRIME))
 
+    @classmethod
+    def getCapabilities(cls):
+        """ Return the version and accepted keys of simple_prime, probed
+        once for every binary and cached on disk. """
+        from .probe import getProgramCapabilities
+        return getProgramCapabilities(cls.getProgram(), cls.getEnviron(),
+                                      os.path.join(cls.getVar(SIMPLE_CACHE),
+                                                   'capabilities.json'))
+
+    @classmethod
+    def getStackCache(cls):
+        """ Return the cache of converted stacks or None if disabled. """
+        from .cache import StackCache
+        maxSize = int(cls.getVar(SIMPLE_CACHE_SIZE))
+        if maxSize <= 0:
+            return None
+        return StackCache(cls.getVar(SIMPLE_CACHE), maxSize * 1024 * 1024)
+
+    @classmethod
+    def getThreadsCache(cls):
+        """ Return the cache of thread counts tuned for this host. """
+        from .tuning import ThreadsCache
+        return ThreadsCache(os.path.join(cls.getVar(SIMPLE_CACHE),
+                                         'threads.json'))
+
+    @classmethod
+    def getBatchSpool(cls):
+        """ Return the spool of batch jobs or None if not configured. """
+        from .batch import BatchSpool
+        submitTemplate = cls.getVar(SIMPLE_BATCH_SUBMIT)
+        if not submitTemplate:
+            return None
+        return BatchSpool(os.path.join(cls.getVar(SIMPLE_CACHE), 'batch'),
+                          submitTemplate, int(cls.getVar(SIMPLE_BATCH_CORES)),
+                          maxWait=float(cls.getVar(SIMPLE_BATCH_WAIT)),
+                          statusTemplate=cls.getVar(SIMPLE_BATCH_STATUS),
+                          timeout=float(cls.getVar(SIMPLE_BATCH_TIMEOUT)) * 3600)
+
+    @classmethod
+    def launchWorkers(cls, address, tokenFile, workers, logFile=None):
+        """ Start the workers of a distributed run, connecting to the
+        coordinator at address, and return their processes. """
+        from .distributed import launchWorkers
+        return launchWorkers(address, tokenFile, workers,
+                             launchTemplate=cls.getVar(SIMPLE_WORKER_LAUNCH),
+                             scratchDir=cls.getVar(SIMPLE_WORKER_SCRATCH),
+                             logFile=logFile)
+
+    @classmethod
+    def getCostModel(cls):
+        """ Return the resources model calibrated in this installation. """
+        from .costs import CostModel
+        return CostModel(os.path.join(cls.getVar(SIMPLE_CACHE), 'costs.json'))
+
+    @classmethod
+    def getResourceLimits(cls, path, host=True):
+        """ Return the maximum (memory, disk) in bytes for a run writing
+        in path. Limits not set in the configuration are taken from this
+        host, or are 0 (no limit) if host is False. """
+        import psutil
+        maxMemory = max(float(cls.getVar(SIMPLE_MAX_MEMORY)), 0) * 1024 ** 3
+        maxDisk = max(float(cls.getVar(SIMPLE_MAX_DISK)), 0) * 1024 ** 3
+        if not host:
+            return int(maxMemory), int(maxDisk)
+        if maxMemory <= 0:
+            maxMemory = psutil.virtual_memory().total
+        if maxDisk <= 0:
+            while not os.path.exists(path):
+                path = os.path.dirname(os.path.abspath(path))
+            maxDisk = psutil.disk_usage(path).free
+        return int(maxMemory), int(maxDisk)
+
     @classmethod
     def defineBinaries(cls, env):
         env.addPackage('simple', version='2.1',
@@ -0,0 +1,263 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import numpy as np
+
+
+def correlation(data1, data2):
+    """ Return the normalized cross correlation between two arrays. """
+    a = np.asarray(data1, dtype=np.float32).ravel()
+    b = np.asarray(data2, dtype=np.float32).ravel()
+    a = a - a.mean(dtype=np.float64)
+    b = b - b.mean(dtype=np.float64)
+    denom = np.sqrt(np.dot(a, a) * np.dot(b, b))
+    if denom == 0:
+        return 0.
+    return float(np.dot(a, b) / denom)
+
+
+def _radialGrid(box):
+    """ Return the distance (in px) of every pixel of a 2D box to its
+    center, with the FFT center convention. """
+    coords = np.arange(box) - box // 2
+    return np.sqrt(coords[:, None] ** 2 + coords[None, :] ** 2)
+
+
+def _zscore(values):
+    std = values.std()
+    if std == 0:
+        return np.zeros_like(values)
+    return (values - values.mean()) / std
+
+
+def scoreAverages(stack):
+    """ Score the quality of a stack of 2D averages of shape (n, box, box).
+
+    Return a dict of arrays with one value per image:
+        snr: variance inside the particle mask over the one outside
+        falloff: log ratio of the low to the high frequency power
+        centering: 1 - distance from the center of mass to the box
+            center, relative to the box radius
+        score: sum of the z-scores of the three measures above, -inf
+            for empty images
+    """
+    data = np.asarray(stack, dtype=np.float32)
+    n, box = data.shape[0], data.shape[-1]
+    data = data - data.mean(axis=(1, 2), keepdims=True)
+    radius = _radialGrid(box)
+
+    inside = radius < 0.4 * box
+    outside = radius >= 0.45 * box
+    varIn = data[:, inside].var(axis=1)
+    varOut = data[:, outside].var(axis=1)
+    snr = varIn / np.maximum(varOut, 1e-12 * np.maximum(varIn, 1e-12))
+
+    power = np.abs(np.fft.fftshift(np.fft.fft2(data), axes=(1, 2))) ** 2
+    lowPower = power[:, (radius > 0) & (radius < box / 8.)].mean(axis=1)
+    highPower = power[:, (radius >= box / 4.) & (radius < box / 2.)].mean(axis=1)
+    falloff = np.log((lowPower + 1e-12) / (highPower + 1e-12))
+
+    # Center of mass of the positive density
+    mass = np.maximum(data, 0)
+    total = mass.sum(axis=(1, 2))
+    coords = np.arange(box) - box // 2
+    cy = (mass.sum(axis=2) * coords).sum(axis=1) / np.maximum(total, 1e-12)
+    cx = (mass.sum(axis=1) * coords).sum(axis=1) / np.maximum(total, 1e-12)
+    centering = 1 - np.sqrt(cx ** 2 + cy ** 2) / (box / 2.)
+
+    valid = varIn > 0
+    score = np.full(n, -np.inf)
+    score[valid] = (_zscore(np.log(snr[valid])) + _zscore(falloff[valid]) +
+                    _zscore(centering[valid]))
+    return {'snr': snr, 'falloff': falloff, 'centering': centering,
+            'score': score}
+
+
+def findDuplicates(stack, threshold):
+    """ Return a list with, for every image of the stack, the index of a
+    previous image that it duplicates (maximum normalized cross correlation
+    over all shifts above threshold) or -1. """
+    data = np.asarray(stack, dtype=np.float32)
+    n, box = data.shape[0], data.shape[-1]
+    data = data - data.mean(axis=(1, 2), keepdims=True)
+    norms = np.sqrt((data ** 2).sum(axis=(1, 2)))
+    fts = np.fft.rfft2(data)
+    duplicates = [-1] * n
+    for i in range(1, n):
+        if norms[i] == 0:
+            continue
+        # Correlation with all previous images at every shift at once
+        xcorr = np.fft.irfft2(fts[:i] * np.conj(fts[i]), s=(box, box))
+        ncc = xcorr.reshape(i, -1).max(axis=1) / np.maximum(norms[:i] * norms[i],
+                                                           1e-12)
+        best = int(np.argmax(ncc))
+        if ncc[best] >= threshold:
+            duplicates[i] = best
+    return duplicates
+
+
+def selectAverages(scores, duplicates, fraction):
+    """ Return the sorted indexes of the best scored images, skipping
+    duplicates of better ones, up to the given fraction of the images. """
+    n = len(scores)
+    order = sorted(range(n), key=lambda i: -scores[i])
+    # Of a group of duplicates, only keep the best scored one
+    rank = dict((index, r) for r, index in enumerate(order))
+    dropped = set()
+    for i, j in enumerate(duplicates):
+        if j >= 0:
+            dropped.add(i if rank[i] > rank[j] else j)
+    keep = [i for i in order if i not in dropped and np.isfinite(scores[i])]
+    nKeep = max(1, int(np.ceil(fraction * n)))
+    return sorted(keep[:nKeep])
+
+
+def getGridOrientations(symmetryGroup):
+    """ Return the orientations, as np.rot90 (k, axes) pairs applied in
+    order, under which two volumes refined with the given symmetry group
+    may describe the same structure and that map the sampling grid onto
+    itself (so no interpolation is needed): rotations of 90 degrees about
+    the symmetry axis (z) and turning it upside down, for cyclic and
+    dihedral groups. Other groups are only compared as they are. """
+    group = symmetryGroup.lower()
+    if not group.startswith(('c', 'd')) or group == 'c1':
+        return [()]
+    orientations = []
+    for flip in [(), ((2, (0, 1)),)]:
+        for k in range(4):
+            orientations.append(flip + (((k, (1, 2)),) if k else ()))
+    return orientations
+
+
+def _orient(volume, orientation):
+    for k, axes in orientation:
+        volume = np.rot90(volume, k, axes)
+    return volume
+
+
+def _shellIndexes(box):
+    """ Return the integer frequency shell (in px) of every coefficient of
+    a rfftn transform of a cubic volume. """
+    freq = np.fft.fftfreq(box) * box
+    freqz = np.fft.rfftfreq(box) * box
+    radius = np.sqrt(freq[:, None, None] ** 2 + freq[None, :, None] ** 2 +
+                     freqz[None, None, :] ** 2)
+    return np.round(radius).astype(int)
+
+
+def compareVolumes(volumes, samplingRate, resolution,
+                   orientations=None, threshold=0.5):
+    """ Compare every pair of a sequence of n (box, box, box) volumes,
+    given in the same frame (e.g. the states of a simple_prime run), in
+    Fourier space. Volumes (e.g. memory mapped files) are transformed one
+    at a time and only their coefficients below resolution are kept.
+
+    Return a dict with (n, n) arrays:
+        correlation: normalized correlation of the volumes filtered at
+            resolution (A), the best over the given orientations
+        resolution: resolution (A) at which the FSC of the pair (in the
+            best orientation) falls below threshold
+        orientation: index of the best orientation of the second volume
+    """
+    n, box = len(volumes), volumes[0].shape[-1]
+    orientations = orientations or [()]
+    shells = _shellIndexes(box)
+    nShells = box // 2
+    lowPass = shells <= box * samplingRate / float(resolution)
+    # Coefficients in the half not stored by rfftn are counted twice
+    weights = np.full(shells.shape[-1], 2.)
+    weights[0] = 1
+    if box % 2 == 0:
+        weights[-1] = 1
+    weights = np.broadcast_to(weights, shells.shape)
+    valid = (shells < nShells) & lowPass
+    shells = shells[valid]
+    weights = weights[valid]
+
+    def transform(volume):
+        volume = np.asarray(volume, dtype=np.float32)
+        return np.fft.rfftn(volume - volume.mean())[valid].astype(np.complex64)
+
+    fts = np.array([transform(v) for v in volumes])
+    power = np.abs(fts) ** 2
+    norms = np.sqrt((power * weights).sum(axis=1))
+    shellPower = np.array([np.bincount(shells, p * weights, nShells)
+                           for p in power])
+
+    correlation = np.eye(n)
+    fscResolution = np.zeros((n, n))
+    bestOrientation = np.zeros((n, n), dtype=int)
+    for j in range(n):
+        rotated = np.array([transform(_orient(volumes[j], o))
+                            for o in orientations])
+        for i in range(n):
+            if i == j:
+                continue
+            cross = (fts[i] * np.conj(rotated)).real * weights
+            ncc = cross.sum(axis=1) / max(norms[i] * norms[j], 1e-12)
+            best = int(np.argmax(ncc))
+            correlation[i, j] = ncc[best]
+            bestOrientation[i, j] = best
+            fsc = (np.bincount(shells, cross[best], nShells) /
+                   np.maximum(np.sqrt(shellPower[i] * shellPower[j]), 1e-12))
+            below = np.nonzero(fsc[1:] < threshold)[0]
+            shell = below[0] + 1 if len(below) else nShells
+            fscResolution[i, j] = box * samplingRate / float(max(shell, 1))
+    return {'correlation': correlation, 'resolution': fscResolution,
+            'orientation': bestOrientation}
+
+
+def findRedundantStates(correlation, threshold):
+    """ Return a list with, for every state, the index of a previous state
+    whose correlation with it is above threshold (the most similar one),
+    or -1 if it is distinct. Redundant states always point to a distinct
+    one. """
+    n = len(correlation)
+    redundant = [-1] * n
+    for i in range(1, n):
+        similar = [j for j in range(i) if redundant[j] < 0 and
+                   min(correlation[i][j], correlation[j][i]) >= threshold]
+        if similar:
+            redundant[i] = max(similar, key=lambda j: correlation[j][i])
+    return redundant
+
+
+def mergeStates(volumes, redundant, orientations, bestOrientation):
+    """ Return the distinct volumes (whose redundant entry is -1) averaged
+    with the states redundant with them, brought to their orientation.
+    Volumes are read one at a time and added to the average of their
+    distinct state. """
+    merged = {}
+    for i, j in enumerate(redundant):
+        if j < 0:
+            merged[i] = [np.array(volumes[i], dtype=np.float64), 1]
+    for i, j in enumerate(redundant):
+        if j >= 0:
+            merged[j][0] += _orient(volumes[i],
+                                    orientations[bestOrientation[j][i]])
+            merged[j][1] += 1
+    return [(merged[i][0] / merged[i][1]).astype(np.float32)
+            for i in sorted(merged)]
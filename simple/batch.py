@@ -0,0 +1,272 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import sys
+import json
+import glob
+import time
+import uuid
+import shutil
+import socket
+import subprocess
+
+from simple.batch_runner import getCancelFile, getExitFile, getHeartbeatFile
+
+
+# Locks older than this (in seconds) were left by a dead process
+STALE_LOCK = 600
+# A batch runner that has not written its heartbeat for this long (in
+# seconds) is considered dead
+HEARTBEAT_TIMEOUT = 120
+# Folders of finished batches are removed after this time (in seconds),
+# once the protocols waiting for their jobs have read the exit codes
+FINISHED_KEEP = 3600
+
+
+class BatchSpool(object):
+    """ Folder shared by the protocols whose simple_prime executions should
+    be packed into a single submission to the queue system.
+
+    Every execution is added as a pending job and its protocol waits for
+    it. Once enough threads are pending to fill the batch cores, or the
+    oldest pending job has waited maxWait seconds, any of the waiting
+    protocols moves all pending jobs into a new batch folder and submits a
+    script running them with batch_runner.py. The submission command is
+    built from submitTemplate with the keys script, cores and name, e.g.
+    'sbatch -c %(cores)d -J %(name)s %(script)s'.
+
+    A submitted batch is alive while its runner writes its heartbeat.
+    Before the runner starts, the optional statusTemplate (with the key
+    name, e.g. 'squeue -h -n %(name)s | grep -q .') should exit with 0
+    while the queue system still has the batch. Jobs fail when their
+    batch is not alive or after timeout seconds (0 for no limit), and
+    are then cancelled. The folders of old finished batches are removed
+    on every submission.
+    """
+    def __init__(self, path, submitTemplate, cores, maxWait=60, poll=5,
+                 statusTemplate='', timeout=0,
+                 heartbeatTimeout=HEARTBEAT_TIMEOUT):
+        self.path = path
+        self.submitTemplate = submitTemplate
+        self.cores = cores
+        self.maxWait = maxWait
+        self.poll = poll
+        self.statusTemplate = statusTemplate
+        self.timeout = timeout
+        self.heartbeatTimeout = heartbeatTimeout
+        self.pendingDir = os.path.join(path, 'pending')
+        if not os.path.exists(self.pendingDir):
+            os.makedirs(self.pendingDir)
+
+    def addJob(self, command, cwd, env, threads):
+        """ Add a pending job and return its id. """
+        jobId = '%s_%d_%s' % (socket.gethostname(), os.getpid(),
+                              uuid.uuid4().hex[:8])
+        job = {'id': jobId, 'command': command, 'cwd': os.path.abspath(cwd),
+               'env': dict(env), 'threads': threads, 'time': time.time()}
+        fn = os.path.join(self.pendingDir, jobId + '.json')
+        with open(fn + '.tmp', 'w') as f:
+            json.dump(job, f)
+        os.rename(fn + '.tmp', fn)
+        return jobId
+
+    def _getPendingJobs(self):
+        jobs = []
+        for fn in glob.glob(os.path.join(self.pendingDir, '*.json')):
+            try:
+                with open(fn) as f:
+                    jobs.append(json.load(f))
+            except (IOError, OSError, ValueError):  # moved meanwhile
+                pass
+        return jobs
+
+    def isReady(self, jobs):
+        """ Return True if the pending jobs should be submitted now. """
+        if not jobs:
+            return False
+        return (sum(job['threads'] for job in jobs) >= self.cores or
+                time.time() - min(job['time'] for job in jobs) >= self.maxWait)
+
+    def _acquireLock(self):
+        lockFile = os.path.join(self.path, 'submit.lock')
+        if (os.path.exists(lockFile) and
+                time.time() - os.path.getmtime(lockFile) > STALE_LOCK):
+            os.remove(lockFile)
+        try:
+            os.close(os.open(lockFile, os.O_CREAT | os.O_EXCL))
+            return lockFile
+        except OSError:
+            return None
+
+    def submit(self):
+        """ Submit all pending jobs as a new batch, unless other process is
+        already doing it. Return the batch folder or None. """
+        lockFile = self._acquireLock()
+        if lockFile is None:
+            return None
+        try:
+            self.cleanBatches()
+            jobs = self._getPendingJobs()
+            if not jobs:
+                return None
+            name = 'batch_%s_%s' % (time.strftime('%Y%m%d_%H%M%S'),
+                                    uuid.uuid4().hex[:4])
+            batchDir = os.path.join(self.path, name)
+            os.makedirs(batchDir)
+            for job in jobs:
+                os.rename(os.path.join(self.pendingDir, job['id'] + '.json'),
+                          os.path.join(batchDir, job['id'] + '.json'))
+            fnBatch = os.path.join(batchDir, 'batch.json')
+            with open(fnBatch, 'w') as f:
+                json.dump({'cores': self.cores, 'jobs': jobs}, f, indent=1)
+            script = os.path.join(batchDir, 'run_batch.sh')
+            runner = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'batch_runner.py')
+            with open(script, 'w') as f:
+                f.write("#!/bin/sh\n")
+                f.write("exec '%s' '%s' '%s' > '%s' 2>&1\n"
+                        % (sys.executable, runner, fnBatch,
+                           os.path.join(batchDir, 'batch.log')))
+            os.chmod(script, 0o755)
+            try:
+                subprocess.check_call(self.submitTemplate
+                                      % {'script': script, 'name': name,
+                                         'cores': self.cores},
+                                      shell=True, cwd=batchDir)
+            except Exception:
+                # Leave the jobs pending for the next submission
+                for job in jobs:
+                    os.rename(os.path.join(batchDir, job['id'] + '.json'),
+                              os.path.join(self.pendingDir,
+                                           job['id'] + '.json'))
+                raise
+            return batchDir
+        finally:
+            os.remove(lockFile)
+
+    def _isBatchFinished(self, batchDir):
+        """ Return True if all the jobs of the batch have an exit code. """
+        with open(os.path.join(batchDir, 'batch.json')) as f:
+            jobs = json.load(f)['jobs']
+        return all(os.path.exists(getExitFile(batchDir, job['id']))
+                   for job in jobs)
+
+    def cleanBatches(self):
+        """ Remove the folders of the batches that finished or died, and
+        have not changed for FINISHED_KEEP seconds. """
+        for batchDir in glob.glob(os.path.join(self.path, 'batch_*')):
+            try:
+                mtime = max([os.path.getmtime(batchDir)] +
+                            [os.path.getmtime(os.path.join(batchDir, fn))
+                             for fn in os.listdir(batchDir)])
+                if time.time() - mtime < FINISHED_KEEP:
+                    continue
+                finished = self._isBatchFinished(batchDir)
+            except (IOError, OSError, ValueError):  # incomplete batch
+                finished = True
+            if finished or not self.isBatchAlive(batchDir):
+                shutil.rmtree(batchDir, ignore_errors=True)
+
+    def cancelJob(self, jobId):
+        """ Remove the job if it is still pending, or tell its batch not to
+        run it (or to terminate it if already running). """
+        try:
+            os.remove(os.path.join(self.pendingDir, jobId + '.json'))
+            return
+        except OSError:  # submitted meanwhile
+            pass
+        batchDir = self.getBatchDir(jobId)
+        if batchDir is not None and self.getExitCode(jobId) is None:
+            open(getCancelFile(batchDir, jobId), 'w').close()
+
+    def getExitCode(self, jobId):
+        """ Return the exit code of a finished job or None. """
+        for fn in glob.glob(getExitFile(os.path.join(self.path, 'batch_*'),
+                                        jobId)):
+            with open(fn) as f:
+                return int(f.read())
+        return None
+
+    def getBatchDir(self, jobId):
+        """ Return the folder of the batch where the job was submitted, or
+        None if it is still pending. """
+        for fn in glob.glob(os.path.join(self.path, 'batch_*',
+                                         jobId + '.json')):
+            return os.path.dirname(fn)
+        return None
+
+    def isBatchAlive(self, batchDir):
+        """ Return False if the batch runner has stopped writing its
+        heartbeat or, before it starts, if the queue system does not have
+        the batch any more. """
+        fnHeartbeat = getHeartbeatFile(batchDir)
+        if os.path.exists(fnHeartbeat):
+            return (time.time() - os.path.getmtime(fnHeartbeat) <
+                    self.heartbeatTimeout)
+        if not self.statusTemplate:
+            return True
+        name = os.path.basename(batchDir)
+        return subprocess.call(self.statusTemplate % {'name': name},
+                               shell=True, cwd=batchDir) == 0
+
+    def waitJob(self, jobId):
+        """ Wait until the job has finished, submitting the pending jobs
+        when they are ready, and return its exit code. An exception is
+        raised if its batch dies or the job times out. The job is cancelled
+        when the wait fails or is interrupted, so no batch runs it for a
+        protocol that is not waiting. """
+        exitCode = None
+        try:
+            exitCode = self._waitJob(jobId)
+        finally:
+            if exitCode is None:
+                self.cancelJob(jobId)
+        return exitCode
+
+    def _waitJob(self, jobId):
+        start = time.time()
+        while True:
+            exitCode = self.getExitCode(jobId)
+            if exitCode is not None:
+                return exitCode
+            batchDir = self.getBatchDir(jobId)
+            if batchDir is None:
+                if self.isReady(self._getPendingJobs()):
+                    self.submit()
+            elif not self.isBatchAlive(batchDir):
+                # The exit code may have been written meanwhile
+                exitCode = self.getExitCode(jobId)
+                if exitCode is not None:
+                    return exitCode
+                raise Exception("Batch %s finished without running job %s, "
+                                "see %s" % (batchDir, jobId,
+                                            os.path.join(batchDir,
+                                                         'batch.log')))
+            if self.timeout and time.time() - start > self.timeout:
+                raise Exception("Batch job %s timed out after %d s"
+                                % (jobId, self.timeout))
+            time.sleep(self.poll)
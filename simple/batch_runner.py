@@ -0,0 +1,128 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Run the jobs of a batch written by simple.batch.BatchSpool inside a single
+allocation of a queue system. Jobs run concurrently as long as their
+threads fit in the cores of the batch, starting from the ones with more
+threads. The exit code of every job is written to <jobId>.exit next to
+the batch file, and a job is terminated when a STOP_FILE appears in its
+working folder or a <jobId>.cancel file next to the batch file (jobs
+cancelled before they start are not run). While it runs, the
+HEARTBEAT_FILE of the batch folder is touched on every poll so the
+waiting protocols know it is alive.
+The submitted script starts it by path on the compute node, outside the
+Scipion environment, so it does not import the plugin; simple.batch
+imports from here the names of the files they share.
+
+Usage: batch_runner.py batch.json
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import signal
+import subprocess
+
+
+STOP_FILE = '.stop_prime'
+HEARTBEAT_FILE = 'heartbeat'
+POLL_INTERVAL = 1
+
+
+def getExitFile(batchDir, jobId):
+    return os.path.join(batchDir, jobId + '.exit')
+
+
+def writeExitCode(batchDir, jobId, exitCode):
+    fn = getExitFile(batchDir, jobId)
+    with open(fn + '.tmp', 'w') as f:
+        f.write('%d\n' % exitCode)
+    os.rename(fn + '.tmp', fn)
+
+
+def getCancelFile(batchDir, jobId):
+    return os.path.join(batchDir, jobId + '.cancel')
+
+
+def getHeartbeatFile(batchDir):
+    return os.path.join(batchDir, HEARTBEAT_FILE)
+
+
+def touchHeartbeat(batchDir):
+    fn = getHeartbeatFile(batchDir)
+    with open(fn, 'a'):
+        os.utime(fn, None)
+
+
+def main(batchFile):
+    batchDir = os.path.dirname(os.path.abspath(batchFile))
+    with open(batchFile) as f:
+        batch = json.load(f)
+    cores = batch['cores']
+    pending = sorted(batch['jobs'], key=lambda job: -job['threads'])
+    running = []
+    free = cores
+
+    while pending or running:
+        touchHeartbeat(batchDir)
+        for job in list(pending):
+            if os.path.exists(getCancelFile(batchDir, job['id'])):
+                # Its protocol is not waiting for it any more
+                print("Cancelled %s" % job['id'])
+                writeExitCode(batchDir, job['id'], -1)
+                pending.remove(job)
+                continue
+            threads = max(1, min(job['threads'], cores))
+            if threads <= free:
+                print("Starting %s with %d threads" % (job['id'], threads))
+                proc = subprocess.Popen(job['command'], shell=True,
+                                        cwd=job['cwd'], env=job['env'],
+                                        preexec_fn=os.setsid)
+                running.append((proc, job, threads))
+                pending.remove(job)
+                free -= threads
+        time.sleep(POLL_INTERVAL)
+
+        for proc, job, threads in list(running):
+            if proc.poll() is None and (
+                    os.path.exists(os.path.join(job['cwd'], STOP_FILE)) or
+                    os.path.exists(getCancelFile(batchDir, job['id']))):
+                os.killpg(proc.pid, signal.SIGTERM)
+            exitCode = proc.poll()
+            if exitCode is not None:
+                print("Finished %s with exit code %d" % (job['id'], exitCode))
+                writeExitCode(batchDir, job['id'], exitCode)
+                running.remove((proc, job, threads))
+                free += threads
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
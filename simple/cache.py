@@ -0,0 +1,153 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+
+def hashItems(items):
+    """ Return a hex digest identifying the given sequence of items.
+    Items are hashed through their repr, so they should be simple values
+    (numbers, strings or tuples of them).
+    """
+    sha = hashlib.sha1()
+    for item in items:
+        sha.update(repr(item).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def linkFile(source, dest):
+    """ Hardlink source to dest, falling back to a copy when both paths
+    are not in the same filesystem, so dest is still there when source
+    is removed (e.g. evicted from the cache). """
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copyfile(source, dest)
+
+
+class StackCache(object):
+    """ Size-bounded cache of converted input stacks.
+
+    Entries are files named after a content key and living in a single
+    folder. The last access time is tracked through the file mtime, so the
+    least recently used entries are evicted first when the total size goes
+    over maxSize (in bytes). Hit/miss counters are kept in a json file.
+
+    Entries are copied in and out of the cache rather than linked, so
+    rewriting a fetched stack in place never changes the cached entry.
+    """
+    STATS_FILE = 'stats.json'
+    _statsLock = threading.Lock()
+
+    def __init__(self, path, maxSize, ext='.spi'):
+        self.path = path
+        self.maxSize = maxSize
+        self.ext = ext
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def _getEntry(self, key):
+        return os.path.join(self.path, key + self.ext)
+
+    def _getEntries(self):
+        """ Return a list of (mtime, size, path) of cached entries. """
+        entries = []
+        for fn in os.listdir(self.path):
+            if fn.endswith(self.ext):
+                entryPath = os.path.join(self.path, fn)
+                st = os.stat(entryPath)
+                entries.append((st.st_mtime, st.st_size, entryPath))
+        return entries
+
+    def getStats(self):
+        """ Return a dict with the hits, misses and evictions counters. """
+        statsFn = os.path.join(self.path, self.STATS_FILE)
+        stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        if os.path.exists(statsFn):
+            with open(statsFn) as f:
+                try:
+                    stats.update(json.load(f))
+                except ValueError:  # corrupted, start counting again
+                    pass
+        return stats
+
+    def _count(self, counter, n=1):
+        # Runs of the same project may fetch and store from several threads
+        with self._statsLock:
+            stats = self.getStats()
+            stats[counter] += n
+            statsFn = os.path.join(self.path, self.STATS_FILE)
+            with open(statsFn + '.tmp', 'w') as f:
+                json.dump(stats, f)
+            os.rename(statsFn + '.tmp', statsFn)
+
+    def getSize(self):
+        return sum(size for _, size, _ in self._getEntries())
+
+    def _copy(self, source, dest):
+        # Use a temporary name first so other readers never see
+        # a partially written file
+        tmp = '%s.%d.tmp' % (dest, os.getpid())
+        shutil.copyfile(source, tmp)
+        os.rename(tmp, dest)
+
+    def fetch(self, key, dest):
+        """ Copy the entry for key to dest. Return False on a cache miss. """
+        entry = self._getEntry(key)
+        if not os.path.exists(entry):
+            self._count('misses')
+            return False
+        os.utime(entry, None)  # mark as recently used
+        self._copy(entry, dest)
+        self._count('hits')
+        return True
+
+    def store(self, key, source):
+        """ Add source to the cache under key and evict old entries. """
+        entry = self._getEntry(key)
+        if os.path.getsize(source) > self.maxSize:
+            return
+        self._copy(source, entry)
+        self.evict()
+
+    def evict(self):
+        """ Remove least recently used entries until the cache fits. """
+        entries = sorted(self._getEntries())
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        while entries and total > self.maxSize:
+            _, size, entryPath = entries.pop(0)
+            os.remove(entryPath)
+            total -= size
+            evicted += 1
+        if evicted:
+            self._count('evictions', evicted)
@@ -26,3 +26,54 @@
 
 SIMPLE_PRIME = 'SIMPLE_PRIME'
 SIMPLE_HOME = 'SIMPLE_HOME'
+SIMPLE_CACHE = 'SIMPLE_CACHE'
+SIMPLE_CACHE_SIZE = 'SIMPLE_CACHE_SIZE'
+SIMPLE_MAX_MEMORY = 'SIMPLE_MAX_MEMORY'
+SIMPLE_MAX_DISK = 'SIMPLE_MAX_DISK'
+SIMPLE_BATCH_SUBMIT = 'SIMPLE_BATCH_SUBMIT'
+SIMPLE_BATCH_CORES = 'SIMPLE_BATCH_CORES'
+SIMPLE_BATCH_WAIT = 'SIMPLE_BATCH_WAIT'
+SIMPLE_BATCH_STATUS = 'SIMPLE_BATCH_STATUS'
+SIMPLE_BATCH_TIMEOUT = 'SIMPLE_BATCH_TIMEOUT'
+SIMPLE_WORKER_LAUNCH = 'SIMPLE_WORKER_LAUNCH'
+SIMPLE_WORKER_SCRATCH = 'SIMPLE_WORKER_SCRATCH'
+
+# Alignment document written by simple_prime at every iteration
+PRIME_ORITAB = 'prime3Ddoc_%d.txt'
+
+# Log written by every simple_prime run of an ensemble
+PRIME_LOG = 'prime.log'
+PRIME_METRICS = 'prime_metrics.jsonl'
+
+# Regular expressions to extract per-iteration metrics from the
+# simple_prime output
+PRIME_LOG_ITERATION = r'ITERATION\s*:?\s*(\d+)'
+PRIME_LOG_METRICS = {
+    'corr': r'CORRELATION\s*:?\s*([-+0-9.eE]+)',
+    'res': r'RESOLUTION[^:]*:\s*([-+0-9.eE]+)',
+}
+
+# Number of images used to time simple_prime when tuning the threads
+CALIBRATION_IMAGES = 20
+
+# Iterations assumed when estimating the cost of a simple_prime run
+ESTIMATED_ITERATIONS = 30
+# Fraction of the resource limits above which a warning is given
+RESOURCE_WARNING = 0.8
+
+SCREENING_BOX = 64
+SCREENING_FILE = 'screening.txt'
+
+# Formats of the output volumes
+OUTPUT_SPIDER = 0
+OUTPUT_MRC = 1
+
+# What to do with states that duplicate another one
+REDUNDANT_FLAG = 0
+REDUNDANT_REMOVE = 1
+REDUNDANT_MERGE = 2
+
+# Views of the volumes of every iteration, for the viewer
+PRIME_THUMBNAILS = 'thumbnails.dat'
+THUMBNAIL_SIZE = 128
+THUMBNAIL_MIN_SIZE = 16
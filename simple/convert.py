@@ -0,0 +1,495 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import math
+
+import numpy as np
+
+import pyworkflow.em as em
+
+
+def getDownsampledBox(box, samplingRate, lowPass):
+    """ Return the smallest even box size whose Nyquist frequency is
+    still compatible with the low-pass limit (in A) given to simple_prime.
+    The original box is returned if no reduction is possible.
+    """
+    newBox = int(math.ceil(box * samplingRate * 2.0 / lowPass))
+    newBox += newBox % 2
+    return min(box, max(newBox, 2))
+
+
+def fourierResize(data, newSize):
+    """ Crop or pad (depending on newSize) the Fourier transform of a
+    2D image or 3D volume so it becomes a cube/square of side newSize.
+    The values are rescaled to keep the mean density unchanged.
+    """
+    oldSize = data.shape[-1]
+    if newSize == oldSize:
+        return data.astype(np.float32)
+
+    ft = np.fft.fftshift(np.fft.fftn(data))
+    newShape = (newSize,) * data.ndim
+    newFt = np.zeros(newShape, dtype=ft.dtype)
+    size = min(oldSize, newSize)
+    src = tuple(slice(oldSize // 2 - size // 2, oldSize // 2 - size // 2 + size)
+                for _ in range(data.ndim))
+    dst = tuple(slice(newSize // 2 - size // 2, newSize // 2 - size // 2 + size)
+                for _ in range(data.ndim))
+    newFt[dst] = ft[src]
+
+    factor = (float(newSize) / oldSize) ** data.ndim
+    newData = np.fft.ifftn(np.fft.ifftshift(newFt)).real * factor
+    return newData.astype(np.float32)
+
+
+def cropOrPad(data, newSize):
+    """ Crop or zero pad, around the center, a 2D image or 3D volume in
+    real space so it becomes a square/cube of side newSize. """
+    oldSize = data.shape[-1]
+    newData = np.zeros((newSize,) * data.ndim, dtype=np.float32)
+    size = min(oldSize, newSize)
+    src = tuple(slice(oldSize // 2 - size // 2, oldSize // 2 - size // 2 + size)
+                for _ in range(data.ndim))
+    dst = tuple(slice(newSize // 2 - size // 2, newSize // 2 - size // 2 + size)
+                for _ in range(data.ndim))
+    newData[dst] = data[src]
+    return newData
+
+
+def resampleVolume(data, samplingRate, newSamplingRate, newBox):
+    """ Change the sampling rate of a volume by Fourier cropping/padding
+    and then its box size by cropping/padding in real space. """
+    size = int(round(data.shape[-1] * samplingRate / float(newSamplingRate)))
+    return cropOrPad(fourierResize(data, max(size, 2)), newBox)
+
+
+def readImageData(location):
+    """ Read the image at location ((index, filename) or filename)
+    and return its data as a numpy array. """
+    return em.ImageHandler().read(location).getData()
+
+
+def resizeVolume(inputFn, outputFn, newSize):
+    """ Fourier crop/pad a SPIDER volume file into outputFn. """
+    writeSpiderVolume(outputFn, fourierResize(memmapVolume(inputFn), newSize))
+
+
+def scaleOritab(inputFn, outputFn, scale, keys=('x', 'y')):
+    """ Copy a simple_prime alignment doc (key=value pairs per line),
+    scaling the values of the given keys (shifts in pixels). """
+    with open(inputFn) as fIn:
+        with open(outputFn, 'w') as fOut:
+            for line in fIn:
+                tokens = []
+                for token in line.split():
+                    key, sep, value = token.partition('=')
+                    if sep and key in keys:
+                        token = '%s=%f' % (key, float(value) * scale)
+                    tokens.append(token)
+                fOut.write(' '.join(tokens) + '\n')
+
+
+# --------------------------- SPIDER / MRC raw access -------------------------
+SPIDER_EXTENSIONS = ['.spi', '.stk', '.vol', '.xmp']
+MRC_EXTENSIONS = ['.mrc', '.mrcs', '.st', '.ali', '.map']
+
+MRC_DTYPES = {0: 'i1', 1: 'i2', 2: 'f4', 6: 'u2', 12: 'f2'}
+
+# Number of bytes copied at once when transferring whole blocks of images
+BLOCK_BYTES = 8 * 1024 * 1024
+
+
+def _getExtension(filename):
+    return os.path.splitext(filename.split(':')[0])[1].lower()
+
+
+def readSpiderHeader(filename):
+    """ Read the main fields of a SPIDER header from its first record.
+    Return None if the file does not look like a valid SPIDER file.
+    """
+    with open(filename, 'rb') as f:
+        buf = f.read(1024)
+    if len(buf) < 1024:
+        return None
+
+    for byteOrder in ['<', '>']:
+        h = np.frombuffer(buf, dtype=byteOrder + 'f4')
+        nz, ny, iform, nx = h[0], h[1], h[4], h[11]
+        labrec, labbyt, lenbyt = h[12], h[21], h[22]
+        if (iform in (1, 3) and nx >= 1 and ny >= 1 and nz >= 1
+                and lenbyt == nx * 4 and labbyt == labrec * lenbyt):
+            return {'nx': int(nx), 'ny': int(ny), 'nz': int(nz),
+                    'iform': int(iform), 'labbyt': int(labbyt),
+                    'istack': int(h[23]), 'maxim': int(h[25]),
+                    'imgnum': int(h[26]), 'byteOrder': byteOrder,
+                    'dtype': byteOrder + 'f4'}
+    return None
+
+
+def readMrcHeader(filename):
+    """ Read dimensions, data type and data offset of an MRC file.
+    Return None if the file does not look like a valid MRC file.
+    """
+    with open(filename, 'rb') as f:
+        buf = f.read(1024)
+    if len(buf) < 1024:
+        return None
+
+    # Machine stamp 0x11 means big endian, any other value little endian
+    byteOrder = '>' if buf[212:213] == b'\x11' else '<'
+    h = np.frombuffer(buf, dtype=byteOrder + 'i4')
+    nx, ny, nz, mode = h[0], h[1], h[2], h[3]
+    if mode not in MRC_DTYPES or min(nx, ny, nz) < 1:
+        return None
+    return {'nx': int(nx), 'ny': int(ny), 'nz': int(nz),
+            'dtype': byteOrder + MRC_DTYPES[mode],
+            'offset': 1024 + int(h[23])}
+
+
+def getSpiderFileSize(header):
+    """ Return the expected size in bytes of a SPIDER file given its
+    header as returned by readSpiderHeader. """
+    imgBytes = header['nx'] * header['ny'] * header['nz'] * 4
+    if header['istack'] > 0:
+        return header['labbyt'] + header['maxim'] * (header['labbyt'] + imgBytes)
+    return header['labbyt'] + imgBytes
+
+
+def isCompleteSpiderFile(filename):
+    """ Return True if filename is a SPIDER file whose size matches the
+    one declared in its header, i.e. it was not truncated. """
+    if not os.path.exists(filename):
+        return False
+    header = readSpiderHeader(filename)
+    return (header is not None and
+            os.path.getsize(filename) == getSpiderFileSize(header))
+
+
+def getSpiderVolumeDim(filename):
+    """ Return the (x, y, z) dimensions of a SPIDER volume reading only
+    its header. An exception is raised if the file is not a SPIDER volume
+    or it is truncated. """
+    header = readSpiderHeader(filename) if os.path.exists(filename) else None
+    if header is None or header['istack'] > 0:
+        raise Exception("%s is not a SPIDER volume" % filename)
+    if os.path.getsize(filename) != getSpiderFileSize(header):
+        raise Exception("%s is incomplete: expected %d bytes"
+                        % (filename, getSpiderFileSize(header)))
+    return header['nx'], header['ny'], header['nz']
+
+
+def memmapStack(filename):
+    """ Return a read-only (n, ny, nx) memory mapped view of the images
+    stored in a SPIDER or MRC stack, or None if the file cannot be mapped.
+    """
+    filename = filename.split(':')[0]
+    ext = _getExtension(filename)
+
+    if ext in SPIDER_EXTENSIONS:
+        h = readSpiderHeader(filename)
+        if h is None or h['nz'] != 1:
+            return None
+        hdrWords = h['labbyt'] // 4
+        imgWords = h['nx'] * h['ny']
+        if h['istack'] > 0:
+            n = h['maxim']
+            records = np.memmap(filename, dtype=h['byteOrder'] + 'f4',
+                                mode='r', offset=h['labbyt'],
+                                shape=(n, hdrWords + imgWords))
+            return records[:, hdrWords:].reshape(n, h['ny'], h['nx'])
+        return np.memmap(filename, dtype=h['byteOrder'] + 'f4', mode='r',
+                         offset=h['labbyt'], shape=(1, h['ny'], h['nx']))
+
+    if ext in MRC_EXTENSIONS:
+        h = readMrcHeader(filename)
+        if h is None:
+            return None
+        return np.memmap(filename, dtype=h['dtype'], mode='r',
+                         offset=h['offset'], shape=(h['nz'], h['ny'], h['nx']))
+
+    return None
+
+
+def getMrcFileSize(header):
+    """ Return the expected size in bytes of an MRC file given its header
+    as returned by readMrcHeader. """
+    return (header['offset'] + header['nx'] * header['ny'] * header['nz'] *
+            np.dtype(header['dtype']).itemsize)
+
+
+def getVolumeDim(filename):
+    """ Return the (x, y, z) dimensions of a SPIDER or MRC volume reading
+    only its header. An exception is raised if the file is not a volume
+    or it is truncated. """
+    if _getExtension(filename) not in MRC_EXTENSIONS:
+        return getSpiderVolumeDim(filename)
+    header = readMrcHeader(filename) if os.path.exists(filename) else None
+    if header is None:
+        raise Exception("%s is not an MRC volume" % filename)
+    if os.path.getsize(filename) != getMrcFileSize(header):
+        raise Exception("%s is incomplete: expected %d bytes"
+                        % (filename, getMrcFileSize(header)))
+    return header['nx'], header['ny'], header['nz']
+
+
+def memmapVolume(filename):
+    """ Return a read-only (nz, ny, nx) memory mapped view of the data of
+    a SPIDER or MRC volume (or a single image). """
+    if _getExtension(filename) in MRC_EXTENSIONS:
+        return memmapStack(filename)
+    h = readSpiderHeader(filename)
+    if h is None or h['istack'] > 0:
+        raise Exception("%s is not a SPIDER volume" % filename)
+    return np.memmap(filename, dtype=h['byteOrder'] + 'f4', mode='r',
+                     offset=h['labbyt'], shape=(h['nz'], h['ny'], h['nx']))
+
+
+def _createSpiderHeader(nx, ny, nz, iform, labbyt):
+    header = np.zeros(labbyt // 4, dtype='<f4')
+    header[0] = nz
+    header[1] = ny
+    header[4] = iform
+    header[11] = nx
+    header[12] = labbyt // (nx * 4)  # labrec
+    header[20] = 1  # scale
+    header[21] = labbyt
+    header[22] = nx * 4  # lenbyt
+    return header
+
+
+def getSpiderHeaderBytes(nx):
+    """ Return the header size of a SPIDER file with nx columns. """
+    lenbyt = nx * 4
+    labrec = int(math.ceil(1024.0 / lenbyt))
+    return labrec * lenbyt
+
+
+def writeSpiderVolume(filename, data):
+    """ Write a 3D numpy array as a SPIDER volume. """
+    nz, ny, nx = data.shape
+    labbyt = getSpiderHeaderBytes(nx)
+    with open(filename, 'wb') as f:
+        f.write(_createSpiderHeader(nx, ny, nz, 3, labbyt).tobytes())
+        f.write(np.ascontiguousarray(data, dtype='<f4').tobytes())
+
+
+class SpiderStackWriter(object):
+    """ Write a SPIDER stack of n images through a memory map.
+
+    The whole file (main header plus one header and data block per image)
+    is allocated on creation, so images can be written in any order with
+    plain numpy assignments, which also take care of the conversion of
+    the data type and byte order of the source.
+    """
+    def __init__(self, filename, n, nx, ny=None):
+        ny = ny or nx
+        self.n = n
+        labbyt = getSpiderHeaderBytes(nx)
+        hdrWords = labbyt // 4
+        imgWords = nx * ny
+
+        with open(filename, 'wb') as f:
+            f.truncate(labbyt + n * (labbyt + imgWords * 4))
+        self._mm = np.memmap(filename, dtype='<f4', mode='r+')
+
+        header = _createSpiderHeader(nx, ny, 1, 1, labbyt)
+        header[23] = 2  # istack
+        header[25] = n  # maxim
+        self._mm[:hdrWords] = header
+
+        records = self._mm[hdrWords:].reshape(n, hdrWords + imgWords)
+        header[23] = 0
+        header[25] = 0
+        records[:, :hdrWords] = header
+        records[:, 26] = np.arange(1, n + 1)  # imgnum
+        self._data = records[:, hdrWords:].reshape(n, ny, nx)
+
+    def write(self, i, data):
+        """ Write data as image i (starting at 1). """
+        self._data[i - 1] = data
+
+    def copyBlock(self, i, stack):
+        """ Copy all images from an (m, ny, nx) array (or memory mapped
+        stack) starting at image i, in blocks of bounded size. """
+        m = len(stack)
+        step = max(1, BLOCK_BYTES // (self._data[0].size * 4))
+        for first in range(0, m, step):
+            last = min(m, first + step)
+            self._data[i - 1 + first:i - 1 + last] = stack[first:last]
+
+    def close(self):
+        self._mm.flush()
+        del self._data
+        del self._mm
+
+
+class MrcWriter(object):
+    """ Write an MRC file (float32, little endian) of n sections through
+    a memory map, either an image stack or the z slices of a volume.
+
+    Sections can be written in any order. Density statistics are
+    accumulated as they are written, so the header is completed on close
+    without reading the data again.
+    """
+    def __init__(self, filename, n, nx, ny=None, samplingRate=1.0,
+                 volume=False):
+        ny = ny or nx
+        self.filename = filename
+        self.shape = (n, ny, nx)
+        self.samplingRate = samplingRate
+        self.volume = volume
+        with open(filename, 'wb') as f:
+            f.truncate(1024 + n * ny * nx * 4)
+        self._data = np.memmap(filename, dtype='<f4', mode='r+',
+                               offset=1024, shape=self.shape)
+        self._min, self._max = np.inf, -np.inf
+        self._sum = self._sum2 = 0.
+
+    def _accumulate(self, data):
+        self._min = min(self._min, float(data.min()))
+        self._max = max(self._max, float(data.max()))
+        self._sum += float(data.sum(dtype=np.float64))
+        self._sum2 += float(np.square(data, dtype=np.float64).sum())
+
+    def write(self, i, data):
+        """ Write data as section i (starting at 1). """
+        self._data[i - 1] = data
+        self._accumulate(self._data[i - 1])
+
+    def copyBlock(self, i, stack):
+        """ Copy all sections from an (m, ny, nx) array (or memory mapped
+        stack) starting at section i, in blocks of bounded size. """
+        m = len(stack)
+        step = max(1, BLOCK_BYTES // (self._data[0].size * 4))
+        for first in range(0, m, step):
+            last = min(m, first + step)
+            block = self._data[i - 1 + first:i - 1 + last]
+            block[:] = stack[first:last]
+            self._accumulate(block)
+
+    def _createHeader(self):
+        n, ny, nx = self.shape
+        mz = n if self.volume else 1
+        header = np.zeros(256, dtype='<i4')
+        floats = header.view('<f4')
+        header[0:4] = [nx, ny, n, 2]  # mode 2: float32
+        header[7:10] = [nx, ny, mz]
+        floats[10:13] = [nx * self.samplingRate, ny * self.samplingRate,
+                         mz * self.samplingRate]
+        floats[13:16] = 90
+        header[16:19] = [1, 2, 3]  # columns, rows and sections axes
+        count = float(n * ny * nx)
+        mean = self._sum / count
+        floats[19:22] = [self._min, self._max, mean]
+        header[22] = 1 if self.volume else 0  # space group
+        header[27] = 20140  # format version
+        floats[54] = np.sqrt(max(self._sum2 / count - mean ** 2, 0))
+        header[55] = 1  # number of labels
+        raw = bytearray(header.tobytes())
+        raw[208:212] = b'MAP '
+        raw[212:216] = b'\x44\x44\x00\x00'  # little endian stamp
+        label = b'scipion-em-simple'
+        raw[224:224 + len(label)] = label
+        return bytes(raw)
+
+    def close(self):
+        self._data.flush()
+        del self._data
+        with open(self.filename, 'r+b') as f:
+            f.write(self._createHeader())
+
+
+def writeMrcVolume(filename, data, samplingRate):
+    """ Write a 3D array (or memory mapped volume) as an MRC volume, by
+    blocks of z slices. """
+    nz, ny, nx = data.shape
+    writer = MrcWriter(filename, nz, nx, ny, samplingRate, volume=True)
+    writer.copyBlock(1, data)
+    writer.close()
+
+
+def convertVolumeToMrc(inputFn, outputFn, samplingRate, box=None):
+    """ Write the volume in inputFn as an MRC volume in a single pass,
+    Fourier resizing it to box when given. """
+    data = memmapVolume(inputFn)
+    if box and box != data.shape[-1]:
+        data = fourierResize(data, box)
+    writeMrcVolume(outputFn, data, samplingRate)
+
+
+def _createStackWriter(filename, n, box, samplingRate):
+    if _getExtension(filename) in MRC_EXTENSIONS:
+        return MrcWriter(filename, n, box, samplingRate=samplingRate)
+    return SpiderStackWriter(filename, n, box)
+
+
+def writeStack(filename, locations, box=None, samplingRate=1.0):
+    """ Write the images at the given locations ((index, filename) tuples)
+    into a new SPIDER or MRC stack (depending on the extension of
+    filename), Fourier resizing them to box if needed.
+
+    Images are memory mapped from SPIDER and MRC sources and read through
+    the image library otherwise, so only one image needs to be in memory.
+    When all images come in order from a single mappable stack and no
+    resizing is needed, they are copied in blocks.
+    """
+    stacks = {}
+
+    def _getImage(index, fn):
+        if fn not in stacks:
+            stacks[fn] = memmapStack(fn)
+        stack = stacks[fn]
+        if stack is None:
+            return readImageData((index, fn))
+        return stack[max(index, 1) - 1]
+
+    firstImage = _getImage(*locations[0])
+    ny, nx = firstImage.shape[-2:]
+    box = box or nx
+    writer = _createStackWriter(filename, len(locations), box, samplingRate)
+
+    fn0 = locations[0][1]
+    indexes = [index for index, _ in locations]
+    firstIndex = max(indexes[0], 1)
+    if (box == nx and stacks.get(fn0) is not None
+            and all(fn == fn0 for _, fn in locations)
+            and indexes == list(range(firstIndex, firstIndex + len(indexes)))):
+        stack = stacks[fn0]
+        writer.copyBlock(1, stack[firstIndex - 1:firstIndex - 1 + len(indexes)])
+    else:
+        for i, (index, fn) in enumerate(locations):
+            data = _getImage(index, fn)
+            if box != nx:
+                data = fourierResize(data, box)
+            writer.write(i + 1, data)
+    writer.close()
+
+
+def writeSpiderStack(filename, locations, box=None):
+    """ Write the images at the given locations into a new SPIDER stack,
+    see writeStack. """
+    writeStack(filename, locations, box)
@@ -0,0 +1,172 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import json
+
+from simple.tuning import estimatePrimeCost
+
+
+SPIDER_HEADER_BYTES = 1024
+
+# Default coefficients of the model, refined by calibration:
+#   memoryBase: bytes used by simple_prime regardless of the input
+#   memoryVoxel: bytes per voxel of every state volume (padded Fourier
+#       volumes and reconstruction weights)
+#   memoryThread: bytes per image pixel for the buffers of every thread
+#   cpuSeconds: CPU seconds per unit of estimatePrimeCost, image and
+#       shift tried
+#   compression: size ratio of gzipped volumes
+DEFAULT_COEFFICIENTS = {
+    'memoryBase': 200 * 1024 ** 2,
+    'memoryVoxel': 64,
+    'memoryThread': 256,
+    'cpuSeconds': 2e-9,
+    'compression': 0.9,
+}
+
+# Weight given to a new measurement when calibrating
+CALIBRATION_WEIGHT = 0.5
+
+
+def getVolumeBytes(box):
+    return SPIDER_HEADER_BYTES + 4 * box ** 3
+
+
+def getStackBytes(box, nimages):
+    return SPIDER_HEADER_BYTES + nimages * (SPIDER_HEADER_BYTES + 4 * box ** 2)
+
+
+class CostModel(object):
+    """ Predict the peak memory, peak disk and CPU hours of simple_prime
+    from the run settings. They are given as a dict with:
+        box, samplingRate, lowPass, symmetryGroup, nimages, nstates,
+        maximumShift, shiftStep, threads (per run), runs, concurrent (runs
+        at the same time), iterations, keepAll, keepIterations, maxBytes
+        (0 for no limit) and compress.
+    The memory and CPU coefficients are corrected with the values measured
+    in previous runs, kept in a json file.
+    """
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.coefficients = dict(DEFAULT_COEFFICIENTS)
+        if filename and os.path.exists(filename):
+            with open(filename) as f:
+                try:
+                    self.coefficients.update(json.load(f))
+                except ValueError:  # corrupted, use the defaults
+                    pass
+
+    def estimateMemory(self, p):
+        """ Return the peak memory in bytes of the concurrent runs. """
+        c = self.coefficients
+        box = p['box']
+        perRun = (c['memoryBase'] + getStackBytes(box, p['nimages']) +
+                  c['memoryVoxel'] * p['nstates'] * box ** 3 +
+                  c['memoryThread'] * p['threads'] * box ** 2)
+        return int(perRun * p['concurrent'])
+
+    def estimateDisk(self, p):
+        """ Return the peak disk in bytes used by the input stack and the
+        volumes and alignment docs written along the iterations. """
+        c = self.coefficients
+        box, iterations = p['box'], p['iterations']
+        iterBytes = (p['nstates'] * getVolumeBytes(box) +
+                     p['nimages'] * 200)  # alignment doc line
+        if p['keepAll'] and p['compress']:
+            volumes = iterBytes * (1 + (iterations - 1) * c['compression'])
+        elif not p['keepAll'] and p['keepIterations'] > 0:
+            volumes = iterBytes * min(iterations, p['keepIterations'])
+        else:
+            volumes = iterBytes * iterations
+        if not p['keepAll'] and p['maxBytes'] > 0:
+            volumes = min(volumes, p['maxBytes'] + iterBytes)
+        startBytes = p['nstates'] * getVolumeBytes(box)
+        return int(getStackBytes(box, p['nimages']) +
+                   p['runs'] * (volumes + startBytes))
+
+    def estimateCpuHours(self, p):
+        shifts = 1
+        if p['maximumShift'] > 0:
+            shifts = (2 * p['maximumShift'] // max(p['shiftStep'], 1) + 1) ** 2
+        cost = estimatePrimeCost(p['box'], p['samplingRate'], p['lowPass'],
+                                 p['nstates'], p['symmetryGroup'])
+        seconds = (self.coefficients['cpuSeconds'] * cost * p['nimages'] *
+                   shifts * p['iterations'] * p['runs'])
+        return seconds / 3600.
+
+    def estimate(self, p):
+        """ Return a dict with the predicted memory and disk (in bytes)
+        and CPU hours. """
+        return {'memory': self.estimateMemory(p),
+                'disk': self.estimateDisk(p),
+                'cpuHours': self.estimateCpuHours(p)}
+
+    def calibrate(self, p, memory=None, cpuHours=None):
+        """ Correct the model with the peak memory (bytes) and CPU hours
+        measured for a run with settings p, and save it. """
+        c = self.coefficients
+        if memory:
+            # The input dependent terms absorb the correction
+            fixed = c['memoryBase']
+            predicted = self.estimateMemory(p) - fixed * p['concurrent']
+            measured = memory - fixed * p['concurrent']
+            if predicted > 0 and measured > 0:
+                factor = self._smooth(float(measured) / predicted)
+                c['memoryVoxel'] *= factor
+                c['memoryThread'] *= factor
+        if cpuHours:
+            predicted = self.estimateCpuHours(p)
+            if predicted > 0:
+                c['cpuSeconds'] *= self._smooth(cpuHours / predicted)
+        self._save()
+
+    def _smooth(self, ratio):
+        return (1 - CALIBRATION_WEIGHT) + CALIBRATION_WEIGHT * ratio
+
+    def _save(self):
+        if not self.filename:
+            return
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tmp = '%s.%d.tmp' % (self.filename, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(self.coefficients, f, indent=1, sort_keys=True)
+        os.rename(tmp, self.filename)
+
+    def suggestBox(self, p, maxMemory, maxDisk):
+        """ Return the largest even box smaller than p['box'] whose
+        predicted memory and disk fit in the limits (0 for no limit),
+        or None if there is none. """
+        box = p['box'] - 2 + p['box'] % 2
+        while box >= 16:
+            q = dict(p, box=box)
+            if ((not maxMemory or self.estimateMemory(q) <= maxMemory) and
+                    (not maxDisk or self.estimateDisk(q) <= maxDisk)):
+                return box
+            box -= 2
+        return None
@@ -0,0 +1,289 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import sys
+import time
+import uuid
+import socket
+import threading
+import subprocess
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+from simple.batch_runner import STOP_FILE
+from simple.distributed_worker import BLOCK_BYTES, readMessage, sendMessage
+
+
+# Seconds a worker waits before asking again for a task
+WAIT_DELAY = 1
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class Coordinator(object):
+    """ Queue of simple_prime tasks served through a TCP socket to the
+    workers (distributed_worker.py) running on every node.
+
+    Workers authenticate with the token written to tokenFile, pull tasks
+    while they are idle and stream back the files written by every task
+    into its run folder, so the protocol follows the iterations as if
+    simple_prime ran locally. A task is stopped when a STOP_FILE appears
+    in its run folder, and it is given to other worker if the one running
+    it is lost (up to maxAttempts times). The activity of every node is
+    recorded to report its throughput.
+    """
+    def __init__(self, tokenFile, host='', port=0, maxAttempts=2):
+        self.maxAttempts = maxAttempts
+        self._token = uuid.uuid4().hex
+        fd = os.open(tokenFile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(self._token)
+        self._condition = threading.Condition()
+        self._tasks = {}
+        self._pending = []
+        self._closing = False
+        self._workers = 0
+        self.nodes = {}
+
+        coordinator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                coordinator._serveWorker(self.rfile, self.wfile)
+
+        self._server = _Server((host, port), Handler)
+        self.address = '%s:%d' % (host or socket.gethostname(),
+                                  self._server.server_address[1])
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def addTask(self, program, args, runDir, stack, stackKey, env,
+                inputs=(), appendFiles=(), appendBase=0):
+        """ Queue the execution of program with args in runDir and return
+        the task id. The stack (stk= argument) is staged by key on every
+        node, the inputs ((path, name) pairs) are copied with the task,
+        and the appendFiles grow from appendBase bytes in runDir. """
+        taskId = uuid.uuid4().hex[:12]
+        task = {'id': taskId, 'program': program, 'args': args,
+                'runDir': os.path.abspath(runDir),
+                'stack': os.path.abspath(stack), 'stackKey': stackKey,
+                'env': dict(env), 'inputs': list(inputs),
+                'appendFiles': list(appendFiles)}
+        with self._condition:
+            self._tasks[taskId] = {'task': task, 'attempts': 0,
+                                   'exitCode': None, 'node': None,
+                                   'appendBase': appendBase}
+            self._pending.append(taskId)
+        return taskId
+
+    def waitTask(self, taskId, timeout=None):
+        """ Wait until the task has finished and return its exit code, or
+        None if it is still running after timeout seconds. """
+        end = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._tasks[taskId]['exitCode'] is None:
+                if end is not None and time.time() >= end:
+                    return None
+                self._condition.wait(WAIT_DELAY)
+            return self._tasks[taskId]['exitCode']
+
+    def close(self, timeout=30):
+        """ Tell the workers to exit when they ask for more work, wait for
+        them up to timeout seconds and stop serving. """
+        with self._condition:
+            self._closing = True
+            end = time.time() + timeout
+            while self._workers and time.time() < end:
+                self._condition.wait(WAIT_DELAY)
+        self._server.shutdown()
+        self._server.server_close()
+
+    def getNodeStats(self):
+        """ Return a dict with the activity of every node: workers, tasks,
+        volumes received, busy seconds (running tasks), bytes received,
+        stacks staged and seconds spent staging them. """
+        with self._condition:
+            return dict((node, dict(stats))
+                        for node, stats in self.nodes.items())
+
+    def _getNodeStats(self, node):
+        if node not in self.nodes:
+            self.nodes[node] = {'workers': 0, 'tasks': 0, 'volumes': 0,
+                                'busy': 0., 'bytes': 0, 'staged': 0,
+                                'stageTime': 0.}
+        return self.nodes[node]
+
+    def _serveWorker(self, rfile, wfile):
+        try:
+            hello = readMessage(rfile)
+        except (EOFError, ValueError):
+            return
+        if hello.get('token') != self._token:
+            sendMessage(wfile, {'ok': False})
+            return
+        node = hello['node']
+        with self._condition:
+            self._workers += 1
+            self._getNodeStats(node)['workers'] += 1
+        sendMessage(wfile, {'ok': True})
+
+        current = None
+        try:
+            while True:
+                message = readMessage(rfile)
+                op = message['op']
+                if op == 'get':
+                    reply = self._nextTask(node)
+                    if reply['op'] == 'task':
+                        current = reply['task']['id']
+                elif op == 'file':
+                    self._receiveFile(rfile, message, node)
+                    reply = {'ok': True}
+                elif op == 'status':
+                    runDir = self._tasks[message['task']]['task']['runDir']
+                    reply = {'stop': os.path.exists(os.path.join(runDir,
+                                                                 STOP_FILE))}
+                elif op == 'done':
+                    keepStage = self._finishTask(message, node)
+                    current = None
+                    reply = {'ok': True, 'keepStage': keepStage}
+                else:
+                    raise ValueError("Unknown message: %s" % op)
+                sendMessage(wfile, reply)
+                if reply.get('op') == 'exit':
+                    break
+        except (EOFError, ValueError, IOError, socket.error):
+            pass
+        finally:
+            with self._condition:
+                self._workers -= 1
+                if current is not None:
+                    self._retryTask(current)
+                self._condition.notify_all()
+
+    def _nextTask(self, node):
+        with self._condition:
+            if self._pending:
+                taskId = self._pending.pop(0)
+                entry = self._tasks[taskId]
+                entry['attempts'] += 1
+                entry['node'] = node
+                entry['start'] = time.time()
+                return {'op': 'task', 'task': entry['task']}
+            if self._closing:
+                return {'op': 'exit'}
+        return {'op': 'wait', 'delay': WAIT_DELAY}
+
+    def _retryTask(self, taskId):
+        """ Queue again a task whose worker was lost, or fail it. """
+        entry = self._tasks[taskId]
+        if entry['attempts'] < self.maxAttempts:
+            self._pending.insert(0, taskId)
+        else:
+            entry['exitCode'] = -1
+
+    def _finishTask(self, message, node):
+        """ Record the end of a task and return whether other tasks queued
+        or running use its stack, so the node should keep it staged. """
+        with self._condition:
+            entry = self._tasks[message['task']]
+            entry['exitCode'] = message['exitCode']
+            stats = self._getNodeStats(node)
+            stats['tasks'] += 1
+            stats['busy'] += time.time() - entry['start']
+            stats['staged'] += int(message['staged'])
+            stats['stageTime'] += message['stageTime']
+            self._condition.notify_all()
+            stackKey = entry['task']['stackKey']
+            return any(e['task']['stackKey'] == stackKey and
+                       e['exitCode'] is None for e in self._tasks.values())
+
+    def _receiveFile(self, rfile, message, node):
+        entry = self._tasks[message['task']]
+        task = entry['task']
+        name = message['name']
+        if name != os.path.basename(name) or name.startswith('.'):
+            raise ValueError("Invalid file name: %s" % name)
+        fn = os.path.join(task['runDir'], name)
+        if name in task['appendFiles']:
+            offset = entry['appendBase'] + message['offset']
+            f = open(fn, 'r+b' if os.path.exists(fn) else 'wb')
+            f.seek(offset)
+        else:
+            # Written aside and renamed, so it is never seen incomplete
+            f = open(fn + '.part', 'wb')
+        with f:
+            remaining = message['size']
+            while remaining > 0:
+                block = rfile.read(min(BLOCK_BYTES, remaining))
+                if not block:
+                    raise EOFError("Connection closed")
+                f.write(block)
+                remaining -= len(block)
+            f.truncate()
+        if name not in task['appendFiles']:
+            os.rename(fn + '.part', fn)
+        with self._condition:
+            stats = self._getNodeStats(node)
+            stats['bytes'] += message['size']
+            if name.startswith('recvol_'):
+                stats['volumes'] += 1
+
+
+def launchWorkers(address, tokenFile, workers, launchTemplate='',
+                  scratchDir='', logFile=None, env=None):
+    """ Start the workers connecting to the coordinator at address. With
+    launchTemplate (e.g. 'mpirun -np %(workers)d --map-by ppr:1:node
+    %(command)s') a single launcher starts them on the nodes; otherwise
+    they are started here as local processes. Return the processes. """
+    worker = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'distributed_worker.py')
+    command = "'%s' '%s' %s '%s'" % (sys.executable, worker, address,
+                                     tokenFile)
+    if scratchDir:
+        command += " '%s'" % scratchDir
+    output = open(logFile, 'a') if logFile else None
+    try:
+        if launchTemplate:
+            commands = [launchTemplate % {'command': command,
+                                          'workers': workers}]
+        else:
+            commands = [command] * workers
+        return [subprocess.Popen(cmd, shell=True, env=env, stdout=output,
+                                 stderr=subprocess.STDOUT if output else None)
+                for cmd in commands]
+    finally:
+        if output is not None:
+            output.close()
@@ -0,0 +1,266 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Worker of a distributed simple_prime execution coordinated by
+simple.distributed.Coordinator. It connects to the coordinator, pulls
+tasks and runs them one at a time in a folder of the local scratch. The
+input stack of a task is staged in the scratch once per node, shared by
+all the workers of the node and removed when no other task needs it. The
+files written by simple_prime are streamed back to the coordinator as
+they are completed, and the task is terminated when the coordinator asks
+to stop it.
+launchWorkers starts it by path, possibly through mpirun on nodes without
+Scipion, so it only relies on the python given in the command line: the
+messages exchanged with the coordinator are defined here and imported by
+simple.distributed.
+
+Usage: distributed_worker.py host:port tokenFile [scratchDir]
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import glob
+import errno
+import sys
+import json
+import time
+import shutil
+import signal
+import socket
+import tempfile
+import subprocess
+
+
+POLL_INTERVAL = 1
+BLOCK_BYTES = 8 * 1024 * 1024
+# Staging locks older than this (in seconds) were left by a dead worker
+STALE_LOCK = 3600
+
+
+def sendMessage(f, message, filename=None, offset=0):
+    """ Send a json message, followed by message['size'] bytes of filename
+    from offset when given. """
+    f.write(json.dumps(message).encode('utf-8') + b'\n')
+    if filename is not None:
+        remaining = message['size']
+        with open(filename, 'rb') as fIn:
+            fIn.seek(offset)
+            while remaining > 0:
+                block = fIn.read(min(BLOCK_BYTES, remaining))
+                if not block:
+                    raise IOError("%s was truncated while sent" % filename)
+                f.write(block)
+                remaining -= len(block)
+    f.flush()
+
+
+def readMessage(f):
+    line = f.readline()
+    if not line:
+        raise EOFError("Connection closed")
+    return json.loads(line.decode('utf-8'))
+
+
+def _lock(lockFile):
+    """ Take the lock of a staged file, waiting while other worker of the
+    node holds it. """
+    while True:
+        try:
+            os.close(os.open(lockFile, os.O_CREAT | os.O_EXCL))
+            return
+        except OSError:
+            try:
+                if time.time() - os.path.getmtime(lockFile) > STALE_LOCK:
+                    os.remove(lockFile)
+            except OSError:  # released meanwhile
+                pass
+            time.sleep(POLL_INTERVAL)
+
+
+def _getUsers(dest):
+    """ Return the pids of the live workers using the staged file dest,
+    removing the references left by dead ones. """
+    pids = []
+    for fnRef in glob.glob(dest + '.*.ref'):
+        pid = int(fnRef.rsplit('.', 2)[1])
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            if e.errno != errno.EPERM:
+                os.remove(fnRef)
+                continue
+        pids.append(pid)
+    return pids
+
+
+def stageFile(source, scratchDir, key):
+    """ Copy source into scratchDir unless other worker of the node did it
+    before (the ones arriving meanwhile wait for it), and use it until
+    releaseStage. Return the local path and whether it was copied now. """
+    dest = os.path.join(scratchDir, 'stage_%s%s'
+                        % (key, os.path.splitext(source)[1]))
+    lockFile = dest + '.lock'
+    _lock(lockFile)
+    try:
+        open('%s.%d.ref' % (dest, os.getpid()), 'w').close()
+        if os.path.exists(dest):
+            return dest, False
+        shutil.copyfile(source, dest + '.tmp')
+        os.rename(dest + '.tmp', dest)
+        return dest, True
+    finally:
+        os.remove(lockFile)
+
+
+def releaseStage(dest, keep=False):
+    """ Stop using the staged file dest and remove it, unless keep or other
+    worker of the node is still using it. """
+    lockFile = dest + '.lock'
+    _lock(lockFile)
+    try:
+        fnRef = '%s.%d.ref' % (dest, os.getpid())
+        if os.path.exists(fnRef):
+            os.remove(fnRef)
+        if not keep and not _getUsers(dest):
+            for fn in [dest, dest + '.tmp']:
+                if os.path.exists(fn):
+                    os.remove(fn)
+    finally:
+        os.remove(lockFile)
+
+
+def cleanStages(scratchDir):
+    """ Remove the staged files that no worker of the node is using. """
+    for fn in glob.glob(os.path.join(scratchDir, 'stage_*')):
+        if not fn.endswith(('.lock', '.ref', '.tmp')):
+            releaseStage(fn)
+
+
+def syncFiles(f, task, workDir, sent, seen, final=False):
+    """ Send the files of workDir that changed since they were sent, once
+    they have not changed during the last poll (or all of them if final).
+    The files in task['appendFiles'] are sent as they grow, only their new
+    bytes. Return True if the coordinator asks to stop the task. """
+    for name in sorted(os.listdir(workDir)):
+        fn = os.path.join(workDir, name)
+        if name.endswith('.tmp') or not os.path.isfile(fn):
+            continue
+        st = os.stat(fn)
+        state = (st.st_size, st.st_mtime)
+        previous, seen[name] = seen.get(name), state
+        append = name in task['appendFiles']
+        if sent.get(name) == state or not (final or append or
+                                           previous == state):
+            continue
+        offset = 0
+        if append and name in sent and sent[name][0] <= st.st_size:
+            offset = sent[name][0]
+        sendMessage(f, {'op': 'file', 'task': task['id'], 'name': name,
+                        'offset': offset, 'size': st.st_size - offset},
+                    fn, offset)
+        readMessage(f)
+        sent[name] = state
+    sendMessage(f, {'op': 'status', 'task': task['id']})
+    return readMessage(f)['stop']
+
+
+def runTask(f, task, scratchDir):
+    workDir = os.path.join(scratchDir, 'task_%s' % task['id'])
+    if os.path.exists(workDir):
+        shutil.rmtree(workDir)
+    os.makedirs(workDir)
+    t0 = time.time()
+    stack, staged = stageFile(task['stack'], scratchDir, task['stackKey'])
+    stageTime = time.time() - t0
+    keepStage = False
+    try:
+        sent, seen = {}, {}
+        for source, name in task['inputs']:
+            fn = os.path.join(workDir, name)
+            shutil.copyfile(source, fn)
+            st = os.stat(fn)
+            sent[name] = seen[name] = (st.st_size, st.st_mtime)
+
+        args = re.sub(r'(^|\s)stk=\S+', r'\1stk=%s' % stack, task['args'])
+        print("Running task %s: %s" % (task['id'], args))
+        sys.stdout.flush()
+        proc = subprocess.Popen('%s %s' % (task['program'], args),
+                                shell=True, cwd=workDir, env=task['env'],
+                                preexec_fn=os.setsid)
+        stopped = False
+        while proc.poll() is None:
+            time.sleep(POLL_INTERVAL)
+            if syncFiles(f, task, workDir, sent, seen) and not stopped:
+                os.killpg(proc.pid, signal.SIGTERM)
+                stopped = True
+        syncFiles(f, task, workDir, sent, seen, final=True)
+        sendMessage(f, {'op': 'done', 'task': task['id'],
+                        'exitCode': proc.returncode, 'staged': staged,
+                        'stageTime': stageTime})
+        # The stack is kept while other tasks may use it in this node
+        keepStage = readMessage(f)['keepStage']
+    finally:
+        releaseStage(stack, keep=keepStage)
+        shutil.rmtree(workDir, ignore_errors=True)
+    print("Finished task %s with exit code %d" % (task['id'], proc.returncode))
+    sys.stdout.flush()
+
+
+def main(address, tokenFile, scratchDir=None):
+    host, port = address.rsplit(':', 1)
+    with open(tokenFile) as fToken:
+        token = fToken.read().strip()
+    scratchDir = os.path.join(scratchDir or tempfile.gettempdir(),
+                              'simple_worker')
+    if not os.path.exists(scratchDir):
+        try:
+            os.makedirs(scratchDir)
+        except OSError:  # created by other worker of the node
+            pass
+
+    sock = socket.create_connection((host, int(port)))
+    f = sock.makefile('rwb')
+    sendMessage(f, {'op': 'hello', 'node': socket.gethostname(),
+                    'pid': os.getpid(), 'token': token})
+    if not readMessage(f)['ok']:
+        sys.exit("The coordinator at %s refused this worker" % address)
+    while True:
+        sendMessage(f, {'op': 'get'})
+        reply = readMessage(f)
+        if reply['op'] == 'exit':
+            cleanStages(scratchDir)
+            break
+        elif reply['op'] == 'wait':
+            time.sleep(reply['delay'])
+        else:
+            runTask(f, reply['task'], scratchDir)
+    sock.close()
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:4])
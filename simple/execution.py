@@ -0,0 +1,125 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+import psutil
+
+
+def splitThreads(totalThreads, numberOfTasks):
+    """ Return (concurrentTasks, threadsPerTask) to run numberOfTasks
+    using at most totalThreads threads. """
+    concurrent = max(1, min(numberOfTasks, totalThreads))
+    return concurrent, max(1, totalThreads // concurrent)
+
+
+def runParallel(func, argsList, workers):
+    """ Call func(*args) for every args in argsList, running up to workers
+    of them at the same time. The calls are expected to spend most of
+    their time waiting for external processes, so threads are used.
+    Results are returned in order and the first error is re-raised.
+    """
+    if workers <= 1:
+        return [func(*args) for args in argsList]
+
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(lambda args: func(*args), argsList)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def scheduleJobs(func, jobs, budget):
+    """ Call func(*args) for every (cost, threads, args) in jobs, running
+    several at the same time as long as the threads of the running ones
+    add up to at most budget. Jobs are started from the most expensive
+    one: whenever threads are released, the most expensive pending job
+    that fits is started. Results are returned in the order of jobs and
+    the first error is re-raised once the running jobs have finished.
+    """
+    pending = sorted(range(len(jobs)), key=lambda i: -jobs[i][0])
+    results = [None] * len(jobs)
+    errors = []
+    condition = threading.Condition()
+    free = [budget]
+
+    def getThreads(i):
+        return max(1, min(jobs[i][1], budget))
+
+    def worker(i):
+        try:
+            results[i] = func(*jobs[i][2])
+        except Exception as e:
+            errors.append(e)
+        finally:
+            with condition:
+                free[0] += getThreads(i)
+                condition.notify_all()
+
+    workers = []
+    with condition:
+        while pending and not errors:
+            fitting = [i for i in pending if getThreads(i) <= free[0]]
+            if not fitting:
+                condition.wait()
+                continue
+            i = fitting[0]
+            pending.remove(i)
+            free[0] -= getThreads(i)
+            thread = threading.Thread(target=worker, args=(i,))
+            thread.daemon = True
+            thread.start()
+            workers.append(thread)
+    for thread in workers:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def terminateProcesses(cwd, timeout=30):
+    """ Terminate the child processes of the current one that are running
+    in the cwd folder. They are first asked to exit (SIGTERM) and killed
+    if still alive after timeout seconds. """
+    cwd = os.path.abspath(cwd)
+    procs = []
+    for proc in psutil.Process().children(recursive=True):
+        try:
+            if proc.cwd() == cwd:
+                procs.append(proc)
+        except psutil.Error:  # already finished or not accessible
+            pass
+    for proc in procs:
+        try:
+            proc.terminate()
+        except psutil.NoSuchProcess:
+            pass
+    _, alive = psutil.wait_procs(procs, timeout=timeout)
+    for proc in alive:
+        proc.kill()
@@ -0,0 +1,108 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import re
+import json
+
+from simple.constants import SCREENING_FILE
+
+
+# Kind of files written by simple_prime, with the regular expression to
+# parse their names, whose groups are the state and iteration (if any)
+PRIME_ARTIFACTS = [
+    ('recvol', re.compile(r'^recvol_state(\d+)_iter(\d+)\.spi$')),
+    ('fullsize', re.compile(r'^recvol_state(\d+)_iter(\d+)_fullsize\.spi$')),
+    ('mrc', re.compile(r'^recvol_state(\d+)_iter(\d+)\.mrc$')),
+    ('compressed', re.compile(r'^recvol_state(\d+)_iter(\d+)\.spi\.gz$')),
+    ('startvol', re.compile(r'^startvol_state(\d+)()\.spi$')),
+    ('oritab', re.compile(r'^prime3Ddoc_()(\d+)\.txt$')),
+    # Written by the protocol, not by simple_prime, and needed afterwards
+    ('screening', re.compile(r'^()()%s$' % re.escape(SCREENING_FILE))),
+    ('seed', re.compile(r'^()()seed_oritab\.txt$')),
+    ('doc', re.compile(r'^()().*\.txt$')),
+]
+
+
+class IterationManifest(object):
+    """ Index of the files written by simple_prime in a folder.
+
+    The folder is listed once and every recognized file is described by
+    a dict with its name, kind, state, iteration, size and mtime, so the
+    protocol does not need to probe the filesystem for each file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        self.scan()
+
+    def scan(self):
+        self.entries = []
+        if not os.path.exists(self.path):
+            return
+        for fn in os.listdir(self.path):
+            for kind, regex in PRIME_ARTIFACTS:
+                match = regex.match(fn)
+                if match:
+                    st = os.stat(os.path.join(self.path, fn))
+                    state, iteration = match.groups()
+                    self.entries.append({
+                        'name': fn, 'kind': kind,
+                        'state': int(state) if state else None,
+                        'iteration': int(iteration) if iteration else None,
+                        'size': st.st_size, 'mtime': st.st_mtime})
+                    break
+
+    def getEntries(self, kind=None, state=None, iteration=None):
+        """ Return matching entries sorted by iteration and state. """
+        entries = [e for e in self.entries
+                   if (kind is None or e['kind'] == kind) and
+                   (state is None or e['state'] == state) and
+                   (iteration is None or e['iteration'] == iteration)]
+        return sorted(entries, key=lambda e: (e['iteration'] or 0,
+                                              e['state'] or 0))
+
+    def getFiles(self, kind=None, state=None, iteration=None):
+        return [os.path.join(self.path, e['name'])
+                for e in self.getEntries(kind, state, iteration)]
+
+    def getLastIteration(self):
+        """ Return the last iteration with a volume for the first state.
+        Previous iterations may have been removed to save disk space. """
+        iterations = [e['iteration'] for e in self.getEntries('recvol', 1)]
+        return max(iterations) if iterations else 0
+
+    def remove(self, entries):
+        """ Delete the files of the given entries from disk and index. """
+        for entry in entries:
+            fn = os.path.join(self.path, entry['name'])
+            if os.path.exists(fn):
+                os.remove(fn)
+            self.entries.remove(entry)
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.getEntries(), f, indent=1)
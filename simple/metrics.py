@@ -0,0 +1,171 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import re
+import json
+import time
+import threading
+
+from simple.constants import (PRIME_LOG_ITERATION, PRIME_LOG_METRICS)
+
+
+_iterRegex = re.compile(PRIME_LOG_ITERATION, re.IGNORECASE)
+_metricRegexes = dict((key, re.compile(regex, re.IGNORECASE))
+                      for key, regex in PRIME_LOG_METRICS.items())
+
+
+def parsePrimeLines(lines, metrics=None):
+    """ Parse simple_prime output lines and return a list of dicts with
+    the metrics of every iteration, e.g. {'iter': 3, 'corr': 0.75}.
+    Values found before the first iteration header are ignored.
+    """
+    metrics = metrics if metrics is not None else []
+    for line in lines:
+        match = _iterRegex.search(line)
+        if match:
+            metrics.append({'iter': int(match.group(1))})
+            continue
+        if not metrics:
+            continue
+        for key, regex in _metricRegexes.items():
+            match = regex.search(line)
+            if match:
+                try:
+                    metrics[-1][key] = float(match.group(1))
+                except ValueError:
+                    pass
+    return metrics
+
+
+def parsePrimeLog(filename):
+    """ Parse the per-iteration metrics from a simple_prime log file. """
+    with open(filename) as f:
+        return parsePrimeLines(f)
+
+
+def getFinalScore(filename):
+    """ Return the last correlation reported in a simple_prime log or
+    None if it could not be found. """
+    for iterMetrics in reversed(parsePrimeLog(filename)):
+        if 'corr' in iterMetrics:
+            return iterMetrics['corr']
+    return None
+
+
+class PrimeLogFollower(threading.Thread):
+    """ Follow the log of a running simple_prime, parsing the metrics of
+    every iteration as soon as the next one starts and appending them,
+    with the time the iteration started and its duration, as json lines
+    to metricsFile. Lines can also be passed to echo(line) as they come.
+
+    With append, only what is added to an existing log is parsed and the
+    metrics are added to the existing ones.
+    """
+    def __init__(self, logFile, metricsFile, interval=1, echo=None,
+                 append=False):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.logFile = logFile
+        self.metricsFile = metricsFile
+        self.interval = interval
+        self.echo = echo
+        self.metrics = []
+        self._written = 0
+        self._buffer = ''
+        self._offset = 0
+        if append and os.path.exists(logFile):
+            self._offset = os.path.getsize(logFile)
+        if not append and os.path.exists(metricsFile):
+            os.remove(metricsFile)
+        self._stopEvent = threading.Event()
+
+    def poll(self):
+        """ Parse the lines added to the log since the last call. """
+        if not os.path.exists(self.logFile):
+            return
+        if os.path.getsize(self.logFile) < self._offset:  # truncated
+            self._offset = 0
+        with open(self.logFile) as f:
+            f.seek(self._offset)
+            data = f.read()
+            self._offset = f.tell()
+        if not data:
+            return
+        lines = (self._buffer + data).split('\n')
+        self._buffer = lines.pop()  # the last one may be incomplete
+        self._parse(lines)
+
+    def _parse(self, lines):
+        n = len(self.metrics)
+        parsePrimeLines(lines, self.metrics)
+        now = time.time()
+        for iterMetrics in self.metrics[n:]:
+            iterMetrics['time'] = now
+        if self.echo is not None:
+            for line in lines:
+                self.echo(line + '\n')
+        # Every iteration but the last one is complete
+        self._writeMetrics(len(self.metrics) - 1)
+
+    def _writeMetrics(self, last):
+        if last <= self._written:
+            return
+        with open(self.metricsFile, 'a') as f:
+            for i in range(self._written, last):
+                iterMetrics = self.metrics[i]
+                nextTime = (self.metrics[i + 1]['time']
+                            if i + 1 < len(self.metrics) else time.time())
+                iterMetrics['duration'] = nextTime - iterMetrics['time']
+                f.write(json.dumps(iterMetrics) + '\n')
+        self._written = last
+
+    def run(self):
+        while not self._stopEvent.wait(self.interval):
+            self.poll()
+
+    def stop(self):
+        """ Stop following, parsing what is left in the log. """
+        self._stopEvent.set()
+        if self.is_alive():
+            self.join()
+        self.poll()
+        if self._buffer:
+            self._parse([self._buffer])
+            self._buffer = ''
+        self._writeMetrics(len(self.metrics))
+
+
+def readPrimeMetrics(filename):
+    """ Return the list of per-iteration metrics written by a
+    PrimeLogFollower (empty if the file does not exist). """
+    metrics = []
+    if os.path.exists(filename):
+        with open(filename) as f:
+            for line in f:
+                if line.strip():
+                    metrics.append(json.loads(line))
+    return metrics
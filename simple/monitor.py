@@ -0,0 +1,223 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import gzip
+import shutil
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from simple.analysis import correlation
+from simple.convert import isCompleteSpiderFile, memmapVolume
+from simple.manifest import IterationManifest
+
+
+class IterationWatcher(threading.Thread):
+    """ Watch the folder where simple_prime is running and notify the
+    registered handlers every time the volumes of all states for a new
+    iteration have been completely written.
+
+    Handlers are objects with an onIteration(watcher, iteration, files)
+    method, where files is the list of volumes ordered by state. They can
+    also define a close() method that is called when the watcher stops.
+    Once a handler reports a convergedIter (see ConvergenceMonitor), the
+    later iterations are not notified.
+    """
+    def __init__(self, runDir, nstates, handlers, interval=5, firstIter=1):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.runDir = runDir
+        self.nstates = nstates
+        self.handlers = handlers
+        self.interval = interval
+        self.nextIter = firstIter
+        self.convergedIter = None
+        self._stopEvent = threading.Event()
+
+    def getVolumes(self, iteration):
+        return [os.path.join(self.runDir, 'recvol_state%d_iter%d.spi'
+                             % (state, iteration))
+                for state in range(1, self.nstates + 1)]
+
+    def poll(self):
+        """ Notify all iterations completed since the last call, up to the
+        converged one. """
+        while self.convergedIter is None:
+            files = self.getVolumes(self.nextIter)
+            if not all(isCompleteSpiderFile(fn) for fn in files):
+                break
+            for handler in self.handlers:
+                handler.onIteration(self, self.nextIter, files)
+                if self.convergedIter is None:
+                    self.convergedIter = getattr(handler, 'convergedIter',
+                                                 None)
+            self.nextIter += 1
+
+    def run(self):
+        while not self._stopEvent.wait(self.interval):
+            self.poll()
+
+    def stop(self):
+        """ Stop watching after notifying any pending iteration. """
+        self._stopEvent.set()
+        if self.is_alive():
+            self.join()
+        self.poll()
+        for handler in self.handlers:
+            if hasattr(handler, 'close'):
+                handler.close()
+
+
+class IterationCallback(object):
+    """ Handler calling func(iteration, files) for every new iteration. """
+    def __init__(self, func):
+        self.func = func
+
+    def onIteration(self, watcher, iteration, files):
+        self.func(iteration, files)
+
+
+class ThumbnailWriter(object):
+    """ Add the views of every new volume to the ThumbnailCache of the
+    run, before any retention policy removes it. """
+    def __init__(self, cache, maxSize, minSize):
+        self.cache = cache
+        self.maxSize = maxSize
+        self.minSize = minSize
+
+    def onIteration(self, watcher, iteration, files):
+        for state, fn in enumerate(files, 1):
+            self.cache.add(state, iteration, memmapVolume(fn),
+                           self.maxSize, self.minSize)
+
+
+class ConvergenceMonitor(object):
+    """ Check the correlation of every state volume with the one of the
+    previous iteration and call onConverged(iteration) once it has been
+    above threshold during the given number of consecutive iterations.
+    """
+    def __init__(self, threshold, iterations, onConverged):
+        self.threshold = threshold
+        self.iterations = iterations
+        self.onConverged = onConverged
+        self.convergedIter = None
+        self.correlations = []
+        self._previous = None
+        self._count = 0
+
+    def onIteration(self, watcher, iteration, files):
+        volumes = [memmapVolume(fn) for fn in files]
+        if self._previous is not None and self.convergedIter is None:
+            corrs = [correlation(v1, v2)
+                     for v1, v2 in zip(self._previous, volumes)]
+            self.correlations.append((iteration, corrs))
+            self._count = self._count + 1 if min(corrs) >= self.threshold else 0
+            if self._count >= self.iterations:
+                self.convergedIter = iteration
+                self.onConverged(iteration)
+        self._previous = volumes
+
+
+class RetentionPolicy(object):
+    """ Limit the disk used by intermediate volumes while simple_prime runs.
+
+    After every iteration, the volumes (and alignment docs) of the oldest
+    iterations are removed so that only the last keepIterations remain
+    and/or their total size stays below maxBytes; the last iteration and
+    the one where the watcher converged are never removed. With compress, older iterations that are kept are
+    gzipped by a background thread instead.
+    The peak size of the volumes on disk is tracked, together with the
+    one that would have been reached without any retention.
+    """
+    def __init__(self, keepIterations=0, maxBytes=0, compress=False):
+        self.keepIterations = keepIterations
+        self.maxBytes = maxBytes
+        self.compress = compress
+        self.peakBytes = 0
+        self.unretainedBytes = 0
+        self._queue = None
+        self._compressThread = None
+        if compress:
+            self._queue = queue.Queue()
+            self._compressThread = threading.Thread(target=self._compressLoop)
+            self._compressThread.daemon = True
+            self._compressThread.start()
+
+    def onIteration(self, watcher, iteration, files):
+        manifest = IterationManifest(watcher.runDir)
+        volumes = manifest.getEntries('recvol') + manifest.getEntries('compressed')
+        sizes = {}
+        for entry in volumes:
+            sizes[entry['iteration']] = sizes.get(entry['iteration'], 0) + entry['size']
+        total = sum(sizes.values())
+        self.peakBytes = max(self.peakBytes, total)
+        self.unretainedBytes += sum(os.path.getsize(fn) for fn in files)
+
+        iterations = sorted(it for it in sizes if it < iteration and
+                            it != watcher.convergedIter)
+        toRemove = []
+        if self.keepIterations > 0:
+            toRemove = iterations[:max(0, len(iterations) + 1 -
+                                       self.keepIterations)]
+        if self.maxBytes > 0:
+            remaining = total - sum(sizes[it] for it in toRemove)
+            for it in iterations[len(toRemove):]:
+                if remaining <= self.maxBytes:
+                    break
+                toRemove.append(it)
+                remaining -= sizes[it]
+
+        if toRemove:
+            manifest.remove([e for e in manifest.getEntries()
+                             if e['iteration'] in toRemove and e['kind'] in
+                             ['recvol', 'compressed', 'oritab']])
+
+        if self.compress:
+            for entry in manifest.getEntries('recvol'):
+                if entry['iteration'] < iteration:
+                    self._queue.put(os.path.join(watcher.runDir, entry['name']))
+
+    def _compressLoop(self):
+        while True:
+            fn = self._queue.get()
+            if fn is None:
+                break
+            if os.path.exists(fn):
+                with open(fn, 'rb') as fIn:
+                    with gzip.open(fn + '.gz.tmp', 'wb') as fOut:
+                        shutil.copyfileobj(fIn, fOut)
+                os.rename(fn + '.gz.tmp', fn + '.gz')
+                os.remove(fn)
+
+    def close(self):
+        """ Wait until all pending volumes have been compressed. """
+        if self._compressThread is not None:
+            self._queue.put(None)
+            self._compressThread.join()
+            self._compressThread = None
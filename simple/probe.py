@@ -0,0 +1,94 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import re
+import json
+import threading
+import subprocess
+
+
+_keyRegex = re.compile(r'(?<![\w-])([a-z][a-z0-9_]*?)\d*=')
+_versionRegex = re.compile(r'version\s*:?\s*v?(\d+(?:\.\d+)*)', re.IGNORECASE)
+
+
+def getArgKeys(args):
+    """ Return the set of keys of key=value arguments, without the state
+    number of keys like vol1, vol2... """
+    return set(_keyRegex.findall(' ' + args))
+
+
+def probeProgram(program, env=None, timeout=30):
+    """ Run program without arguments and parse the version and the
+    accepted keys from the usage message it prints. """
+    try:
+        proc = subprocess.Popen([program], env=env, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+    except OSError as e:
+        return {'error': str(e), 'version': None, 'keys': []}
+    # Do not wait forever for a program that expects some input
+    timer = threading.Timer(timeout, proc.kill)
+    timer.start()
+    try:
+        output = proc.communicate()[0].decode('utf-8', 'replace')
+    finally:
+        timer.cancel()
+    match = _versionRegex.search(output)
+    return {'version': match.group(1) if match else None,
+            'keys': sorted(getArgKeys(output))}
+
+
+def getProgramCapabilities(program, env, cacheFile):
+    """ Return the probeProgram result for program, that is only run again
+    when the program file changes. Results are kept in cacheFile. """
+    st = os.stat(program)
+    key = '%s:%d:%d' % (os.path.abspath(program), st.st_size, st.st_mtime)
+    cache = {}
+    if os.path.exists(cacheFile):
+        with open(cacheFile) as f:
+            try:
+                cache = json.load(f)
+            except ValueError:
+                pass
+    if key not in cache:
+        cache[key] = probeProgram(program, env)
+        dirname = os.path.dirname(cacheFile)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tmp = '%s.%d.tmp' % (cacheFile, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+        os.rename(tmp, cacheFile)
+    return cache[key]
+
+
+def checkProgramArgs(capabilities, args):
+    """ Return the keys used in args that the program does not accept,
+    or an empty list when its accepted keys are unknown. """
+    keys = set(capabilities.get('keys', []))
+    if not keys:
+        return []
+    return sorted(getArgKeys(args) - keys)
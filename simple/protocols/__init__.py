@@ -25,3 +25,4 @@
 # **************************************************************************
 
 from protocol_prime import ProtPrime
+from protocol_prime_sweep import ProtPrimeSweep
@@ -25,14 +25,44 @@
 # **************************************************************************
 
 import os
-from glob import glob
+import re
+import sys
+import json
+import time
+import threading
 
 import pyworkflow.em as em
+import pyworkflow.object as pwobj
 import pyworkflow.protocol.params as params
-from pyworkflow.utils.path import cleanPath, cleanPattern
+import pyworkflow.utils as pwutils
+from pyworkflow.utils.path import makePath
 
 import simple
 from simple.constants import *
+from simple.analysis import (compareVolumes, findDuplicates,
+                             findRedundantStates, getGridOrientations,
+                             mergeStates, scoreAverages, selectAverages)
+from simple.batch_runner import STOP_FILE
+from simple.cache import hashItems, linkFile
+from simple.convert import (convertVolumeToMrc, getDownsampledBox,
+                            getVolumeDim, isCompleteSpiderFile, memmapStack,
+                            memmapVolume, readImageData, readSpiderHeader,
+                            resampleVolume, resizeVolume, scaleOritab,
+                            writeMrcVolume, writeSpiderStack,
+                            writeSpiderVolume)
+from simple.distributed import Coordinator
+from simple.execution import runParallel, splitThreads, terminateProcesses
+from simple.manifest import IterationManifest
+from simple.metrics import (PrimeLogFollower, getFinalScore, parsePrimeLog,
+                            readPrimeMetrics)
+from simple.monitor import (ConvergenceMonitor, IterationCallback,
+                            IterationWatcher, RetentionPolicy,
+                            ThumbnailWriter)
+from simple.probe import checkProgramArgs
+from simple.telemetry import StepTelemetry, readTelemetry, telemetryStep
+from simple.thumbnails import ThumbnailCache
+from simple.tuning import (chooseThreads, fitScaling, getAvailableCores,
+                           getCalibrationThreads)
 
 
 
@@ -40,6 +70,22 @@ class ProtPrime(em.ProtInitialVolume):
     """ Produces one or several initial volumes using simple prime """
     _label = 'prime'
 
+    def __init__(self, **kwargs):
+        em.ProtInitialVolume.__init__(self, **kwargs)
+        self.bestRun = pwobj.Integer(1)
+        self.runScores = pwobj.String()
+        self.resumedIterations = pwobj.Integer(0)
+        self.resumedTime = pwobj.Float(0)
+        self.convergedIterations = pwobj.String()
+        self.peakDiskBytes = pwobj.Integer(0)
+        self.unretainedDiskBytes = pwobj.Integer(0)
+        self.tunedThreads = pwobj.Integer()
+        self.stageReport = pwobj.String()
+        self.nodeReport = pwobj.String()
+        self._outputLock = threading.Lock()
+        self._coordinator = None
+        self._workerProcesses = []
+
     # --------------------------- DEFINE param functions ----------------------
     def _defineParams(self, form):
         form.addSection('Input')
@@ -57,6 +103,56 @@ class ProtPrime(em.ProtInitialVolume):
                       default=1,
                       label='Number of volumes', 
                       help="Number of volumes to reconstruct")
+        form.addParam('doWarmStart', params.BooleanParam,
+                      default=False,
+                      label='Start from given volumes?',
+                      help="Start simple_prime from existing volumes (e.g. "
+                           "the output of a previous prime run) instead of "
+                           "random ones. Useful to refine the result again "
+                           "after small changes in the input classes.")
+        form.addParam('initialVolumes', params.PointerParam,
+                      pointerClass='Volume, SetOfVolumes',
+                      condition="doWarmStart", allowsNull=True,
+                      label="Starting volume(s)",
+                      help='One volume per state: a single volume when '
+                           'reconstructing one volume or a set with as many '
+                           'volumes as requested.')
+        form.addParam('warmIterations', params.IntParam,
+                      default=10,
+                      condition="doWarmStart",
+                      label='Maximum iterations',
+                      help="Maximum number of iterations when starting from "
+                           "given volumes, that should be much closer to "
+                           "the solution than random ones.")
+        form.addParam('compareStates', params.BooleanParam,
+                      default=True,
+                      condition="Nvolumes > 1",
+                      expertLevel=params.LEVEL_ADVANCED,
+                      label='Compare final volumes?',
+                      help="Compute the correlation and FSC between every "
+                           "pair of final volumes (up to the max. "
+                           "resolution, trying the orientations related by "
+                           "the symmetry axis) and store them with the "
+                           "output set. Near identical volumes are reported "
+                           "as redundant. Not applied when streaming.")
+        form.addParam('stateThreshold', params.FloatParam,
+                      default=0.9,
+                      condition="Nvolumes > 1 and compareStates",
+                      expertLevel=params.LEVEL_ADVANCED,
+                      label='Redundant correlation',
+                      help="Two volumes are redundant when their "
+                           "correlation is above this value.")
+        form.addParam('redundantStates', params.EnumParam,
+                      choices=['flag', 'remove', 'merge'],
+                      default=REDUNDANT_REMOVE,
+                      display=params.EnumParam.DISPLAY_HLIST,
+                      condition="Nvolumes > 1 and compareStates",
+                      expertLevel=params.LEVEL_ADVANCED,
+                      label='Redundant volumes',
+                      help="Flag: output all volumes, with the redundant "
+                           "ones commented as such. Remove: output only the "
+                           "first volume of every group of redundant ones. "
+                           "Merge: output the average of every group.")
         form.addParam('maximumShift', params.IntParam,
                       default=0,
                       expertLevel=params.LEVEL_ADVANCED,
@@ -84,12 +180,63 @@ class ProtPrime(em.ProtInitialVolume):
                       label='Max. resolution (A)',
                       help="The reconstructed volume will be limited to \n"
                            "this resolution in Angstroms.")
+        form.addParam('doDownsample', params.BooleanParam,
+                      default=False,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      condition="not dynamicFilter",
+                      label='Downsample input?',
+                      help="Fourier crop the input averages to the smallest \n"
+                           "box compatible with the max. resolution before \n"
+                           "running prime. Output volumes are padded back \n"
+                           "to the original box and sampling rate.")
+        form.addParam('resolutionSchedule', params.StringParam,
+                      default='',
+                      expertLevel=params.LEVEL_ADVANCED,
+                      label='Coarse stages resolution (A)',
+                      help="Run simple_prime first at these resolutions "
+                           "(e.g. '40 30'), each one on the input downsampled "
+                           "to the smallest box compatible with it and "
+                           "starting from the volumes and orientations of "
+                           "the previous stage, before the final run at the "
+                           "full box. Leave empty to run only the final one.")
+        form.addParam('stageIterations', params.IntParam,
+                      default=5,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      condition="resolutionSchedule",
+                      label='Iterations per coarse stage',
+                      help="Maximum number of iterations of every coarse "
+                           "stage. They stop before if they converge and "
+                           "early stop is enabled.")
         form.addParam('fractionParticles', params.FloatParam,
                       default=1,
                       expertLevel=params.LEVEL_ADVANCED,
                       label='Fraction of particles',
                       help="Fraction of particles to include in the refinement. \n"
                            "1=all particles, 0.8=80% of particles")
+        form.addParam('doScreening', params.BooleanParam,
+                      default=False,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      label='Pre-screen averages?',
+                      help="Score the input averages by their signal to "
+                           "noise ratio, power falloff and centering, drop "
+                           "duplicated ones and only give the best scored "
+                           "to simple_prime. The scores and the selection "
+                           "are written to extra/screening.txt.")
+        form.addParam('screeningFraction', params.FloatParam,
+                      default=0.8,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      condition="doScreening",
+                      label='Fraction of averages kept',
+                      help="Fraction of the input averages kept after "
+                           "pre-screening.")
+        form.addParam('duplicateThreshold', params.FloatParam,
+                      default=0.95,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      condition="doScreening",
+                      label='Duplicate correlation',
+                      help="Two averages are considered duplicated when "
+                           "their correlation (at the best shift) is above "
+                           "this value. Only the best scored one is kept.")
         form.addParam('molecularWeight', params.FloatParam,
                       default=-1,
                       expertLevel=params.LEVEL_ADVANCED,
@@ -101,21 +248,188 @@ class ProtPrime(em.ProtInitialVolume):
                       expertLevel=params.LEVEL_ADVANCED,
                       label='Keep intermediate volumes?',
                       help='Keep all volumes along iterations')
+        form.addParam('outputFormat', params.EnumParam,
+                      choices=['SPIDER', 'MRC'],
+                      default=OUTPUT_SPIDER,
+                      display=params.EnumParam.DISPLAY_HLIST,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      label='Output format',
+                      help="Format of the output volumes. simple_prime "
+                           "writes SPIDER volumes, that are converted to "
+                           "MRC (with the input box size) in a single "
+                           "pass when MRC is chosen, so they can be "
+                           "memory mapped by other programs without any "
+                           "further conversion.")
+        form.addParam('compressIntermediate', params.BooleanParam,
+                      default=False,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      condition="keepIntermediate",
+                      label='Compress intermediate volumes?',
+                      help="Gzip the volumes of previous iterations in the "
+                           "background while simple_prime runs.")
+        form.addParam('retainIterations', params.IntParam,
+                      default=0,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      condition="not keepIntermediate",
+                      label='Iterations kept while running',
+                      help="Remove the volumes of older iterations while "
+                           "simple_prime runs, keeping only the last ones. "
+                           "Set to 0 to remove them only at the end.")
+        form.addParam('diskBudget', params.FloatParam,
+                      default=0,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      condition="not keepIntermediate",
+                      label='Disk budget for volumes (GB)',
+                      help="Remove the volumes of the oldest iterations "
+                           "while simple_prime runs so the ones kept do not "
+                           "use more than this. The last iteration is always "
+                           "kept. Set to 0 for no limit.")
+        form.addParam('numberOfRuns', params.IntParam,
+                      default=1,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      label='Number of independent runs',
+                      help="Run simple_prime several times from different "
+                           "random starting volumes and keep the run with "
+                           "the best final correlation. Runs are executed "
+                           "concurrently, sharing the available threads.")
+        form.addParam('doEarlyStop', params.BooleanParam,
+                      default=False,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      label='Stop when converged?',
+                      help="Compare the volumes of every iteration with the "
+                           "previous ones while simple_prime runs and stop "
+                           "it once they do not change any more.")
+        form.addParam('convergenceThreshold', params.FloatParam,
+                      default=0.99,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      condition="doEarlyStop",
+                      label='Convergence correlation',
+                      help="Minimum correlation of every state volume with "
+                           "the one of the previous iteration.")
+        form.addParam('convergenceIterations', params.IntParam,
+                      default=3,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      condition="doEarlyStop",
+                      label='Converged iterations',
+                      help="Number of consecutive iterations above the "
+                           "convergence correlation before stopping.")
+        form.addParam('doStreaming', params.BooleanParam,
+                      default=False,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      condition="numberOfRuns == 1",
+                      label='Update outputs every iteration?',
+                      help="Publish the output volume(s) as soon as the "
+                           "first iteration finishes and update them with "
+                           "every new iteration, so other protocols can "
+                           "start from an intermediate model. With several "
+                           "volumes the output set is kept open while "
+                           "simple_prime runs.")
+        form.addParam('doThumbnails', params.BooleanParam,
+                      default=True,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      label='Keep thumbnails of iterations?',
+                      help="Save small central slices and projections of "
+                           "every volume as it is written, in a single "
+                           "file per run, so the viewer can browse all "
+                           "states and iterations without opening any "
+                           "volume (even after intermediate ones are "
+                           "removed).")
+
+        form.addParam('telemetryInterval', params.FloatParam,
+                      default=10,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      label='Resource sampling interval (s)',
+                      help="Record the wall time, CPU, memory and I/O used "
+                           "by every step (and by simple_prime) at this "
+                           "interval in extra/telemetry.jsonl. "
+                           "Set to 0 to disable.")
 
         form.addParallelSection(threads=8, mpi=0)
+        form.addParam('useBatch', params.BooleanParam,
+                      default=False,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      label='Submit in a shared batch?',
+                      help="Instead of running simple_prime in this job, "
+                           "queue it to be submitted to the cluster together "
+                           "with the runs of other protocols in a single "
+                           "allocation. Requires SIMPLE_BATCH_SUBMIT in the "
+                           "plugin configuration.")
+        form.addParam('useDistributed', params.BooleanParam,
+                      default=False,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      label='Distribute runs across nodes?',
+                      help="Start a worker on every node (with "
+                           "SIMPLE_WORKER_LAUNCH, e.g. an mpirun command, or "
+                           "as local processes if it is empty) that pulls "
+                           "the simple_prime runs (independent runs, coarse "
+                           "stages or sweep combinations) from this job. "
+                           "Every node stages the input stack once in its "
+                           "local scratch, and the volumes are streamed "
+                           "back as they are written. Every run uses the "
+                           "given number of threads on its node.")
+        form.addParam('distributedWorkers', params.IntParam,
+                      default=2,
+                      expertLevel=params.LEVEL_ADVANCED,
+                      condition="useDistributed",
+                      label='Number of nodes',
+                      help="Number of workers to start, one per node.")
+        form.addParam('autoThreads', params.BooleanParam,
+                      default=False,
+                      label='Tune number of threads?',
+                      help="Time short simple_prime runs on a subset of the "
+                           "input with a few thread counts and use the "
+                           "largest count that still scales efficiently, up "
+                           "to the threads given to the protocol (and the "
+                           "cores available to it). The result is "
+                           "remembered for this host, box size, number of "
+                           "volumes and threads.")
     
     # --------------------------- INSERT steps functions ----------------------
     def _insertAllSteps(self):
         self._insertFunctionStep('convertInputStep')
+        if self.autoThreads:
+            self._insertFunctionStep('tuneThreadsStep')
         self._insertFunctionStep('runPrime')
+        if self._isEnsemble():
+            self._insertFunctionStep('selectBestRunStep')
         if not self.keepIntermediate:
             self._insertFunctionStep('cleanPrime')
         self._insertFunctionStep('createOutputStep')        
 
     # --------------------------- STEPS functions -----------------------------
+    @telemetryStep
     def convertInputStep(self):
-        self.inputClasses.get().writeStack(self._getExtraPath("classes.spi:stk"))
+        if self.doScreening:
+            self._screenAverages()
+        if self.doWarmStart:
+            self._convertStartVolumes()
+        cache = simple.Plugin.getStackCache()
+        for fnStack, box in self._getInputStacks():
+            if cache is not None:
+                key = self._getStackKey(box)
+                if cache.fetch(key, fnStack):
+                    self.info("Input stack taken from cache: %s" % key)
+                    continue
+            self._writeInputStack(fnStack, box)
+            if cache is not None:
+                cache.store(key, fnStack)
             
+    @telemetryStep
+    def tuneThreadsStep(self):
+        box, nstates = self._getPrimeBox(), self.Nvolumes.get()
+        maxThreads = self._getMaxThreads()
+        cache = simple.Plugin.getThreadsCache()
+        tuning = cache.get(box, nstates, maxThreads)
+        if tuning is None:
+            tuning = self._calibrateThreads(maxThreads)
+            cache.set(box, nstates, maxThreads, tuning)
+        else:
+            self.info("Using the number of threads tuned before for this "
+                      "host: %d" % tuning['threads'])
+        self.tunedThreads.set(tuning['threads'])
+        self._store(self.tunedThreads)
+
+    @telemetryStep
     def runPrime(self):
         # simple_prime stk=stack.spi [vol1=invol.spi] [vol2=<refvol_2.spi> etc.] box=<image size(in pixels)> 
         #              smpd=<sampling distance(in A)> [ring2=<outer mask radius(in pixels){box/2}>] 
@@ -123,62 +437,97 @@ class ProtPrime(em.ProtInitialVolume):
         #              [dynlp=<yes|no{no}>] [nstates=nstates to reconstruct>] [frac=<fraction of ptcls to include{1}>]
         #              [mw=<molecular weight (in kD)>] [oritab=<previous rounds alignment doc>] [nthr=<nr of OpenMP threads{1}>]
 
-        inputClasses = self.inputClasses.get()
-        xdim, _, _ = inputClasses.getDimensions()
-        args = "stk=classes.spi box=%d smpd=%f pgrp=%s" % (xdim,
-                                                           inputClasses.getSamplingRate(),
-                                                           self.symmetryGroup)
-        
-        if self.dynamicFilter:
-            args += " dynlp=yes"
+        if self.useDistributed:
+            # All runs are queued, and each one takes the threads of a node
+            concurrent, threads = self.numberOfRuns.get(), self._getThreads()
         else:
-            args += " lp=%f" % self.maxResolution
-        args += " trs=%d trsstep=%d" % (self.maximumShift,
-                                        self.shiftStep)
-        args += " nstates=%d" % self.Nvolumes
-        args += " nthr=%d" % self.numberOfThreads
-        
-        if self.outerMask > 0:
-            args += " ring2=%f" % self.outerMask
-        args += " frac=%f" % self.fractionParticles
-        
-        if self.molecularWeight > 0:
-            args += " mw=%f" % self.molecularWeight
-        
-        self.runJob(simple.Plugin.getProgram(), args,
-                    cwd=self._getExtraPath(),
-                    env=simple.Plugin.getEnviron())
+            concurrent, threads = splitThreads(self._getThreads(),
+                                               self.numberOfRuns.get())
+        argsList = []
+        resumedIterations, resumedTime = 0, 0
+        for runDir in self._getRunDirs():
+            makePath(runDir)
+            # Continue from a previous execution that was interrupted
+            resumeIter = self._getResumeIteration(runDir)
+            if resumeIter:
+                resumedIterations += resumeIter
+                resumedTime += self._getElapsedTime(runDir, resumeIter)
+            argsList.append((runDir, threads, resumeIter))
+
+        if resumedIterations:
+            self.info("Resuming simple_prime: %d iterations already done"
+                      % resumedIterations)
+            self.resumedIterations.set(self.resumedIterations.get() +
+                                       resumedIterations)
+            self.resumedTime.set(self.resumedTime.get() + resumedTime)
+            self._store(self.resumedIterations, self.resumedTime)
+
+        convergedIters = self._runWorkers(runParallel, self._runPrimeJob,
+                                          argsList, concurrent)
+        if self.doEarlyStop:
+            self.convergedIterations.set(" ".join(str(it or "-")
+                                                  for it in convergedIters))
+            self._store(self.convergedIterations)
+
+    @telemetryStep
+    def selectBestRunStep(self):
+        """ Score every run by its final correlation and keep the best. """
+        scores = [getFinalScore(os.path.join(runDir, PRIME_LOG))
+                  for runDir in self._getRunDirs()]
+        validScores = [(score, i + 1) for i, score in enumerate(scores)
+                       if score is not None]
+        if validScores:
+            self.bestRun.set(max(validScores)[1])
+        else:
+            self.warning("Could not find any correlation in the prime "
+                         "logs, using the first run.")
+        self.runScores.set(" ".join("n/a" if score is None else "%0.4f" % score
+                                    for score in scores))
+        self._store(self.bestRun, self.runScores)
 
+    @telemetryStep
     def cleanPrime(self):
-        self._enterDir(self._getExtraPath())
-        cleanPath("cmdline.txt")
-        cleanPattern("*.txt")
-        cleanPattern("startvol_state*.spi")
-        # Get last iteration
-        for i in range(1, self.getLastIteration()):
-            cleanPattern("recvol_state*_iter%d.spi" % i)
-        self._leaveDir()
+        runDirs = []
+        for runDir in self._getRunDirs():
+            runDirs.append(runDir)
+            runDirs += [self._getStageDir(runDir, i) for i, _ in
+                        enumerate(self._getStageResolutions(), 1)]
+        for runDir in runDirs:
+            manifest = IterationManifest(runDir)
+            lastIter = manifest.getLastIteration()
+            manifest.remove(manifest.getEntries('doc') +
+                            manifest.getEntries('oritab') +
+                            manifest.getEntries('startvol') +
+                            [e for e in manifest.getEntries('recvol')
+                             if e['iteration'] < lastIter])
     
+    @telemetryStep
     def createOutputStep(self):
-        lastIter = self.getLastIteration()
+        runDir = self._getBestRunDir()
+        manifest = IterationManifest(runDir)
+        manifest.write(os.path.join(runDir, 'manifest.json'))
+        lastIter = manifest.getLastIteration()
         
         if lastIter <= 1:
             return
+
+        self._calibrateCostModel(lastIter)
+        fnVolumes = manifest.getFiles('recvol', iteration=lastIter)
+        if self._isStreaming():
+            self._publishVolumes(map(self._getOutputVolume, fnVolumes),
+                                 self.inputClasses.get().getSamplingRate(),
+                                 "final", closeStream=True)
+            return
         
+        samplingRate = self.inputClasses.get().getSamplingRate()
+        fnPrimeVolumes = fnVolumes
+        fnVolumes = [self._getOutputVolume(fn) for fn in fnVolumes]
         if self.Nvolumes == 1:
-            vol = em.Volume()
-            vol.setLocation(self._getExtraPath('recvol_state1_iter%d.spi' % lastIter))
-            vol.setSamplingRate(self.inputClasses.get().getSamplingRate())
+            vol = self._createOutputVolume(fnVolumes[0], samplingRate)
             self._defineOutputs(outputVol=vol)
         else:
-            vol = self._createSetOfVolumes()
-            vol.setSamplingRate(self.inputClasses.get().getSamplingRate())
-            fnVolumes = glob(self._getExtraPath('recvol_state*_iter%d.spi') % lastIter)
-            fnVolumes.sort()
-            for fnVolume in fnVolumes:
-                aux = em.Volume()
-                aux.setLocation(fnVolume)
-                vol.append(aux)
+            vol = self._createStatesSet(fnPrimeVolumes, fnVolumes,
+                                        samplingRate)
             self._defineOutputs(outputVolumes=vol)
 
         self._defineSourceRelation(self.inputClasses, vol)
@@ -186,12 +535,97 @@ class ProtPrime(em.ProtInitialVolume):
     # --------------------------- INFO functions ------------------------------
     def _validate(self):
         errors = []
+        if self.doWarmStart:
+            volumes = self._getInputVolumes()
+            if not volumes:
+                errors.append("Select the starting volume(s).")
+            elif len(volumes) != self.Nvolumes:
+                errors.append("The number of starting volumes (%d) should "
+                              "be the number of volumes to reconstruct (%d)."
+                              % (len(volumes), self.Nvolumes))
+        try:
+            stages = self._getStageResolutions()
+        except ValueError:
+            errors.append("The coarse stages resolution should be a list of "
+                          "numbers separated by spaces.")
+            stages = []
+        if stages and not self.dynamicFilter:
+            if any(lp <= self.maxResolution for lp in stages):
+                errors.append("The resolution of every coarse stage should "
+                              "be worse (larger) than the max. resolution "
+                              "(%0.1f A)." % self.maxResolution)
+        if self.useBatch and simple.Plugin.getBatchSpool() is None:
+            errors.append("Batch submission requires SIMPLE_BATCH_SUBMIT "
+                          "in the plugin configuration.")
+        if self.useDistributed:
+            if self.useBatch:
+                errors.append("Runs can not be both distributed and "
+                              "submitted in a batch.")
+            if self.distributedWorkers < 1:
+                errors.append("At least one node is needed.")
+        if self.inputClasses.get() is not None:
+            # Only the limits set in the configuration are hard errors
+            errors += self._checkResources(1., host=False)
         return errors
 
+    def _warnings(self):
+        warnings = []
+        if self.inputClasses.get() is not None:
+            warnings += self._checkResources(RESOURCE_WARNING,
+                                             host=not self._isQueued())
+        return warnings
+
     def _summary(self):
         summary = []
         summary.append("Input classes: %s" % self.getObjectTag('inputClasses'))
-        summary.append("Starting from: %d random volumes" % self.Nvolumes )
+        if self.doWarmStart:
+            summary.append("Starting from: %s"
+                           % self.getObjectTag('initialVolumes'))
+        else:
+            summary.append("Starting from: %d random volumes" % self.Nvolumes)
+        if self._isEnsemble() and self.runScores.get():
+            summary.append("Best of %d runs: run %d (final correlations: %s)"
+                           % (self.numberOfRuns, self.bestRun,
+                              self.runScores))
+        if self.convergedIterations.get():
+            summary.append("Stopped after converging at iteration(s): %s"
+                           % self.convergedIterations)
+        selection = self._getSelection()
+        if selection is not None:
+            summary.append("Pre-screening kept %d of %d averages"
+                           % (len(selection), self.inputClasses.get().getSize()))
+        if self.stageReport.get():
+            summary.append("Resolution schedule:")
+            summary += self.stageReport.get().split('\n')
+        comparison = self.getStateComparison()
+        if comparison is not None:
+            redundant = [i + 1 for i, j in enumerate(comparison['redundant'])
+                         if j >= 0]
+            summary.append("Redundant volumes (correlation above %0.2f): %s"
+                           % (comparison['threshold'],
+                              " ".join(map(str, redundant)) or "none"))
+        if self.nodeReport.get():
+            summary.append("Distributed execution:")
+            summary += self.nodeReport.get().split('\n')
+        if self.autoThreads and self.tunedThreads.hasValue():
+            summary.append("Threads chosen by calibration: %d"
+                           % self.tunedThreads)
+        summary += self._getTelemetrySummary()
+        if self.peakDiskBytes > 0:
+            summary.append("Peak disk used by volumes: %s (%s without "
+                           "retention)"
+                           % (pwutils.prettySize(self.peakDiskBytes.get()),
+                              pwutils.prettySize(self.unretainedDiskBytes.get())))
+        if self.resumedIterations > 0:
+            summary.append("Resumed after %d completed iterations "
+                           "(about %0.1f min of compute saved)"
+                           % (self.resumedIterations,
+                              self.resumedTime.get() / 60.))
+        if self.inputClasses.get() is not None:
+            box = self._getPrimeBox()
+            if box != self._getInputBox():
+                summary.append("Downsampled to: %d px (%0.2f A/px)"
+                               % (box, self._getPrimeSamplingRate()))
         return summary
     
     def _methods(self):
@@ -203,9 +637,890 @@ class ProtPrime(em.ProtInitialVolume):
             return []
 
     # -------------------------- UTILS functions ------------------------------
-    def getLastIteration(self):
-        lastIter = 1
-        pattern = self._getExtraPath("recvol_state1_iter%d.spi")
-        while os.path.exists(pattern % lastIter):
-            lastIter += 1
-        return lastIter - 1
+    def getLastIteration(self, runDir=None):
+        runDir = runDir or self._getBestRunDir()
+        return IterationManifest(runDir).getLastIteration()
+
+    def getIterationMetrics(self, runDir=None):
+        """ Return a list with the metrics of every iteration of the best
+        run (or the one in runDir), as dicts with the iteration number
+        (iter), correlation (corr), resolution (res), start time (time)
+        and duration in seconds (duration) when available. """
+        runDir = runDir or self._getBestRunDir()
+        metrics = readPrimeMetrics(os.path.join(runDir, PRIME_METRICS))
+        fnLog = os.path.join(runDir, PRIME_LOG)
+        if not metrics and os.path.exists(fnLog):
+            metrics = parsePrimeLog(fnLog)
+        return metrics
+
+    def _echoLine(self, line):
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+    def _getStepTelemetry(self, stepName):
+        """ Return the StepTelemetry recording stepName or None. """
+        if self.telemetryInterval <= 0:
+            return None
+        return StepTelemetry(self._getExtraPath('telemetry.jsonl'), stepName,
+                             self.telemetryInterval.get())
+
+    def _getTelemetrySummary(self):
+        _, totals = readTelemetry(self._getExtraPath('telemetry.jsonl'))
+        lines = []
+        for record in totals:
+            lines.append("%s: %0.1f s wall, %0.1f s CPU, peak RSS %s, "
+                         "I/O %s read / %s written"
+                         % (record['step'], record['wall'], record['cpuTime'],
+                            pwutils.prettySize(record['peakRss']),
+                            pwutils.prettySize(record['read']),
+                            pwutils.prettySize(record['write'])))
+        return lines
+
+    def _getCostParams(self, box=None):
+        """ Return the settings used by the CostModel to predict the
+        resources needed by the simple_prime runs. """
+        box = box or self._getPrimeBox()
+        scale = float(box) / self._getInputBox()
+        concurrent, threads = splitThreads(self._getThreads(),
+                                           self.numberOfRuns.get())
+        nimages = self.inputClasses.get().getSize()
+        if self.doScreening:
+            nimages = int(round(nimages * self.screeningFraction.get()))
+        return {'box': box,
+                'samplingRate': self._getPrimeSamplingRate(box),
+                'lowPass': max(self.maxResolution.get(),
+                               2 * self._getPrimeSamplingRate(box)),
+                'symmetryGroup': self.symmetryGroup.get(),
+                'nimages': nimages,
+                'nstates': self.Nvolumes.get(),
+                'maximumShift': int(round(self.maximumShift.get() * scale)),
+                'shiftStep': max(1, int(round(self.shiftStep.get() * scale))),
+                'threads': threads,
+                'runs': self.numberOfRuns.get(),
+                'concurrent': concurrent,
+                'iterations': (self.warmIterations.get() if self.doWarmStart
+                               else ESTIMATED_ITERATIONS),
+                'keepAll': self.keepIntermediate.get(),
+                'keepIterations': self.retainIterations.get(),
+                'maxBytes': int(self.diskBudget.get() * 1024 ** 3),
+                'compress': self.compressIntermediate.get()}
+
+    def _checkResources(self, fraction, host=True):
+        """ Return messages about the predicted memory and disk that go
+        over the given fraction of the configured limits and, with host,
+        of the resources of this host. """
+        model = simple.Plugin.getCostModel()
+        p = self._getCostParams()
+        estimate = model.estimate(p)
+        maxMemory, maxDisk = simple.Plugin.getResourceLimits(
+            self._getExtraPath(), host=host)
+        maxMemory, maxDisk = int(maxMemory * fraction), int(maxDisk * fraction)
+        messages = []
+        if maxMemory and estimate['memory'] > maxMemory:
+            messages.append("simple_prime is expected to need %s of memory "
+                            "but only %s are available."
+                            % (pwutils.prettySize(estimate['memory']),
+                               pwutils.prettySize(maxMemory)))
+        if maxDisk and estimate['disk'] > maxDisk:
+            messages.append("The volumes written along the iterations are "
+                            "expected to need %s of disk but only %s are "
+                            "available. Consider keeping fewer iterations."
+                            % (pwutils.prettySize(estimate['disk']),
+                               pwutils.prettySize(maxDisk)))
+        if messages:
+            box = model.suggestBox(p, maxMemory, maxDisk)
+            if box is not None and not self.dynamicFilter:
+                messages.append("Downsampling to %d px (%0.2f A/px, max. "
+                                "resolution %0.1f A) would fit."
+                                % (box, self._getPrimeSamplingRate(box),
+                                   2 * self._getPrimeSamplingRate(box)))
+            messages.append("Estimated CPU time: %0.1f hours."
+                            % estimate['cpuHours'])
+        return messages
+
+    def _calibrateCostModel(self, iterations):
+        """ Correct the cost model with the resources measured for
+        runPrime, if they are comparable with its predictions (it ran in
+        this host, in a single stage, from the start to the last iteration
+        and its iterations were timed). """
+        stopped = [it for it in (self.convergedIterations.get() or '').split()
+                   if it != '-']
+        if (self._isQueued() or self._getStageResolutions() or
+                self.resumedIterations > 0 or stopped):
+            return
+        if not any(m.get('duration') for m in self.getIterationMetrics()):
+            return
+        _, totals = readTelemetry(self._getExtraPath('telemetry.jsonl'))
+        records = [r for r in totals if r['step'] == 'runPrime'
+                   and not r.get('failed')]
+        if records:
+            p = dict(self._getCostParams(), iterations=iterations)
+            simple.Plugin.getCostModel().calibrate(
+                p, memory=records[-1]['peakRss'],
+                cpuHours=records[-1]['cpuTime'] / 3600.)
+
+    def _isQueued(self):
+        """ Whether simple_prime runs in other hosts (batch or nodes). """
+        return bool(self.useBatch or self.useDistributed)
+
+    def _getThreads(self):
+        if self.autoThreads and self.tunedThreads.hasValue():
+            return self.tunedThreads.get()
+        return self.numberOfThreads.get()
+
+    def _getMaxThreads(self):
+        """ Return the threads allocated to this protocol, bounded by the
+        cores this process may run on (e.g. those given by the queue). """
+        return max(1, min(self.numberOfThreads.get(), getAvailableCores()))
+
+    def _calibrateThreads(self, maxThreads):
+        """ Time one iteration of simple_prime on a few images with several
+        thread counts up to maxThreads and choose the number of threads
+        from them. """
+        calibrationDir = self._getTmpPath('calibration')
+        makePath(calibrationDir)
+        fnClasses = self._getExtraPath("classes.spi")
+        fnStack = os.path.join(calibrationDir, 'classes.spi')
+        n = min(readSpiderHeader(fnClasses)['maxim'], CALIBRATION_IMAGES)
+        writeSpiderStack(fnStack, [(i, fnClasses) for i in range(1, n + 1)])
+
+        threadsList = getCalibrationThreads(maxThreads)
+        times = []
+        for threads in threadsList:
+            runDir = os.path.join(calibrationDir, 'threads_%02d' % threads)
+            makePath(runDir)
+            args = self._getPrimeArgs(os.path.relpath(fnStack, runDir),
+                                      threads)
+            t0 = time.time()
+            self.runJob(simple.Plugin.getProgram(), args + " maxits=1",
+                        cwd=runDir,
+                        env=simple.Plugin.getEnviron())
+            times.append(time.time() - t0)
+
+        a, b = fitScaling(threadsList, times)
+        tuning = {'threads': chooseThreads(a, b, maxThreads),
+                  'calibration': dict(zip(map(str, threadsList), times))}
+        self.info("Thread calibration (threads: seconds): %s, using %d "
+                  "threads" % (tuning['calibration'], tuning['threads']))
+        return tuning
+
+    def _isEnsemble(self):
+        return self.numberOfRuns > 1
+
+    def _getRunDirs(self):
+        """ Return the folders where simple_prime is executed. """
+        if not self._isEnsemble():
+            return [self._getExtraPath()]
+        return [self._getExtraPath('run_%02d' % i)
+                for i in range(1, self.numberOfRuns.get() + 1)]
+
+    def _getBestRunDir(self):
+        return self._getRunDirs()[self.bestRun.get() - 1]
+
+    def _runPrimeJob(self, runDir, threads, resumeIter=0):
+        args = self._getPrimeArgs(
+            os.path.relpath(self._getExtraPath("classes.spi"), runDir), threads)
+        if resumeIter:
+            for state in range(1, self.Nvolumes.get() + 1):
+                args += " vol%d=recvol_state%d_iter%d.spi" % (state, state,
+                                                             resumeIter)
+            args += " oritab=%s startit=%d" % (PRIME_ORITAB % resumeIter,
+                                               resumeIter + 1)
+        elif self.doWarmStart:
+            for state in range(1, self.Nvolumes.get() + 1):
+                args += " vol%d=%s" % (state, os.path.relpath(
+                    self._getStartVolume(state), runDir))
+        elif self._getStageResolutions():
+            args += self._runCoarseStages(runDir, threads)
+        if self.doWarmStart:
+            args += " maxits=%d" % self.warmIterations
+        # The output is followed from the log, where it is also kept
+        # for scoring the runs of an ensemble afterwards
+        args += " %s %s 2>&1" % ('>>' if resumeIter else '>', PRIME_LOG)
+
+        t0 = time.time()
+        convergedIter = self._runPrimeProcess(
+            runDir, args, self._getIterationHandlers(runDir),
+            firstIter=max(resumeIter, 1), threads=threads,
+            echo=not self._isEnsemble(), appendLog=bool(resumeIter))
+        if self._getStageResolutions():
+            lowPass = None if self.dynamicFilter else self.maxResolution.get()
+            self._reportStage(runDir, "final", self._getPrimeBox(), lowPass,
+                              time.time() - t0)
+        return convergedIter
+
+    def _runCoarseStages(self, runDir, threads):
+        """ Run the coarse stages of the resolution schedule inside runDir,
+        each one seeded with the result of the previous one. Return the
+        arguments to start the final run from the last stage.
+        """
+        prevDir = prevBox = None
+        for i, lowPass in enumerate(self._getStageResolutions(), 1):
+            stageDir = self._getStageDir(runDir, i)
+            makePath(stageDir)
+            box = self._getStageBox(lowPass)
+            args = self._getPrimeArgs(
+                os.path.relpath(self._getStageStack(i), stageDir), threads,
+                box=box, lowPass=lowPass)
+            if prevDir is not None:
+                args += self._seedFromStage(prevDir, prevBox, stageDir, box)
+            args += " maxits=%d > %s 2>&1" % (self.stageIterations, PRIME_LOG)
+
+            handlers = []
+            if self.doEarlyStop:
+                handlers.append(ConvergenceMonitor(
+                    self.convergenceThreshold.get(),
+                    self.convergenceIterations.get(),
+                    lambda it, d=stageDir: self._stopPrime(d)))
+            t0 = time.time()
+            self._runPrimeProcess(stageDir, args, handlers, threads=threads)
+            self._reportStage(stageDir, "stage %d" % i, box, lowPass,
+                              time.time() - t0)
+            prevDir, prevBox = stageDir, box
+
+        return self._seedFromStage(prevDir, prevBox, runDir,
+                                   self._getPrimeBox())
+
+    def _seedFromStage(self, stageDir, stageBox, destDir, box):
+        """ Resize the last volumes of the stage run in stageDir to box and
+        rescale the shifts of its alignment doc, writing both in destDir.
+        Return the simple_prime arguments to start from them.
+        """
+        manifest = IterationManifest(stageDir)
+        lastIter = manifest.getLastIteration()
+        args = ""
+        for state, fnVol in enumerate(manifest.getFiles('recvol',
+                                                        iteration=lastIter), 1):
+            fnSeed = 'seedvol_state%d.spi' % state
+            resizeVolume(fnVol, os.path.join(destDir, fnSeed), box)
+            args += " vol%d=%s" % (state, fnSeed)
+        fnOritab = os.path.join(stageDir, PRIME_ORITAB % lastIter)
+        if os.path.exists(fnOritab):
+            scaleOritab(fnOritab, os.path.join(destDir, 'seed_oritab.txt'),
+                        float(box) / stageBox)
+            args += " oritab=seed_oritab.txt"
+        return args
+
+    def _reportStage(self, runDir, label, box, lowPass, elapsed):
+        """ Add a line about a finished stage to the stage report. """
+        score = getFinalScore(os.path.join(runDir, PRIME_LOG))
+        line = ("%s %s: box %d px, lp %s, %d iterations, %0.1f min, "
+                "final correlation %s"
+                % (os.path.basename(os.path.normpath(runDir)), label, box,
+                   "dynamic" if lowPass is None else "%0.1f A" % lowPass,
+                   self.getLastIteration(runDir), elapsed / 60.,
+                   "n/a" if score is None else "%0.4f" % score))
+        self.info(line)
+        with self._outputLock:
+            report = self.stageReport.get()
+            self.stageReport.set(line if not report else report + '\n' + line)
+            self._store(self.stageReport)
+
+    def _runPrimeProcess(self, runDir, args, handlers, firstIter=1,
+                         nstates=None, threads=1, echo=False, appendLog=False):
+        """ Run simple_prime in runDir while the handlers follow its
+        iterations and its log (where args should redirect the output) is
+        parsed into per-iteration metrics. With echo, the log is also
+        printed as it is written.
+        Return the iteration where it converged or None. """
+        watcher = IterationWatcher(runDir, nstates or self.Nvolumes.get(),
+                                   handlers, firstIter=firstIter)
+        if handlers:
+            watcher.start()
+        follower = PrimeLogFollower(os.path.join(runDir, PRIME_LOG),
+                                    os.path.join(runDir, PRIME_METRICS),
+                                    echo=self._echoLine if echo else None,
+                                    append=appendLog)
+        follower.start()
+        try:
+            self._executePrime(runDir, args, threads)
+        except Exception:
+            # simple_prime fails when it is stopped after converging
+            if self._getConvergedIteration(handlers) is None:
+                raise
+        finally:
+            follower.stop()
+            if handlers:
+                watcher.stop()
+
+        for handler in handlers:
+            if isinstance(handler, RetentionPolicy):
+                with self._outputLock:
+                    # Concurrent runs add up their peaks
+                    self.peakDiskBytes.set(self.peakDiskBytes.get() +
+                                           handler.peakBytes)
+                    self.unretainedDiskBytes.set(
+                        self.unretainedDiskBytes.get() +
+                        handler.unretainedBytes)
+                    self._store(self.peakDiskBytes, self.unretainedDiskBytes)
+
+        convergedIter = self._getConvergedIteration(handlers)
+        if convergedIter is not None:
+            self.info("simple_prime converged at iteration %d in %s"
+                      % (convergedIter, runDir))
+            # Remove anything written after the converged iteration
+            manifest = IterationManifest(runDir)
+            manifest.remove([e for e in manifest.getEntries()
+                             if e['kind'] in ['recvol', 'oritab'] and
+                             e['iteration'] > convergedIter])
+        return convergedIter
+
+    def _executePrime(self, runDir, args, threads):
+        """ Run simple_prime in runDir, here or packed with other runs
+        into a batch submission. """
+        fnStop = os.path.join(runDir, STOP_FILE)
+        if os.path.exists(fnStop):
+            os.remove(fnStop)
+        unknownKeys = checkProgramArgs(simple.Plugin.getCapabilities(), args)
+        if unknownKeys:
+            raise Exception("%s does not accept the arguments: %s. Check the "
+                            "SIMPLE version (%s supported)."
+                            % (simple.Plugin.getProgram(),
+                               ", ".join(unknownKeys),
+                               ", ".join(simple.Plugin._supportedVersions)))
+        if self._coordinator is not None:
+            self._executeDistributed(runDir, args)
+            return
+        spool = simple.Plugin.getBatchSpool() if self.useBatch else None
+        if spool is None:
+            self.runJob(simple.Plugin.getProgram(), args,
+                        cwd=runDir,
+                        env=simple.Plugin.getEnviron())
+            return
+
+        jobId = spool.addJob("%s %s" % (simple.Plugin.getProgram(), args),
+                             runDir, simple.Plugin.getEnviron(), threads)
+        self.info("simple_prime waiting to be submitted in a batch as %s"
+                  % jobId)
+        exitCode = spool.waitJob(jobId)
+        if exitCode != 0:
+            raise Exception("simple_prime failed with exit code %d (batch "
+                            "job %s)" % (exitCode, jobId))
+
+    def _executeDistributed(self, runDir, args):
+        """ Queue simple_prime in the coordinator and wait for a worker to
+        run it. The stack is staged by the workers and the other input
+        files given in args (relative to runDir) are sent with the task,
+        under their base name in the task folder. """
+        fnStack = os.path.join(runDir, re.search(r'(?:^|\s)stk=(\S+)',
+                                                 args).group(1))
+        st = os.stat(fnStack)
+        stackKey = hashItems([os.path.abspath(fnStack), st.st_size,
+                              st.st_mtime])
+        inputs = {}
+        for key, value in re.findall(r'(?:^|\s)(\w+)=(\S+)', args):
+            fn = os.path.normpath(os.path.join(runDir, value))
+            if key == 'stk' or not os.path.isfile(fn):
+                continue
+            name = os.path.basename(fn)
+            if inputs.get(name, fn) != fn:
+                name = '%s_%s' % (key, name)
+            inputs[name] = fn
+            args = re.sub(r'(^|\s)%s=\S+' % key,
+                          lambda m: '%s%s=%s' % (m.group(1), key, name), args)
+        fnLog = os.path.join(runDir, PRIME_LOG)
+        if '>> %s' % PRIME_LOG in args and os.path.exists(fnLog):
+            appendBase = os.path.getsize(fnLog)
+        else:
+            appendBase = 0
+            open(fnLog, 'w').close()
+
+        taskId = self._coordinator.addTask(
+            simple.Plugin.getProgram(), args, runDir, fnStack, stackKey,
+            simple.Plugin.getEnviron(),
+            inputs=[(fn, name) for name, fn in sorted(inputs.items())],
+            appendFiles=[PRIME_LOG], appendBase=appendBase)
+        self.info("simple_prime queued for the workers as task %s" % taskId)
+        exitCode = None
+        while exitCode is None:
+            exitCode = self._coordinator.waitTask(taskId, timeout=10)
+            if (exitCode is None and
+                    all(p.poll() is not None for p in self._workerProcesses)):
+                raise Exception("All the workers have finished before "
+                                "running task %s, see %s"
+                                % (taskId, self._getWorkersLog()))
+        if exitCode != 0:
+            raise Exception("simple_prime failed with exit code %d (task %s)"
+                            % (exitCode, taskId))
+
+    def _getWorkersLog(self):
+        return self._getExtraPath('workers.log')
+
+    def _runWorkers(self, func, *args):
+        """ Return func(*args), called while the coordinator and the
+        workers are running if the execution is distributed. The
+        throughput of every node is reported at the end. """
+        if not self.useDistributed:
+            return func(*args)
+
+        tokenFile = self._getExtraPath('coordinator.token')
+        self._coordinator = Coordinator(tokenFile)
+        self._coordinator.start()
+        self.info("Coordinator listening at %s" % self._coordinator.address)
+        self._workerProcesses = simple.Plugin.launchWorkers(
+            self._coordinator.address, tokenFile,
+            self.distributedWorkers.get(), logFile=self._getWorkersLog())
+        try:
+            return func(*args)
+        finally:
+            self._coordinator.close()
+            self._reportNodes(self._coordinator.getNodeStats())
+            self._coordinator = None
+            for proc in self._workerProcesses:
+                if proc.poll() is None:
+                    proc.terminate()
+            os.remove(tokenFile)
+
+    def _reportNodes(self, nodes):
+        lines = []
+        for node, stats in sorted(nodes.items()):
+            hours = stats['busy'] / 3600.
+            lines.append("%s: %d worker(s), %d run(s), %d volumes in %0.1f "
+                         "min (%0.1f volumes/h), %s received, stack staged "
+                         "%d time(s) in %0.1f s"
+                         % (node, stats['workers'], stats['tasks'],
+                            stats['volumes'], stats['busy'] / 60.,
+                            stats['volumes'] / hours if hours else 0,
+                            pwutils.prettySize(stats['bytes']),
+                            stats['staged'], stats['stageTime']))
+            self.info("Node %s" % lines[-1])
+        report = self.nodeReport.get()
+        self.nodeReport.set("\n".join(([report] if report else []) + lines))
+        self._store(self.nodeReport)
+
+    def _stopPrime(self, runDir):
+        """ Stop the simple_prime running in runDir, here or in a batch. """
+        open(os.path.join(runDir, STOP_FILE), 'w').close()
+        terminateProcesses(runDir)
+
+    def _getIterationHandlers(self, runDir):
+        """ Return the objects that should follow the iterations of the
+        simple_prime execution in runDir while it runs. """
+        handlers = []
+        if self.doEarlyStop:
+            handlers.append(ConvergenceMonitor(
+                self.convergenceThreshold.get(),
+                self.convergenceIterations.get(),
+                lambda it: self._stopPrime(runDir)))
+        if self._isStreaming():
+            handlers.append(IterationCallback(self._publishIteration))
+        if self.doThumbnails:
+            handlers.append(self._getThumbnailWriter(runDir))
+        if self.keepIntermediate:
+            if self.compressIntermediate:
+                handlers.append(RetentionPolicy(compress=True))
+        elif self.retainIterations > 0 or self.diskBudget > 0:
+            handlers.append(RetentionPolicy(
+                keepIterations=self.retainIterations.get(),
+                maxBytes=int(self.diskBudget.get() * 1024 ** 3)))
+        return handlers
+
+    def _isStreaming(self):
+        return self.doStreaming and not self._isEnsemble()
+
+    def _getThumbnailWriter(self, runDir):
+        return ThumbnailWriter(
+            ThumbnailCache(os.path.join(runDir, PRIME_THUMBNAILS)),
+            THUMBNAIL_SIZE, THUMBNAIL_MIN_SIZE)
+
+    def getThumbnailCache(self, runDir=None):
+        """ Return the indexed ThumbnailCache of the best run (or the one
+        in runDir). """
+        cache = ThumbnailCache(os.path.join(runDir or self._getBestRunDir(),
+                                            PRIME_THUMBNAILS))
+        cache.scan()
+        return cache
+
+    def _publishIteration(self, iteration, files):
+        self._publishVolumes(files, self._getPrimeSamplingRate(),
+                             "iteration %d" % iteration)
+
+    def _publishVolumes(self, files, samplingRate, comment, closeStream=False):
+        """ Create or update the outputs with the given volumes. Outputs
+        point to stable links in extra/ that are replaced on every update.
+        """
+        with self._outputLock:
+            liveFiles = []
+            for state, fn in enumerate(files, 1):
+                liveFn = self._getExtraPath('live_state%02d%s'
+                                            % (state, os.path.splitext(fn)[1]))
+                linkFile(fn, liveFn)
+                liveFiles.append(liveFn)
+
+            if self.Nvolumes == 1:
+                if self.hasAttribute('outputVol'):
+                    # Final volumes may be in another format and box than
+                    # the iterations, so the location is updated too
+                    vol = self.outputVol
+                    getVolumeDim(liveFiles[0])
+                    vol.setLocation(liveFiles[0])
+                else:
+                    vol = self._createOutputVolume(liveFiles[0], samplingRate)
+                vol.setSamplingRate(samplingRate)
+                vol.setObjComment(comment)
+                if self.hasAttribute('outputVol'):
+                    self._store(vol)
+                else:
+                    self._defineOutputs(outputVol=vol)
+                    self._defineSourceRelation(self.inputClasses, vol)
+                return
+
+            if self.hasAttribute('outputVolumes'):
+                volSet = self.outputVolumes
+                volSet.enableAppend()
+                # Final volumes may be in another format than the
+                # iterations, so their locations are updated too
+                for item, liveFn in zip([v.clone() for v in volSet],
+                                        liveFiles):
+                    item.setLocation(liveFn)
+                    item.setSamplingRate(samplingRate)
+                    volSet.update(item)
+            else:
+                volSet = self._createOutputSet(liveFiles, samplingRate)
+            volSet.setSamplingRate(samplingRate)
+            volSet.setDim(getVolumeDim(liveFiles[0]))
+            volSet.setObjComment(comment)
+            volSet.setStreamState(volSet.STREAM_CLOSED if closeStream
+                                  else volSet.STREAM_OPEN)
+            volSet.write()
+            if self.hasAttribute('outputVolumes'):
+                self._store(volSet)
+            else:
+                self._defineOutputs(outputVolumes=volSet)
+                self._defineSourceRelation(self.inputClasses, volSet)
+
+    def _createOutputVolume(self, fnVolume, samplingRate):
+        """ Return a Volume for a SPIDER or MRC file, checked from its
+        header only. """
+        getVolumeDim(fnVolume)
+        vol = em.Volume()
+        vol.setLocation(fnVolume)
+        vol.setSamplingRate(samplingRate)
+        return vol
+
+    def _createStatesSet(self, fnPrimeVolumes, fnVolumes, samplingRate,
+                         suffix='', lowPass=None, symmetryGroup=None):
+        """ Return the output set with the final volumes of a run, after
+        comparing them if requested. The prime volumes (at the box of
+        the run) are compared, and the output ones registered. """
+        if not self.compareStates or len(fnVolumes) < 2:
+            return self._createOutputSet(fnVolumes, samplingRate, suffix)
+
+        symmetryGroup = symmetryGroup or self.symmetryGroup.get()
+        orientations = getGridOrientations(symmetryGroup)
+        # All states are compared in one batch of memory mapped volumes
+        comparison = compareVolumes(
+            [memmapVolume(fn) for fn in fnPrimeVolumes],
+            self._getPrimeSamplingRate(),
+            self._getComparisonResolution(lowPass), orientations)
+        redundant = findRedundantStates(comparison['correlation'],
+                                        self.stateThreshold.get())
+        comments = [""] * len(fnVolumes)
+        for i, j in enumerate(redundant):
+            if j >= 0:
+                comments[i] = ("redundant with volume %d (correlation %0.3f)"
+                               % (j + 1, comparison['correlation'][j][i]))
+                self.info("Volume %d is %s" % (i + 1, comments[i]))
+
+        distinct = [i for i, j in enumerate(redundant) if j < 0]
+        if self.redundantStates == REDUNDANT_REMOVE:
+            fnVolumes = [fnVolumes[i] for i in distinct]
+            comments = [comments[i] for i in distinct]
+        elif self.redundantStates == REDUNDANT_MERGE:
+            merged = mergeStates([memmapVolume(fn) for fn in fnVolumes],
+                                 redundant, orientations,
+                                 comparison['orientation'])
+            fnVolumes = [self._writeMergedVolume(fnVolumes[i], data,
+                                                 samplingRate)
+                         for i, data in zip(distinct, merged)]
+            comments = ["average of volumes %s" %
+                        " ".join(str(k + 1) for k, j in enumerate(redundant)
+                                 if k == i or j == i)
+                        for i in distinct]
+
+        volSet = self._createOutputSet(fnVolumes, samplingRate, suffix,
+                                       comments)
+        volSet.stateComparison = pwobj.String(json.dumps({
+            'correlation': comparison['correlation'].round(4).tolist(),
+            'resolution': comparison['resolution'].round(2).tolist(),
+            'redundant': redundant,
+            'threshold': self.stateThreshold.get(),
+            'symmetryGroup': symmetryGroup}))
+        volSet.write()
+        return volSet
+
+    def _getComparisonResolution(self, lowPass=None):
+        if lowPass is not None:
+            return lowPass
+        if self.dynamicFilter:
+            return 2 * self._getPrimeSamplingRate()
+        return self.maxResolution.get()
+
+    def _writeMergedVolume(self, fnVolume, data, samplingRate):
+        fnMerged = fnVolume.replace('recvol_', 'merged_')
+        if fnMerged.endswith('.mrc'):
+            writeMrcVolume(fnMerged, data, samplingRate)
+        else:
+            writeSpiderVolume(fnMerged, data)
+        return fnMerged
+
+    def getStateComparison(self, volSet=None):
+        """ Return the comparison of the final states stored with the
+        output set (as a dict with the correlation and resolution
+        matrices, the redundant state of every state or -1 and the
+        threshold used), or None. """
+        volSet = volSet or getattr(self, 'outputVolumes', None)
+        comparison = getattr(volSet, 'stateComparison', None)
+        if comparison is None or not comparison.get():
+            return None
+        return json.loads(comparison.get())
+
+    def _createOutputSet(self, fnVolumes, samplingRate, suffix='',
+                         comments=None):
+        """ Return a SetOfVolumes with the given SPIDER or MRC files.
+        Dimensions are taken from their headers, so the set does not need
+        to open any volume, and all of them are written to the set at
+        once. """
+        dims = [getVolumeDim(fn) for fn in fnVolumes]
+        if len(set(dims)) > 1:
+            raise Exception("Volumes of different sizes: %s"
+                            % ", ".join(fnVolumes))
+        volSet = self._createSetOfVolumes(suffix=suffix)
+        volSet.setSamplingRate(samplingRate)
+        if dims:
+            volSet.setDim(dims[0])
+        for fnVolume, comment in zip(fnVolumes,
+                                     comments or [""] * len(fnVolumes)):
+            vol = em.Volume()
+            vol.setLocation(fnVolume)
+            vol.setSamplingRate(samplingRate)
+            if comment:
+                vol.setObjComment(comment)
+            volSet.append(vol)
+        volSet.write()
+        return volSet
+
+    def _getConvergedIteration(self, handlers):
+        for handler in handlers:
+            if isinstance(handler, ConvergenceMonitor):
+                return handler.convergedIter
+        return None
+
+    def _getPrimeArgs(self, fnStack, threads, box=None, lowPass=None,
+                      symmetryGroup=None, nstates=None):
+        box = box or self._getPrimeBox()
+        # Pixel based parameters refer to the input box
+        scale = float(box) / self._getInputBox()
+        args = "stk=%s box=%d smpd=%f pgrp=%s" % (fnStack, box,
+                                                  self._getPrimeSamplingRate(box),
+                                                  symmetryGroup or
+                                                  self.symmetryGroup)
+
+        if lowPass is not None:
+            args += " lp=%f" % lowPass
+        elif self.dynamicFilter:
+            args += " dynlp=yes"
+        else:
+            args += " lp=%f" % self.maxResolution
+        args += " trs=%d trsstep=%d" % (round(self.maximumShift.get() * scale),
+                                        max(1, round(self.shiftStep.get() * scale)))
+        args += " nstates=%d" % (nstates or self.Nvolumes.get())
+        args += " nthr=%d" % threads
+
+        if self.outerMask > 0:
+            args += " ring2=%f" % (self.outerMask.get() * scale)
+        args += " frac=%f" % self.fractionParticles
+
+        if self.molecularWeight > 0:
+            args += " mw=%f" % self.molecularWeight
+        return args
+
+    def _getResumeIteration(self, runDir):
+        """ Return the last iteration left complete by a previous execution
+        in runDir (volumes of every state and alignment doc), or 0. """
+        for it in range(self.getLastIteration(runDir), 0, -1):
+            if self._isIterationComplete(runDir, it):
+                return it
+        return 0
+
+    def _isIterationComplete(self, runDir, it):
+        for state in range(1, self.Nvolumes.get() + 1):
+            fnVol = os.path.join(runDir, "recvol_state%d_iter%d.spi"
+                                 % (state, it))
+            if not isCompleteSpiderFile(fnVol):
+                return False
+
+        # The alignment doc should have a line per image
+        fnDoc = os.path.join(runDir, PRIME_ORITAB % it)
+        if not os.path.exists(fnDoc):
+            return False
+        with open(fnDoc) as f:
+            lines = [line for line in f if line.strip()]
+        header = readSpiderHeader(self._getExtraPath("classes.spi"))
+        return header is not None and len(lines) >= header['maxim']
+
+    def _getElapsedTime(self, runDir, it):
+        """ Estimate the time (in seconds) spent in the first iterations
+        from the modification time of their volumes. """
+        entries = [e for e in IterationManifest(runDir).getEntries('recvol', 1)
+                   if e['iteration'] <= it]
+        if len(entries) < 2:
+            return 0
+        first, last = entries[0], entries[-1]
+        elapsed = last['mtime'] - first['mtime']
+        return elapsed * last['iteration'] / (last['iteration'] - first['iteration'])
+
+    def _writeInputStack(self, fnStack, box):
+        writeSpiderStack(fnStack, self._getInputLocations(), box=box)
+
+    def _getInputVolumes(self):
+        """ Return the list of starting volumes given as input. """
+        initialVolumes = self.initialVolumes.get()
+        if initialVolumes is None:
+            return []
+        if isinstance(initialVolumes, em.Volume):
+            return [initialVolumes]
+        return [vol.clone() for vol in initialVolumes]
+
+    def _getStartVolume(self, state):
+        return self._getExtraPath("startvol_input_state%d.spi" % state)
+
+    def _convertStartVolumes(self):
+        """ Write the starting volumes in SPIDER format with the box size
+        and sampling rate of the stack given to simple_prime. """
+        for state, vol in enumerate(self._getInputVolumes(), 1):
+            data = resampleVolume(readImageData(vol.getLocation()),
+                                  vol.getSamplingRate(),
+                                  self._getPrimeSamplingRate(),
+                                  self._getPrimeBox())
+            writeSpiderVolume(self._getStartVolume(state), data)
+
+    def _getInputStacks(self):
+        """ Return the (filename, box) of the stacks given to simple_prime:
+        the one of the final run and one per coarse stage. """
+        stacks = [(self._getExtraPath("classes.spi"), self._getPrimeBox())]
+        for i, lowPass in enumerate(self._getStageResolutions(), 1):
+            stacks.append((self._getStageStack(i), self._getStageBox(lowPass)))
+        return stacks
+
+    def _getStageResolutions(self):
+        """ Return the low pass (in A) of every coarse stage. """
+        return [float(lp) for lp in
+                (self.resolutionSchedule.get() or '').replace(',', ' ').split()]
+
+    def _getStageBox(self, lowPass):
+        return getDownsampledBox(self._getInputBox(),
+                                 self.inputClasses.get().getSamplingRate(),
+                                 lowPass)
+
+    def _getStageStack(self, stage):
+        return self._getExtraPath("classes_stage%02d.spi" % stage)
+
+    def _getStageDir(self, runDir, stage):
+        return os.path.join(runDir, 'stage_%02d' % stage)
+
+    def _getInputLocations(self):
+        """ Return the (index, filename) of the input averages given to
+        simple_prime, only the selected ones after pre-screening. """
+        selection = self._getSelection()
+        return [location for objId, location in self._getAllInputLocations()
+                if selection is None or objId in selection]
+
+    def _getAllInputLocations(self):
+        """ Return the (objId, (index, filename)) of all input averages. """
+        locations = []
+        for item in self.inputClasses.get():
+            objId = item.getObjId()
+            if isinstance(item, em.Class2D):
+                item = item.getRepresentative()
+            locations.append((objId, item.getLocation()))
+        return locations
+
+    def _screenAverages(self):
+        """ Score all input averages and write the selection file with
+        the ones that should be given to simple_prime. """
+        makePath(self._getTmpPath())
+        fnScreen = self._getTmpPath('screening.spi')
+        allLocations = self._getAllInputLocations()
+        writeSpiderStack(fnScreen, [loc for _, loc in allLocations],
+                         box=min(self._getInputBox(), SCREENING_BOX))
+        stack = memmapStack(fnScreen)
+        scores = scoreAverages(stack)
+        duplicates = findDuplicates(stack, self.duplicateThreshold.get())
+        selected = set(selectAverages(scores['score'], duplicates,
+                                      self.screeningFraction.get()))
+        del stack
+
+        with open(self._getExtraPath(SCREENING_FILE), 'w') as f:
+            f.write("# classId score snr falloff centering duplicateOf "
+                    "selected\n")
+            for i, (objId, _) in enumerate(allLocations):
+                duplicateOf = (allLocations[duplicates[i]][0]
+                               if duplicates[i] >= 0 else 0)
+                f.write("%d %f %f %f %f %d %d\n"
+                        % (objId, scores['score'][i], scores['snr'][i],
+                           scores['falloff'][i], scores['centering'][i],
+                           duplicateOf, i in selected))
+        self.info("Pre-screening kept %d of %d averages"
+                  % (len(selected), len(allLocations)))
+
+    def _getSelection(self):
+        """ Return the ids of the input classes kept by pre-screening or
+        None when they were not screened. """
+        fnSelection = self._getExtraPath(SCREENING_FILE)
+        if not self.doScreening or not os.path.exists(fnSelection):
+            return None
+        selection = set()
+        with open(fnSelection) as f:
+            for line in f:
+                values = line.split()
+                if values and not line.startswith('#') and int(values[-1]):
+                    selection.add(int(values[0]))
+        return selection
+
+    def _getStackKey(self, box):
+        """ Return a key identifying the converted stack: it depends on
+        the input images (and their files) and on the conversion done. """
+        inputClasses = self.inputClasses.get()
+        keyItems = [inputClasses.getSamplingRate(), box]
+        fileStats = {}
+        for index, fn in self._getInputLocations():
+            if fn not in fileStats:
+                st = os.stat(fn.split(':')[0])
+                fileStats[fn] = (st.st_size, st.st_mtime)
+            keyItems.append((index, fn, fileStats[fn]))
+        return hashItems(keyItems)
+
+    def _getInputBox(self):
+        xdim, _, _ = self.inputClasses.get().getDimensions()
+        return xdim
+
+    def _getPrimeBox(self):
+        """ Return the box size of the stack given to simple_prime. """
+        xdim = self._getInputBox()
+        if self.doDownsample and not self.dynamicFilter:
+            return getDownsampledBox(xdim,
+                                     self.inputClasses.get().getSamplingRate(),
+                                     self.maxResolution.get())
+        return xdim
+
+    def _getPrimeSamplingRate(self, box=None):
+        return (self.inputClasses.get().getSamplingRate() *
+                self._getInputBox() / float(box or self._getPrimeBox()))
+
+    def _getOutputVolume(self, fnVolume):
+        """ Return the volume to register as output, padding it back to
+        the input box size when prime ran on a downsampled stack, and
+        converting it to MRC if requested. """
+        xdim = self._getInputBox()
+        if self.outputFormat == OUTPUT_MRC:
+            fnMrc = fnVolume.replace('.spi', '.mrc')
+            convertVolumeToMrc(fnVolume, fnMrc,
+                               self.inputClasses.get().getSamplingRate(),
+                               box=xdim)
+            return fnMrc
+        if self._getPrimeBox() == xdim:
+            return fnVolume
+        fnFull = fnVolume.replace('.spi', '_fullsize.spi')
+        resizeVolume(fnVolume, fnFull, xdim)
+        return fnFull
@@ -0,0 +1,252 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar S. Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import time
+import itertools
+
+import pyworkflow.object as pwobj
+import pyworkflow.protocol.params as params
+from pyworkflow.utils.path import makePath
+
+from simple.constants import *
+from simple.convert import getDownsampledBox
+from simple.execution import scheduleJobs
+from simple.manifest import IterationManifest
+from simple.telemetry import telemetryStep
+from simple.tuning import estimatePrimeCost
+
+from protocol_prime import ProtPrime
+
+
+class ProtPrimeSweep(ProtPrime):
+    """ Runs simple prime for every combination of several symmetry groups,
+    numbers of volumes and resolutions, converting the input only once """
+    _label = 'prime sweep'
+
+    # Parameters of ProtPrime that do not apply to the sweep
+    UNUSED_PARAMS = ['numberOfRuns', 'doStreaming', 'autoThreads',
+                     'resolutionSchedule', 'stageIterations', 'doWarmStart']
+
+    def __init__(self, **kwargs):
+        ProtPrime.__init__(self, **kwargs)
+        self.sweepTimes = pwobj.String()
+
+    # --------------------------- DEFINE param functions ----------------------
+    def _defineParams(self, form):
+        ProtPrime._defineParams(self, form)
+        for paramName in self.UNUSED_PARAMS:
+            form.getParam(paramName).condition.set('False')
+
+        form.addSection('Sweep')
+        form.addParam('symmetryGroups', params.StringParam,
+                      default='',
+                      label='Symmetry groups',
+                      help="Symmetry groups to try, separated by spaces "
+                           "(e.g. 'c1 c2 d2'). Leave empty to use only the "
+                           "symmetry group of the Input tab.")
+        form.addParam('volumesList', params.StringParam,
+                      default='',
+                      label='Numbers of volumes',
+                      help="Numbers of volumes to try, separated by spaces "
+                           "(e.g. '1 2 3'). Leave empty to use only the "
+                           "number of volumes of the Input tab.")
+        form.addParam('resolutionsList', params.StringParam,
+                      default='',
+                      condition="not dynamicFilter",
+                      label='Max. resolutions (A)',
+                      help="Max. resolutions to try, separated by spaces "
+                           "(e.g. '20 15'). Leave empty to use only the "
+                           "max. resolution of the Input tab.")
+        form.addParam('threadsPerRun', params.IntParam,
+                      default=4,
+                      label='Threads per run',
+                      help="Threads used by every simple_prime run. Runs are "
+                           "executed concurrently while their threads fit "
+                           "in the total number of threads, starting from "
+                           "the most expensive ones.")
+
+    # --------------------------- INSERT steps functions ----------------------
+    def _insertAllSteps(self):
+        self._insertFunctionStep('convertInputStep')
+        self._insertFunctionStep('runSweepStep')
+        if not self.keepIntermediate:
+            self._insertFunctionStep('cleanPrime')
+        self._insertFunctionStep('createSweepOutputStep')
+
+    # --------------------------- STEPS functions -----------------------------
+    @telemetryStep
+    def runSweepStep(self):
+        threads = min(self.threadsPerRun.get(), self.numberOfThreads.get())
+        jobs = []
+        for i, combination in enumerate(self._getCombinations(), 1):
+            cost = estimatePrimeCost(self._getPrimeBox(),
+                                     self._getPrimeSamplingRate(),
+                                     combination['lowPass'] or
+                                     self.maxResolution.get(),
+                                     combination['nstates'],
+                                     combination['symmetryGroup'])
+            jobs.append((cost, threads, (i, combination, threads)))
+        budget = self.numberOfThreads.get()
+        if self.useDistributed:
+            # Every node runs one combination at a time
+            budget = threads * self.distributedWorkers.get()
+        times = self._runWorkers(scheduleJobs, self._runCombination, jobs,
+                                 budget)
+        self.sweepTimes.set(" ".join("%0.1f" % t for t in times))
+        self._store(self.sweepTimes)
+
+    @telemetryStep
+    def createSweepOutputStep(self):
+        samplingRate = self.inputClasses.get().getSamplingRate()
+        times = [float(t) for t in self.sweepTimes.get().split()]
+        outputs = {}
+        for i, combination in enumerate(self._getCombinations(), 1):
+            runDir = self._getCombinationDir(i)
+            manifest = IterationManifest(runDir)
+            manifest.write(os.path.join(runDir, 'manifest.json'))
+            lastIter = manifest.getLastIteration()
+            if lastIter <= 1:
+                self.warning("No volumes for %s"
+                             % self._getCombinationLabel(combination))
+                continue
+
+            fnVolumes = manifest.getFiles('recvol', iteration=lastIter)
+            volSet = self._createStatesSet(
+                fnVolumes, [self._getOutputVolume(fn) for fn in fnVolumes],
+                samplingRate, suffix='_%02d' % i,
+                lowPass=combination['lowPass'],
+                symmetryGroup=combination['symmetryGroup'])
+            volSet.setObjLabel(self._getCombinationLabel(combination))
+            volSet.setObjComment("%d iterations in %0.1f min"
+                                 % (lastIter, times[i - 1] / 60.))
+            outputs['outputVolumes_%02d' % i] = volSet
+
+        self._defineOutputs(**outputs)
+        for volSet in outputs.values():
+            self._defineSourceRelation(self.inputClasses, volSet)
+
+    # --------------------------- INFO functions ------------------------------
+    def _validate(self):
+        errors = ProtPrime._validate(self)
+        try:
+            combinations = self._getCombinations()
+        except ValueError:
+            errors.append("The numbers of volumes and resolutions should be "
+                          "numbers separated by spaces.")
+            combinations = []
+        if any(c['nstates'] < 1 for c in combinations):
+            errors.append("The numbers of volumes should be at least 1.")
+        return errors
+
+    def _summary(self):
+        summary = ProtPrime._summary(self)
+        times = (self.sweepTimes.get() or '').split()
+        try:
+            combinations = self._getCombinations()
+        except ValueError:  # reported by _validate
+            combinations = []
+        for i, combination in enumerate(combinations, 1):
+            line = "Run %d: %s" % (i, self._getCombinationLabel(combination))
+            if i <= len(times):
+                line += " (%0.1f min)" % (float(times[i - 1]) / 60.)
+            summary.append(line)
+        return summary
+
+    # -------------------------- UTILS functions ------------------------------
+    def _getCombinations(self):
+        """ Return a dict with the symmetryGroup, nstates and lowPass
+        (None for dynamic filtering) of every run of the sweep. """
+        symmetryGroups = (self.symmetryGroups.get() or '').split()
+        volumes = [int(n) for n in (self.volumesList.get() or '').split()]
+        if self.dynamicFilter:
+            resolutions = [None]
+        else:
+            resolutions = [float(lp) for lp in
+                           (self.resolutionsList.get() or '').split()]
+        return [{'symmetryGroup': sym, 'nstates': n, 'lowPass': lp}
+                for sym, n, lp in itertools.product(
+                    symmetryGroups or [self.symmetryGroup.get()],
+                    volumes or [self.Nvolumes.get()],
+                    resolutions or [self.maxResolution.get()])]
+
+    def _getCombinationLabel(self, combination):
+        label = "%s, %d volume(s)" % (combination['symmetryGroup'],
+                                      combination['nstates'])
+        if combination['lowPass'] is not None:
+            label += ", %0.1f A" % combination['lowPass']
+        return label
+
+    def _getCombinationDir(self, index):
+        return self._getExtraPath('sweep_%02d' % index)
+
+    def _runCombination(self, index, combination, threads):
+        """ Run simple_prime for one combination and return the elapsed
+        time in seconds. """
+        runDir = self._getCombinationDir(index)
+        makePath(runDir)
+        args = self._getPrimeArgs(
+            os.path.relpath(self._getExtraPath("classes.spi"), runDir), threads,
+            lowPass=combination['lowPass'],
+            symmetryGroup=combination['symmetryGroup'],
+            nstates=combination['nstates'])
+        args += " > %s 2>&1" % PRIME_LOG
+
+        t0 = time.time()
+        self._runPrimeProcess(runDir, args,
+                              self._getIterationHandlers(runDir),
+                              nstates=combination['nstates'], threads=threads)
+        elapsed = time.time() - t0
+        self.info("%s finished in %0.1f min"
+                  % (self._getCombinationLabel(combination), elapsed / 60.))
+        return elapsed
+
+    def _getRunDirs(self):
+        return [self._getCombinationDir(i) for i, _ in
+                enumerate(self._getCombinations(), 1)]
+
+    def _getStageResolutions(self):
+        return []
+
+    def _isEnsemble(self):
+        return False
+
+    def _isStreaming(self):
+        return False
+
+    def _getPrimeBox(self):
+        """ The stack is shared by all runs, so it is downsampled for the
+        best resolution of the sweep. """
+        xdim = self._getInputBox()
+        if self.doDownsample and not self.dynamicFilter:
+            try:
+                lowPass = min(c['lowPass'] for c in self._getCombinations())
+            except ValueError:  # reported by _validate
+                lowPass = self.maxResolution.get()
+            return getDownsampledBox(xdim,
+                                     self.inputClasses.get().getSamplingRate(),
+                                     lowPass)
+        return xdim
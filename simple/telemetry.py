@@ -0,0 +1,189 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import json
+import time
+import resource
+import threading
+from functools import wraps
+
+
+class ProcessTreeSampler(threading.Thread):
+    """ Periodically sample the resources used by the current process and
+    all its children (e.g. simple_prime launched through runJob): CPU
+    usage, resident memory, bytes read/written and number of threads.
+    Every sample is passed to the onSample callback as a dict.
+    """
+    def __init__(self, interval, onSample):
+        import psutil
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.onSample = onSample
+        self._procs = {}
+        self._io = {}  # last io counters seen for every pid
+        self._stopEvent = threading.Event()
+        self._start = time.time()
+        self._root = psutil.Process()
+        self._ioStart = self._getIo(self._root)
+
+    @staticmethod
+    def _getIo(proc):
+        import psutil
+        try:
+            io = proc.io_counters()
+            return io.read_bytes, io.write_bytes
+        except (psutil.Error, AttributeError, NotImplementedError):
+            return 0, 0
+
+    def sample(self):
+        import psutil
+        procs = [self._root]
+        try:
+            procs += self._root.children(recursive=True)
+        except psutil.Error:
+            pass
+
+        cpu, rss, threads = 0., 0, 0
+        for proc in procs:
+            # Reuse the Process objects, cpu_percent is relative to
+            # the previous call on the same object
+            proc = self._procs.setdefault(proc.pid, proc)
+            try:
+                cpu += proc.cpu_percent(None)
+                rss += proc.memory_info().rss
+                threads += proc.num_threads()
+                self._io[proc.pid] = self._getIo(proc)
+            except psutil.Error:  # finished while sampling
+                pass
+
+        rootPid = self._root.pid
+        read = sum(r for pid, (r, _) in self._io.items() if pid != rootPid)
+        write = sum(w for pid, (_, w) in self._io.items() if pid != rootPid)
+        rootRead, rootWrite = self._io.get(rootPid, self._ioStart)
+        self.onSample({'t': round(time.time() - self._start, 3),
+                       'cpu': cpu, 'rss': rss, 'threads': threads,
+                       'procs': len(procs),
+                       'read': read + rootRead - self._ioStart[0],
+                       'write': write + rootWrite - self._ioStart[1]})
+
+    def run(self):
+        while not self._stopEvent.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._stopEvent.set()
+        if self.is_alive():
+            self.join()
+        self.sample()
+
+
+class StepTelemetry(object):
+    """ Context manager recording the resources used by a protocol step.
+
+    Samples are appended as json lines to filename while the step runs,
+    followed by a record with the step totals: wall and cpu time (own and
+    of finished children), peak resident memory and bytes read/written.
+    """
+    def __init__(self, filename, stepName, interval):
+        self.filename = filename
+        self.stepName = stepName
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._peakRss = 0
+        self._lastSample = {}
+
+    def _write(self, record):
+        record['step'] = self.stepName
+        with self._lock:
+            with open(self.filename, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+    def _onSample(self, sample):
+        self._peakRss = max(self._peakRss, sample['rss'])
+        self._lastSample = sample
+        self._write(sample)
+
+    @staticmethod
+    def _getChildrenRss():
+        """ Peak resident memory in bytes of the largest finished child. """
+        return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+    def __enter__(self):
+        self._wallStart = time.time()
+        self._timesStart = os.times()
+        self._childrenRssStart = self._getChildrenRss()
+        self._sampler = ProcessTreeSampler(self.interval, self._onSample)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self._sampler.stop()
+        times = os.times()
+        cpuTime = sum(times[i] - self._timesStart[i] for i in range(4))
+        # Children finished between samples are only seen by getrusage,
+        # whose peak is that of all the children of the process: it is
+        # only from this step if it has grown
+        childrenRss = self._getChildrenRss()
+        if childrenRss <= self._childrenRssStart:
+            childrenRss = 0
+        self._write({'event': 'end',
+                     'wall': round(time.time() - self._wallStart, 3),
+                     'cpuTime': round(cpuTime, 3),
+                     'peakRss': max(self._peakRss, childrenRss),
+                     'read': self._lastSample.get('read', 0),
+                     'write': self._lastSample.get('write', 0),
+                     'failed': excType is not None})
+        return False
+
+
+def telemetryStep(func):
+    """ Decorator for protocol steps that records their resource usage
+    when the protocol returns a StepTelemetry from _getStepTelemetry. """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        telemetry = self._getStepTelemetry(func.__name__)
+        if telemetry is None:
+            return func(self, *args, **kwargs)
+        with telemetry:
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+def readTelemetry(filename):
+    """ Return (samples, totals) from a telemetry file, where totals has
+    the end record of every step, in execution order. """
+    samples, totals = [], []
+    if os.path.exists(filename):
+        with open(filename) as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get('event') == 'end':
+                    totals.append(record)
+                else:
+                    samples.append(record)
+    return samples, totals
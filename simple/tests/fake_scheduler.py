@@ -0,0 +1,53 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Stand-in for the submission command of a queue system (like sbatch), to
+test batch submission without a cluster. The given script is started in
+the background, detached from this process, and a job id is printed.
+Submissions are logged to fake_scheduler.log in the current folder.
+
+Usage: fake_scheduler.py script [args]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import subprocess
+
+
+def main(argv):
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen(['sh'] + argv, stdout=devnull,
+                                stderr=devnull, preexec_fn=os.setsid)
+    with open('fake_scheduler.log', 'a') as f:
+        f.write(' '.join(argv) + '\n')
+    print("Submitted batch job %d" % proc.pid)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
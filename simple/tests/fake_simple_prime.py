@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Stand-in for the simple_prime binary, used to exercise and benchmark the
+protocol without a SIMPLE installation. It accepts the same key=value
+arguments, prints per-iteration lines similar to the real program and
+writes recvol_stateN_iterM.spi volumes and prime3Ddoc_M.txt docs.
+Tests install it as bin/simple_prime of a SIMPLE_HOME, where it runs
+through its #! line with whatever python is first in the PATH, so it
+writes the SPIDER files with struct instead of numpy.
+
+The behaviour is controlled with these environment variables:
+    FAKE_PRIME_ITERATIONS: last iteration to run (default 10)
+    FAKE_PRIME_ITER_TIME: seconds spent per iteration (default 0.5)
+    FAKE_PRIME_CONVERGE: iteration after which volumes stop changing
+
+Without arguments, the usage message is printed with the accepted keys.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import math
+import time
+import struct
+import random
+
+
+def readStackSize(filename):
+    with open(filename, 'rb') as f:
+        header = struct.unpack('<256f', f.read(1024))
+    return int(header[25])
+
+
+def writeVolume(filename, box, seed):
+    """ Write a SPIDER volume built from a few shifted copies of a row. """
+    lenbyt = box * 4
+    labrec = int(math.ceil(1024.0 / lenbyt))
+    header = [0.0] * (labrec * box)
+    header[0], header[1], header[4], header[11] = box, box, 3, box
+    header[12], header[20], header[21], header[22] = (labrec, 1,
+                                                      labrec * lenbyt, lenbyt)
+    rnd = random.Random(seed)
+    profile = [math.exp(-((x - box / 2.) / (box / 8.)) ** 2)
+               for x in range(box)]
+    rows = []
+    for k in range(16):
+        shift = rnd.randint(-2, 2)
+        rows.append(struct.pack('<%df' % box, *(profile[(x + shift) % box]
+                                                for x in range(box))))
+    with open(filename + '.tmp', 'wb') as f:
+        f.write(struct.pack('<%df' % len(header), *header))
+        f.write(b''.join(rows[(y * 7 + z * 3) % 16]
+                         for z in range(box) for y in range(box)))
+    os.rename(filename + '.tmp', filename)
+
+
+USAGE = """USAGE:
+simple_prime stk=<stack.spi> [vol1=<invol.spi>] [vol2=<refvol_2.spi> etc.]
+ box=<image size(in pixels)> smpd=<sampling distance(in A)>
+ [ring2=<outer mask radius(in pixels){box/2}>] [trs=<origin shift{0}>]
+ [trsstep=<origin shift stepsize{1}>] [lp=<low-pass limit{20}>]
+ [dynlp=<yes|no{no}>] [nstates=<nstates to reconstruct>] [pgrp=<cn|dn{c1}>]
+ [frac=<fraction of ptcls to include{1}>] [mw=<molecular weight(in kD)>]
+ [oritab=<previous alignment doc>] [startit=<start iteration>]
+ [maxits=<max iterations>] [nthr=<nr of OpenMP threads{1}>]
+SIMPLE version: 2.1 (stand-in)"""
+
+
+def main(argv):
+    args = dict(arg.split('=', 1) for arg in argv if '=' in arg)
+    if 'stk' not in args:
+        print(USAGE)
+        return
+    box = int(args['box'])
+    nstates = int(args.get('nstates', 1))
+    startIter = int(args.get('startit', 1))
+    iterations = int(os.environ.get('FAKE_PRIME_ITERATIONS', 10))
+    if 'maxits' in args:
+        iterations = min(iterations, startIter + int(args['maxits']) - 1)
+    iterTime = float(os.environ.get('FAKE_PRIME_ITER_TIME', 0.5))
+    converge = int(os.environ.get('FAKE_PRIME_CONVERGE', iterations))
+    nimages = readStackSize(args['stk'])
+
+    with open('cmdline.txt', 'w') as f:
+        f.write(' '.join(argv) + '\n')
+    for state in range(1, nstates + 1):
+        writeVolume('startvol_state%d.spi' % state, box, state)
+
+    for it in range(startIter, iterations + 1):
+        time.sleep(iterTime)
+        seedIter = min(it, converge)
+        print(">>> ITERATION %d" % it)
+        print(">>> CORRELATION: %0.4f" % (1 - 0.5 / seedIter))
+        print(">>> RESOLUTION AT FSC=0.5: %0.2f" % (40. / math.sqrt(seedIter)))
+        for state in range(1, nstates + 1):
+            writeVolume('recvol_state%d_iter%d.spi' % (state, it), box,
+                        1000 * seedIter + state)
+        with open('prime3Ddoc_%d.txt' % it, 'w') as f:
+            for i in range(nimages):
+                f.write("e1=0.0 e2=0.0 e3=0.0 x=0.0 y=0.0 state=%d "
+                        "corr=%0.4f\n" % (i % nstates + 1, 1 - 0.5 / seedIter))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,89 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+"""
+Generation of synthetic data to exercise the protocols without
+downloading any dataset. Averages are analytic projections of a phantom
+made of gaussian blobs, so any box size and number of images can be
+produced quickly.
+"""
+
+import numpy as np
+
+from simple.convert import SpiderStackWriter
+
+
+def createPhantom(box, blobs=12, seed=0):
+    """ Return (centers, sigmas, amplitudes) of random gaussian blobs
+    inside a sphere of radius box/4 (in pixels). """
+    rng = np.random.RandomState(seed)
+    radius = box / 4.
+    centers = rng.uniform(-1, 1, (blobs, 3))
+    centers *= radius / np.maximum(1, np.linalg.norm(centers, axis=1))[:, None]
+    sigmas = rng.uniform(box / 40., box / 16., blobs)
+    amplitudes = rng.uniform(0.5, 1., blobs)
+    return centers, sigmas, amplitudes
+
+
+def randomRotations(n, seed=0):
+    """ Return n uniformly distributed rotation matrices (n, 3, 3). """
+    rng = np.random.RandomState(seed)
+    q = rng.normal(size=(n, 4))
+    q /= np.linalg.norm(q, axis=1)[:, None]
+    w, x, y, z = q.T
+    return np.stack([
+        np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)], -1),
+        np.stack([2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)], -1),
+        np.stack([2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], -1),
+    ], 1)
+
+
+def projectPhantom(phantom, rotation, box):
+    """ Return the projection of the phantom along z after rotating it.
+    The projection of a 3D gaussian is a 2D gaussian, so it is computed
+    analytically for all blobs at once. """
+    centers, sigmas, amplitudes = phantom
+    rotated = centers.dot(rotation.T)
+    coords = np.arange(box) - box // 2
+    dx = coords[None, :] - rotated[:, 0, None]  # (blobs, box)
+    dy = coords[None, :] - rotated[:, 1, None]
+    gx = np.exp(-dx ** 2 / (2 * sigmas[:, None] ** 2))
+    gy = np.exp(-dy ** 2 / (2 * sigmas[:, None] ** 2))
+    weights = amplitudes * np.sqrt(2 * np.pi) * sigmas
+    return np.einsum('k,ky,kx->yx', weights, gy, gx).astype(np.float32)
+
+
+def writeSyntheticAverages(filename, box, n, noise=0.1, seed=0):
+    """ Write n noisy projections of a phantom as a SPIDER stack. """
+    phantom = createPhantom(box, seed=seed)
+    rng = np.random.RandomState(seed + 1)
+    writer = SpiderStackWriter(filename, n, box)
+    for i, rotation in enumerate(randomRotations(n, seed=seed), 1):
+        image = projectPhantom(phantom, rotation, box)
+        image += rng.normal(0, noise * image.std(), image.shape)
+        writer.write(i, image)
+    writer.close()
+    return filename
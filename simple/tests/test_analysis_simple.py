@@ -0,0 +1,133 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from simple.analysis import (compareVolumes, findDuplicates,
+                             findRedundantStates, getGridOrientations,
+                             mergeStates, scoreAverages, selectAverages)
+from simple.convert import memmapVolume, writeSpiderVolume
+
+
+class TestSimpleScreening(unittest.TestCase):
+    BOX = 32
+
+    def _blob(self, cx=0, cy=0, sigma=3, noise=0.05):
+        y, x = np.mgrid[:self.BOX, :self.BOX] - self.BOX // 2
+        img = np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2. * sigma ** 2))
+        return img + noise * self.rng.randn(self.BOX, self.BOX)
+
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+
+    def test_scoreAverages(self):
+        stack = np.array([self._blob(),
+                          self.rng.randn(self.BOX, self.BOX),
+                          np.zeros((self.BOX, self.BOX)),
+                          self._blob(cx=11, cy=11)])
+        scores = scoreAverages(stack)
+        self.assertEqual(np.argmax(scores['score']), 0)
+        self.assertTrue(np.isneginf(scores['score'][2]))
+        self.assertGreater(scores['centering'][0], scores['centering'][3])
+        self.assertGreater(scores['snr'][0], scores['snr'][1])
+
+    def test_selectAverages(self):
+        first = self._blob(sigma=2)
+        stack = np.array([first,
+                          self.rng.randn(self.BOX, self.BOX),
+                          np.roll(first, 3, axis=1),
+                          self._blob(cx=3, sigma=6)])
+        duplicates = findDuplicates(stack, 0.9)
+        self.assertEqual(duplicates[:3], [-1, -1, 0])
+        scores = scoreAverages(stack)['score']
+        selected = selectAverages(scores, duplicates, 0.5)
+        self.assertEqual(len(selected), 2)
+        self.assertFalse(0 in selected and 2 in selected)
+        self.assertNotIn(1, selected)
+
+
+class TestSimpleStates(unittest.TestCase):
+    BOX = 32
+
+    def _volume(self, boxes):
+        vol = np.zeros((self.BOX,) * 3, dtype=np.float32)
+        for z0, z1, y0, y1, x0, x1 in boxes:
+            vol[z0:z1, y0:y1, x0:x1] = 1
+        return vol
+
+    def test_compareVolumes(self):
+        rng = np.random.RandomState(0)
+        first = self._volume([(8, 20, 10, 24, 12, 18), (20, 26, 6, 12, 6, 12)])
+        other = self._volume([(4, 12, 4, 26, 20, 26)])
+        # Same volume turned 90 degrees about the symmetry axis
+        turned = np.rot90(first, 1, (1, 2)) + 0.05 * rng.randn(*first.shape)
+        volumes = np.array([first, other, turned])
+
+        orientations = getGridOrientations('c4')
+        self.assertEqual(len(orientations), 8)
+        self.assertEqual(getGridOrientations('c1'), [()])
+        comparison = compareVolumes(volumes, 2.0, 8.0, orientations)
+        correlation = comparison['correlation']
+        np.testing.assert_allclose(correlation, correlation.T, atol=1e-3)
+        self.assertGreater(correlation[0, 2], 0.95)
+        self.assertLess(correlation[0, 1], 0.5)
+        self.assertLess(comparison['resolution'][0, 2],
+                        comparison['resolution'][0, 1])
+        # Without the rotation the two copies do not match
+        self.assertLess(compareVolumes(volumes, 2.0, 8.0)['correlation'][0, 2],
+                        0.9)
+
+        redundant = findRedundantStates(correlation, 0.9)
+        self.assertEqual(redundant, [-1, -1, 0])
+        merged = mergeStates(volumes, redundant, orientations,
+                             comparison['orientation'])
+        self.assertEqual(len(merged), 2)
+        self.assertLess(np.abs(merged[0] - first).max(), 0.2)
+        np.testing.assert_array_equal(merged[1], other)
+
+        # Memory mapped volumes are compared without loading them at once
+        tmpDir = tempfile.mkdtemp()
+        try:
+            fnVolumes = [os.path.join(tmpDir, 'recvol_state%d.spi' % i)
+                         for i in range(1, 4)]
+            for fn, vol in zip(fnVolumes, volumes):
+                writeSpiderVolume(fn, vol)
+            mapped = [memmapVolume(fn) for fn in fnVolumes]
+            mappedComparison = compareVolumes(mapped, 2.0, 8.0, orientations)
+            np.testing.assert_allclose(mappedComparison['correlation'],
+                                       correlation, atol=1e-5)
+            np.testing.assert_array_equal(mappedComparison['orientation'],
+                                          comparison['orientation'])
+            mappedMerged = mergeStates(mapped, redundant, orientations,
+                                       comparison['orientation'])
+            np.testing.assert_allclose(mappedMerged[0], merged[0], atol=1e-5)
+        finally:
+            shutil.rmtree(tmpDir)
@@ -0,0 +1,149 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from simple.batch import FINISHED_KEEP, BatchSpool
+from simple.batch_runner import STOP_FILE, getCancelFile, main as runBatch
+
+
+class TestBatchSpool(unittest.TestCase):
+    """ Submit jobs from several threads, as separate protocols would do,
+    through the stand-in scheduler. """
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        scheduler = os.path.join(os.path.dirname(__file__),
+                                 'fake_scheduler.py')
+        self.spool = BatchSpool(os.path.join(self.tmpDir, 'spool'),
+                                "'%s' '%s' %%(script)s" % (sys.executable,
+                                                         scheduler),
+                                cores=4, maxWait=30, poll=0.2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def _runJobs(self, commands, threads):
+        results = [None] * len(commands)
+
+        def run(i):
+            runDir = os.path.join(self.tmpDir, 'run_%d' % i)
+            os.makedirs(runDir)
+            jobId = self.spool.addJob(commands[i], runDir, os.environ,
+                                      threads)
+            results[i] = self.spool.waitJob(jobId)
+
+        workers = [threading.Thread(target=run, args=(i,))
+                   for i in range(len(commands))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return results
+
+    def _getBatches(self):
+        return [d for d in os.listdir(self.spool.path)
+                if d.startswith('batch_')]
+
+    def test_batch(self):
+        # Jobs fill the 4 batch cores, so they are submitted together
+        results = self._runJobs(["echo done > out.txt", "exit 3"], 2)
+        self.assertEqual(results, [0, 3])
+        self.assertEqual(len(self._getBatches()), 1)
+        with open(os.path.join(self.tmpDir, 'run_0', 'out.txt')) as f:
+            self.assertEqual(f.read().strip(), 'done')
+
+    def test_stop(self):
+        self.spool.maxWait = 0
+        stopper = threading.Timer(2, lambda: open(
+            os.path.join(self.tmpDir, 'run_0', STOP_FILE), 'w').close())
+        stopper.start()
+        results = self._runJobs(["sleep 60"], 1)
+        stopper.join()
+        self.assertNotEqual(results[0], 0)
+
+    def _assertFails(self, command):
+        self.spool.maxWait = 0
+        jobId = self.spool.addJob(command, self.tmpDir, os.environ, 1)
+        self.assertRaises(Exception, self.spool.waitJob, jobId)
+        # No job is left for the next batch
+        self.assertEqual(os.listdir(self.spool.pendingDir), [])
+        return jobId
+
+    def test_rejected(self):
+        # Submitted, but the queue system does not know the batch
+        self.spool.submitTemplate = 'true'
+        self.spool.statusTemplate = 'false'
+        self._assertFails("exit 0")
+
+    def test_deadRunner(self):
+        # The runner started but stopped writing its heartbeat long ago
+        self.spool.submitTemplate = 'touch -t 200001010000 heartbeat'
+        self._assertFails("exit 0")
+
+    def test_timeout(self):
+        self.spool.submitTemplate = 'true'
+        self.spool.timeout = 1
+        jobId = self._assertFails("touch out.txt")
+        # The batch starts later, but does not run the cancelled job
+        batchDir = self.spool.getBatchDir(jobId)
+        self.assertTrue(os.path.exists(getCancelFile(batchDir, jobId)))
+        runBatch(os.path.join(batchDir, 'batch.json'))
+        self.assertEqual(self.spool.getExitCode(jobId), -1)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpDir,
+                                                     'out.txt')))
+
+    def test_submitFailure(self):
+        self.spool.submitTemplate = 'false'
+        self._assertFails("exit 0")
+
+    def test_cleanBatches(self):
+        self._runJobs(["exit 0", "exit 0"], 2)
+        self.spool.submitTemplate = 'true'
+        self.spool.timeout = 1
+        self._assertFails("exit 0")
+        self.assertEqual(len(self._getBatches()), 2)
+        self.spool.cleanBatches()
+        self.assertEqual(len(self._getBatches()), 2)
+        # Once old, the finished batch is removed, and the one still
+        # queued is kept
+        old = time.time() - FINISHED_KEEP - 10
+        for batch in self._getBatches():
+            batchDir = os.path.join(self.spool.path, batch)
+            for fn in os.listdir(batchDir) + ['']:
+                os.utime(os.path.join(batchDir, fn), (old, old))
+        self.spool.cleanBatches()
+        batches = self._getBatches()
+        self.assertEqual(len(batches), 1)
+        with open(os.path.join(self.spool.path, batches[0],
+                               'batch.json')) as f:
+            self.assertEqual(len(json.load(f)['jobs']), 1)
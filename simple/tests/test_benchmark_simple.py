@@ -0,0 +1,263 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import sys
+import json
+import shutil
+import subprocess
+import time
+
+from pyworkflow.tests import *
+from pyworkflow.em.protocol import ProtImportAverages
+
+from simple.constants import (OUTPUT_MRC, OUTPUT_SPIDER, SIMPLE_CACHE,
+                              SIMPLE_CACHE_SIZE, SIMPLE_HOME)
+from simple.convert import memmapStack, memmapVolume, writeStack
+from simple.protocols import ProtPrime
+from simple.tests.synthetic import writeSyntheticAverages
+
+
+# Environment variables to configure the benchmark
+BENCHMARK_OUTPUT = 'SIMPLE_BENCHMARK_OUTPUT'
+BENCHMARK_BASELINE = 'SIMPLE_BENCHMARK_BASELINE'
+BENCHMARK_TOLERANCE = 'SIMPLE_BENCHMARK_TOLERANCE'
+BENCHMARK_IMPORT_TIME = 'SIMPLE_BENCHMARK_IMPORT_TIME'
+
+
+def installFakeSimple(path):
+    """ Create a SIMPLE_HOME whose simple_prime is the stand-in script. """
+    binDir = os.path.join(path, 'bin')
+    if not os.path.exists(binDir):
+        os.makedirs(binDir)
+    fnPrime = os.path.join(binDir, 'simple_prime')
+    shutil.copy(os.path.join(os.path.dirname(__file__),
+                             'fake_simple_prime.py'), fnPrime)
+    os.chmod(fnPrime, 0o755)
+    return path
+
+
+class TestPrimeBenchmark(BaseTest):
+    """ Time the ProtPrime steps on synthetic averages, using a stand-in
+    simple_prime that spends a fixed time per iteration, so the plugin
+    overhead can be measured without SIMPLE or any dataset.
+
+    Timings are written as json to SIMPLE_BENCHMARK_OUTPUT (or the test
+    output folder). If SIMPLE_BENCHMARK_BASELINE points to the json of a
+    previous execution, the test fails when any step gets slower than the
+    baseline by more than SIMPLE_BENCHMARK_TOLERANCE (default 1.5 times).
+    """
+    BOX_SIZES = [64, 128]
+    STATES = [1, 3]
+    NUMBER_OF_AVERAGES = 50
+    ITERATIONS = 5
+    ITER_TIME = 0.2
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestProject(cls)
+        # The protocols run in other processes, that will take the
+        # plugin configuration from the environment
+        os.environ[SIMPLE_HOME] = installFakeSimple(
+            os.path.abspath(cls.getOutputPath('fake_simple')))
+        # Caches and calibrations of the stand-in runs stay in the project
+        os.environ[SIMPLE_CACHE] = os.path.abspath(
+            cls.getOutputPath('simple_cache'))
+        os.environ[SIMPLE_CACHE_SIZE] = '0'
+        os.environ['FAKE_PRIME_ITERATIONS'] = str(cls.ITERATIONS)
+        os.environ['FAKE_PRIME_ITER_TIME'] = str(cls.ITER_TIME)
+
+    def _importAverages(self, box):
+        fnAverages = writeSyntheticAverages(
+            os.path.abspath(self.getOutputPath('averages_%d.stk' % box)),
+            box, self.NUMBER_OF_AVERAGES)
+        protImport = self.newProtocol(ProtImportAverages,
+                                      filesPath=fnAverages,
+                                      samplingRate=3.0)
+        protImport.setObjLabel('import %d px' % box)
+        self.launchProtocol(protImport)
+        return protImport.outputAverages
+
+    def _runPrime(self, averages, nstates):
+        # The comparison of states is timed apart, in test_prime_simple
+        protPrime = self.newProtocol(ProtPrime,
+                                     Nvolumes=nstates,
+                                     numberOfThreads=1,
+                                     compareStates=False)
+        protPrime.inputClasses.set(averages)
+        self.launchProtocol(protPrime)
+
+        times = {}
+        for step in protPrime.loadSteps():
+            times[step.funcName.get()] = step.getElapsedTime().total_seconds()
+        # Time spent by the stand-in program is not plugin overhead
+        times['runPrimeOverhead'] = (times['runPrime'] -
+                                     self.ITERATIONS * self.ITER_TIME)
+        return times
+
+    def _compareBaseline(self, results):
+        fnBaseline = os.environ.get(BENCHMARK_BASELINE)
+        if not fnBaseline:
+            return
+        tolerance = float(os.environ.get(BENCHMARK_TOLERANCE, 1.5))
+        with open(fnBaseline) as f:
+            baseline = json.load(f)
+
+        slower = []
+        for case, times in results.items():
+            for step, seconds in times.items():
+                reference = baseline.get(case, {}).get(step)
+                # Ignore differences below 0.5 seconds, they are just noise
+                if reference is not None and seconds > max(reference * tolerance,
+                                                           reference + 0.5):
+                    slower.append("%s %s: %0.2fs (baseline %0.2fs)"
+                                  % (case, step, seconds, reference))
+        self.assertFalse(slower, "Slower than baseline:\n" + "\n".join(slower))
+
+    def test_benchmark(self):
+        results = {}
+        for box in self.BOX_SIZES:
+            averages = self._importAverages(box)
+            for nstates in self.STATES:
+                case = 'box%d_states%d' % (box, nstates)
+                results[case] = self._runPrime(averages, nstates)
+                print("%s: %s" % (case, results[case]))
+
+        fnOutput = os.environ.get(BENCHMARK_OUTPUT,
+                                  self.getOutputPath('benchmark.json'))
+        with open(fnOutput, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print("Benchmark results written to %s" % fnOutput)
+        self._compareBaseline(results)
+
+
+class TestImportBenchmark(BaseTest):
+    """ Time the import of the plugin and its protocols in fresh
+    processes, after pyworkflow.em that Scipion always imports first.
+    The test fails if the median time of the plugin import is above
+    SIMPLE_BENCHMARK_IMPORT_TIME seconds, when given.
+    """
+    REPEATS = 5
+    SCRIPT = ("import time; import pyworkflow.em; t0 = time.time(); "
+              "import simple; t1 = time.time(); import simple.protocols; "
+              "print('%f %f' % (t1 - t0, time.time() - t1))")
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestProject(cls)
+
+    def _median(self, values):
+        return sorted(values)[len(values) // 2]
+
+    def test_import(self):
+        pluginTimes, protocolsTimes = [], []
+        for _ in range(self.REPEATS):
+            output = subprocess.check_output([sys.executable, '-c',
+                                              self.SCRIPT])
+            pluginTime, protocolsTime = map(float, output.split()[-2:])
+            pluginTimes.append(pluginTime)
+            protocolsTimes.append(protocolsTime)
+        results = {'importPlugin': self._median(pluginTimes),
+                   'importProtocols': self._median(protocolsTimes)}
+        print("Import times (median of %d): %s" % (self.REPEATS, results))
+        with open(self.getOutputPath('import_benchmark.json'), 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+        maxTime = os.environ.get(BENCHMARK_IMPORT_TIME)
+        if maxTime:
+            self.assertLessEqual(results['importPlugin'], float(maxTime))
+
+
+class TestFormatBenchmark(BaseTest):
+    """ Compare the I/O cost of the SPIDER and MRC paths: writing and
+    reading the input stack in each format, and creating the outputs of
+    ProtPrime (plus reading them back as a downstream program would).
+    Results are written as json to the test output folder.
+    """
+    BOX_SIZES = [64, 128]
+    NUMBER_OF_AVERAGES = 200
+    ITERATIONS = 3
+    FORMATS = {'spider': OUTPUT_SPIDER, 'mrc': OUTPUT_MRC}
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestProject(cls)
+        os.environ[SIMPLE_HOME] = installFakeSimple(
+            os.path.abspath(cls.getOutputPath('fake_simple')))
+        # Caches and calibrations of the stand-in runs stay in the project
+        os.environ[SIMPLE_CACHE] = os.path.abspath(
+            cls.getOutputPath('simple_cache'))
+        os.environ[SIMPLE_CACHE_SIZE] = '0'
+        os.environ['FAKE_PRIME_ITERATIONS'] = str(cls.ITERATIONS)
+        os.environ['FAKE_PRIME_ITER_TIME'] = '0'
+
+    def _timeStack(self, fnAverages, box, ext):
+        fnStack = self.getOutputPath('stack_%d%s' % (box, ext))
+        locations = [(i, fnAverages) for i in
+                     range(1, self.NUMBER_OF_AVERAGES + 1)]
+        t0 = time.time()
+        writeStack(fnStack, locations)
+        t1 = time.time()
+        memmapStack(fnStack).sum(dtype='f8')
+        return {'writeStack': t1 - t0, 'readStack': time.time() - t1}
+
+    def _timeOutputs(self, averages, outputFormat):
+        protPrime = self.newProtocol(ProtPrime, Nvolumes=2,
+                                     numberOfThreads=1,
+                                     compareStates=False,
+                                     outputFormat=outputFormat)
+        protPrime.inputClasses.set(averages)
+        self.launchProtocol(protPrime)
+        times = {}
+        for step in protPrime.loadSteps():
+            if step.funcName.get() == 'createOutputStep':
+                times['createOutputs'] = step.getElapsedTime().total_seconds()
+        t0 = time.time()
+        for vol in protPrime.outputVolumes:
+            memmapVolume(vol.getFileName()).sum(dtype='f8')
+        times['readOutputs'] = time.time() - t0
+        return times
+
+    def test_formats(self):
+        results = {}
+        for box in self.BOX_SIZES:
+            fnAverages = writeSyntheticAverages(
+                os.path.abspath(self.getOutputPath('averages_%d.stk' % box)),
+                box, self.NUMBER_OF_AVERAGES)
+            protImport = self.newProtocol(ProtImportAverages,
+                                          filesPath=fnAverages,
+                                          samplingRate=3.0)
+            self.launchProtocol(protImport)
+            for name, outputFormat in self.FORMATS.items():
+                case = 'box%d_%s' % (box, name)
+                ext = '.spi' if outputFormat == OUTPUT_SPIDER else '.mrcs'
+                results[case] = self._timeStack(fnAverages, box, ext)
+                results[case].update(self._timeOutputs(
+                    protImport.outputAverages, outputFormat))
+                print("%s: %s" % (case, results[case]))
+
+        with open(self.getOutputPath('format_benchmark.json'), 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
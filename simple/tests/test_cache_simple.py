@@ -0,0 +1,99 @@
+# **************************************************************************
+# *
+# * Authors:    Jose Luis Vilas (jlvilas@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from simple.cache import StackCache, hashItems
+
+
+class TestStackCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.cacheDir = os.path.join(self.tmpDir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def _createFile(self, name, size):
+        fn = os.path.join(self.tmpDir, name)
+        with open(fn, 'wb') as f:
+            f.write(b'\0' * size)
+        return fn
+
+    def test_fetchStore(self):
+        cache = StackCache(self.cacheDir, 1000)
+        key = hashItems([1.0, 64, (1, 'classes.stk')])
+        dest = os.path.join(self.tmpDir, 'classes.spi')
+        self.assertFalse(cache.fetch(key, dest))
+        cache.store(key, self._createFile('stack1.spi', 100))
+        self.assertTrue(cache.fetch(key, dest))
+        self.assertEqual(os.path.getsize(dest), 100)
+        stats = cache.getStats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_evictLeastRecentlyUsed(self):
+        cache = StackCache(self.cacheDir, 250)
+        for i, key in enumerate(['a', 'b', 'c']):
+            cache.store(key, self._createFile('stack%d.spi' % i, 100))
+            # make sure every entry gets a different access time
+            os.utime(os.path.join(self.cacheDir, key + '.spi'), (i, i))
+        self.assertLessEqual(cache.getSize(), 250)
+        self.assertFalse(cache.fetch('a', os.path.join(self.tmpDir, 'x.spi')))
+        self.assertTrue(cache.fetch('c', os.path.join(self.tmpDir, 'y.spi')))
+        self.assertEqual(cache.getStats()['evictions'], 1)
+
+    def test_entriesAreCopies(self):
+        cache = StackCache(self.cacheDir, 150)
+        source = self._createFile('stack1.spi', 100)
+        cache.store('a', source)
+        dest = os.path.join(self.tmpDir, 'classes.spi')
+        self.assertTrue(cache.fetch('a', dest))
+        # Rewriting the source or the fetched stack leaves the entry intact
+        for fn in [source, dest]:
+            with open(fn, 'r+b') as f:
+                f.write(b'\1' * 100)
+        with open(os.path.join(self.cacheDir, 'a.spi'), 'rb') as f:
+            self.assertEqual(f.read(), b'\0' * 100)
+        # The fetched stack survives the eviction of its entry
+        cache.store('b', self._createFile('stack2.spi', 100))
+        self.assertFalse(os.path.exists(os.path.join(self.cacheDir, 'a.spi')))
+        self.assertEqual(os.path.getsize(dest), 100)
+
+    def test_countFromThreads(self):
+        cache = StackCache(self.cacheDir, 1000)
+        threads = [threading.Thread(target=cache.fetch,
+                                    args=('a', os.path.join(self.tmpDir,
+                                                            'x.spi')))
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(cache.getStats()['misses'], 8)
@@ -0,0 +1,191 @@
+# **************************************************************************
+# *
+# * Authors:    Jose Luis Vilas (jlvilas@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from simple.convert import (convertVolumeToMrc, fourierResize,
+                            getDownsampledBox, getSpiderVolumeDim,
+                            getVolumeDim, isCompleteSpiderFile,
+                            memmapStack, memmapVolume,
+                            readMrcHeader, readSpiderHeader, resampleVolume,
+                            resizeVolume, scaleOritab, writeSpiderStack,
+                            writeSpiderVolume, writeStack)
+
+
+class TestSimpleConvert(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def _writeMrcStack(self, data, byteOrder='<'):
+        fn = os.path.join(self.tmpDir, 'input.mrcs')
+        header = np.zeros(256, dtype=byteOrder + 'i4')
+        n, ny, nx = data.shape
+        header[:4] = [nx, ny, n, 2]
+        header = bytearray(header.tobytes())
+        header[212:214] = b'\x11\x11' if byteOrder == '>' else b'\x44\x44'
+        with open(fn, 'wb') as f:
+            f.write(bytes(header))
+            f.write(data.astype(byteOrder + 'f4').tobytes())
+        return fn
+
+    def test_downsampledBox(self):
+        self.assertEqual(getDownsampledBox(400, 1.0, 20), 40)
+        self.assertEqual(getDownsampledBox(64, 5.0, 8), 64)
+
+    def test_fourierResize(self):
+        data = np.random.rand(32, 32).astype(np.float32)
+        small = fourierResize(data, 16)
+        self.assertEqual(small.shape, (16, 16))
+        self.assertAlmostEqual(small.mean(), data.mean(), places=4)
+
+    def test_writeSpiderStack(self):
+        data = np.random.rand(4, 24, 24).astype(np.float32)
+        fnMrc = self._writeMrcStack(data, byteOrder='>')
+        fnSpi = os.path.join(self.tmpDir, 'classes.spi')
+
+        writeSpiderStack(fnSpi, [(i, fnMrc) for i in range(1, 5)])
+        header = readSpiderHeader(fnSpi)
+        self.assertEqual((header['nx'], header['maxim']), (24, 4))
+        self.assertTrue(np.allclose(memmapStack(fnSpi), data))
+
+        fnSmall = os.path.join(self.tmpDir, 'small.spi')
+        writeSpiderStack(fnSmall, [(3, fnSpi), (1, fnSpi)], box=12)
+        stack = memmapStack(fnSmall)
+        self.assertEqual(stack.shape, (2, 12, 12))
+        self.assertAlmostEqual(stack[0].mean(), data[2].mean(), places=4)
+
+    def test_resizeVolume(self):
+        data = np.random.rand(16, 16, 16).astype(np.float32)
+        fnVol = os.path.join(self.tmpDir, 'vol.spi')
+        fnBig = os.path.join(self.tmpDir, 'vol_big.spi')
+        writeSpiderVolume(fnVol, data)
+        self.assertTrue(np.allclose(memmapVolume(fnVol), data))
+        resizeVolume(fnVol, fnBig, 32)
+        self.assertEqual(memmapVolume(fnBig).shape, (32, 32, 32))
+        self.assertAlmostEqual(memmapVolume(fnBig).mean(), data.mean(), 4)
+
+    def test_scaleOritab(self):
+        fnIn = os.path.join(self.tmpDir, 'doc.txt')
+        fnOut = os.path.join(self.tmpDir, 'doc_scaled.txt')
+        with open(fnIn, 'w') as f:
+            f.write('e1=10.0 e2=20.0 x=1.5 y=-2.0 state=1\n')
+        scaleOritab(fnIn, fnOut, 2.0)
+        with open(fnOut) as f:
+            values = dict(token.split('=') for token in f.read().split())
+        self.assertEqual(float(values['e1']), 10.0)
+        self.assertEqual(float(values['x']), 3.0)
+        self.assertEqual(float(values['y']), -4.0)
+        self.assertEqual(values['state'], '1')
+
+    def test_resampleVolume(self):
+        # A 20 px cube at 2 A/px in a 40 px box, resampled to 4 A/px
+        data = np.zeros((40, 40, 40), dtype=np.float32)
+        data[10:30, 10:30, 10:30] = 1
+        resampled = resampleVolume(data, 2.0, 4.0, 32)
+        self.assertEqual(resampled.shape, (32, 32, 32))
+        self.assertAlmostEqual(resampled[16, 16, 16], 1, delta=0.15)
+        self.assertEqual(resampled[0, 0, 0], 0)
+        self.assertAlmostEqual(resampled.sum() * 8, data.sum(), -1)
+
+    def test_getSpiderVolumeDim(self):
+        fnVol = os.path.join(self.tmpDir, 'vol.spi')
+        writeSpiderVolume(fnVol, np.zeros((8, 12, 16), dtype=np.float32))
+        self.assertEqual(getSpiderVolumeDim(fnVol), (16, 12, 8))
+        self.assertEqual(readSpiderHeader(fnVol)['dtype'], '<f4')
+        # Truncated volumes are rejected
+        with open(fnVol, 'r+b') as f:
+            f.truncate(os.path.getsize(fnVol) - 4)
+        self.assertRaises(Exception, getSpiderVolumeDim, fnVol)
+
+    def test_isCompleteSpiderFile(self):
+        """ Volumes and stacks left half written by a killed simple_prime
+        are not used to resume it. """
+        fnVol = os.path.join(self.tmpDir, 'recvol_state1_iter1.spi')
+        self.assertFalse(isCompleteSpiderFile(fnVol))
+        writeSpiderVolume(fnVol, np.zeros((8, 8, 8), dtype=np.float32))
+        self.assertTrue(isCompleteSpiderFile(fnVol))
+        fnStack = os.path.join(self.tmpDir, 'stack.spi')
+        fnMrc = self._writeMrcStack(np.zeros((3, 8, 8)))
+        writeSpiderStack(fnStack, [(i, fnMrc) for i in range(1, 4)])
+        self.assertTrue(isCompleteSpiderFile(fnStack))
+        for fn in [fnVol, fnStack]:
+            with open(fn, 'r+b') as f:
+                f.truncate(os.path.getsize(fn) - 4)
+            self.assertFalse(isCompleteSpiderFile(fn))
+        # Header not written yet
+        open(fnVol, 'w').close()
+        self.assertFalse(isCompleteSpiderFile(fnVol))
+
+    def test_convertVolumeToMrc(self):
+        data = np.random.rand(8, 12, 16).astype(np.float32)
+        fnVol = os.path.join(self.tmpDir, 'vol.spi')
+        fnMrc = os.path.join(self.tmpDir, 'vol.mrc')
+        writeSpiderVolume(fnVol, data)
+        convertVolumeToMrc(fnVol, fnMrc, 1.5)
+        self.assertEqual(getVolumeDim(fnMrc), (16, 12, 8))
+        np.testing.assert_array_equal(memmapVolume(fnMrc), data)
+
+        with open(fnMrc, 'rb') as f:
+            raw = f.read(1024)
+        header = np.frombuffer(raw, dtype='<i4')
+        floats = np.frombuffer(raw, dtype='<f4')
+        self.assertEqual(list(header[7:10]), [16, 12, 8])
+        np.testing.assert_allclose(floats[10:13], [24, 18, 12])
+        self.assertEqual(header[22], 1)
+        self.assertEqual(raw[208:212], b'MAP ')
+        np.testing.assert_allclose(floats[19:22],
+                                   [data.min(), data.max(), data.mean()],
+                                   rtol=1e-5)
+        self.assertAlmostEqual(floats[54], data.std(), 5)
+
+        # Truncated volumes are rejected
+        with open(fnMrc, 'r+b') as f:
+            f.truncate(os.path.getsize(fnMrc) - 4)
+        self.assertRaises(Exception, getVolumeDim, fnMrc)
+
+    def test_writeMrcStack(self):
+        data = np.random.rand(5, 16, 16).astype(np.float32)
+        fnInput = self._writeMrcStack(data)
+        fnStack = os.path.join(self.tmpDir, 'stack.mrcs')
+        writeStack(fnStack, [(i, fnInput) for i in range(1, 6)],
+                   samplingRate=2.0)
+        header = readMrcHeader(fnStack)
+        self.assertEqual((header['nx'], header['ny'], header['nz']),
+                         (16, 16, 5))
+        np.testing.assert_array_equal(memmapStack(fnStack), data)
+        # Image stacks have a single section per image
+        with open(fnStack, 'rb') as f:
+            raw = f.read(1024)
+        self.assertEqual(np.frombuffer(raw, dtype='<i4')[9], 1)
+        self.assertEqual(np.frombuffer(raw, dtype='<i4')[22], 0)
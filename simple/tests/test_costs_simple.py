@@ -0,0 +1,72 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from simple.costs import CostModel
+
+
+class TestCostModel(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.params = {'box': 128, 'samplingRate': 2.0, 'lowPass': 20.0,
+                       'symmetryGroup': 'c1', 'nimages': 100, 'nstates': 2,
+                       'maximumShift': 0, 'shiftStep': 1, 'threads': 8,
+                       'runs': 1, 'concurrent': 1, 'iterations': 30,
+                       'keepAll': True, 'keepIterations': 0, 'maxBytes': 0,
+                       'compress': False}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_disk(self):
+        model = CostModel()
+        keepAll = model.estimateDisk(self.params)
+        retained = model.estimateDisk(dict(self.params, keepAll=False,
+                                           keepIterations=2))
+        self.assertGreater(keepAll, 2 * 4 * 128 ** 3 * 30)
+        self.assertLess(retained, keepAll / 5)
+
+    def test_suggestBox(self):
+        model = CostModel()
+        memory = model.estimateMemory(self.params)
+        box = model.suggestBox(self.params, memory / 2, 0)
+        self.assertTrue(box < 128 and box % 2 == 0)
+        self.assertLessEqual(model.estimateMemory(dict(self.params, box=box)),
+                             memory / 2)
+
+    def test_calibrate(self):
+        fn = os.path.join(self.tmpDir, 'costs.json')
+        model = CostModel(fn)
+        predicted = model.estimateCpuHours(self.params)
+        for _ in range(10):
+            model.calibrate(self.params, cpuHours=2 * predicted)
+        # The calibration is saved and converges to the measured values
+        self.assertAlmostEqual(CostModel(fn).estimateCpuHours(self.params),
+                               2 * predicted, delta=0.01 * predicted)
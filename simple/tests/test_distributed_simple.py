@@ -0,0 +1,147 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import sys
+import shutil
+import struct
+import tempfile
+import unittest
+
+from simple.batch_runner import STOP_FILE
+from simple.convert import isCompleteSpiderFile
+from simple.distributed import Coordinator, launchWorkers
+from simple.distributed_worker import stageFile, releaseStage, cleanStages
+
+
+class TestDistributed(unittest.TestCase):
+    """ Run tasks with the stand-in simple_prime on local workers, that
+    talk to the coordinator through a local socket as remote nodes do. """
+    WORKERS = 2
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.fnStack = os.path.join(self.tmpDir, 'classes.spi')
+        header = [0.] * 256
+        header[25] = 10  # number of images
+        with open(self.fnStack, 'wb') as f:
+            f.write(struct.pack('<256f', *header))
+        self.program = "'%s' '%s'" % (sys.executable,
+                                      os.path.join(os.path.dirname(__file__),
+                                                   'fake_simple_prime.py'))
+        self.env = dict(os.environ, FAKE_PRIME_ITERATIONS='3',
+                        FAKE_PRIME_ITER_TIME='0.5')
+        tokenFile = os.path.join(self.tmpDir, 'token')
+        self.coordinator = Coordinator(tokenFile, host='localhost')
+        self.coordinator.start()
+        self.workers = launchWorkers(
+            self.coordinator.address, tokenFile, self.WORKERS,
+            scratchDir=os.path.join(self.tmpDir, 'scratch'),
+            logFile=os.path.join(self.tmpDir, 'workers.log'), env=self.env)
+
+    def tearDown(self):
+        for proc in self.workers:
+            if proc.poll() is None:
+                proc.terminate()
+        shutil.rmtree(self.tmpDir)
+
+    def _addTask(self, name, nstates, stop=False):
+        runDir = os.path.join(self.tmpDir, name)
+        os.makedirs(runDir)
+        if stop:
+            open(os.path.join(runDir, STOP_FILE), 'w').close()
+        args = ("stk=../classes.spi box=16 nstates=%d > prime.log 2>&1"
+                % nstates)
+        return runDir, self.coordinator.addTask(
+            self.program, args, runDir, self.fnStack, 'classes', self.env,
+            appendFiles=['prime.log'])
+
+    def test_tasks(self):
+        tasks = [self._addTask('run_%d' % i, nstates=i) for i in [1, 2, 3]]
+        stoppedDir, stoppedId = self._addTask('stopped', 1, stop=True)
+        for runDir, taskId in tasks:
+            self.assertEqual(self.coordinator.waitTask(taskId, timeout=60), 0)
+        self.assertIsNotNone(self.coordinator.waitTask(stoppedId, timeout=60))
+        self.coordinator.close()
+        for proc in self.workers:
+            self.assertEqual(proc.wait(), 0)
+
+        # Volumes and log are streamed back to the run folders
+        for nstates, (runDir, _) in enumerate(tasks, 1):
+            for state in range(1, nstates + 1):
+                self.assertTrue(isCompleteSpiderFile(os.path.join(
+                    runDir, 'recvol_state%d_iter3.spi' % state)))
+            with open(os.path.join(runDir, 'prime.log')) as f:
+                self.assertEqual(f.read().count('ITERATION'), 3)
+        self.assertFalse(os.path.exists(os.path.join(
+            stoppedDir, 'recvol_state1_iter3.spi')))
+
+        nodes = self.coordinator.getNodeStats()
+        self.assertEqual(len(nodes), 1)
+        stats = list(nodes.values())[0]
+        self.assertEqual(stats['workers'], self.WORKERS)
+        self.assertEqual(stats['tasks'], 4)
+        self.assertGreaterEqual(stats['volumes'], 18)
+        # The stack is staged once for the node and removed at the end
+        self.assertEqual(stats['staged'], 1)
+        self.assertEqual([fn for fn in os.listdir(os.path.join(
+            self.tmpDir, 'scratch', 'simple_worker'))
+            if fn.startswith('stage_')], [])
+
+
+class TestStaging(unittest.TestCase):
+    """ The stack staged in a node is shared while it is in use. """
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.fnSource = os.path.join(self.tmpDir, 'classes.spi')
+        with open(self.fnSource, 'wb') as f:
+            f.write(b'stack')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_release(self):
+        dest, staged = stageFile(self.fnSource, self.tmpDir, 'key')
+        self.assertTrue(staged)
+        self.assertEqual(stageFile(self.fnSource, self.tmpDir, 'key'),
+                         (dest, False))
+        releaseStage(dest, keep=True)
+        self.assertTrue(os.path.exists(dest))
+        releaseStage(dest)
+        self.assertFalse(os.path.exists(dest))
+        self.assertEqual(sorted(os.listdir(self.tmpDir)), ['classes.spi'])
+
+    def test_usedByOtherWorker(self):
+        dest, _ = stageFile(self.fnSource, self.tmpDir, 'key')
+        # Referenced by a live process (this test's parent) and a dead one
+        for pid in [os.getppid(), 2 ** 22 + 1]:
+            open('%s.%d.ref' % (dest, pid), 'w').close()
+        releaseStage(dest)
+        self.assertTrue(os.path.exists(dest))
+        os.remove('%s.%d.ref' % (dest, os.getppid()))
+        cleanStages(self.tmpDir)
+        self.assertEqual(sorted(os.listdir(self.tmpDir)), ['classes.spi'])
@@ -0,0 +1,122 @@
+# **************************************************************************
+# *
+# * Authors:    Jose Luis Vilas (jlvilas@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import subprocess
+
+from simple.execution import (runParallel, scheduleJobs, splitThreads,
+                              terminateProcesses)
+
+
+class TestScheduling(unittest.TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+        self.started = []
+
+    def _run(self, name, threads, duration=0.05):
+        """ Job using threads for a while, tracking the threads in use. """
+        with self.lock:
+            self.started.append(name)
+            self.running += threads
+            self.peak = max(self.peak, self.running)
+        time.sleep(duration)
+        with self.lock:
+            self.running -= threads
+        if name == 'fail':
+            raise ValueError(name)
+        return name
+
+    def test_splitThreads(self):
+        self.assertEqual(splitThreads(8, 2), (2, 4))
+        self.assertEqual(splitThreads(8, 3), (3, 2))
+        self.assertEqual(splitThreads(2, 5), (2, 1))
+        self.assertEqual(splitThreads(1, 1), (1, 1))
+        self.assertEqual(splitThreads(0, 3), (1, 1))
+
+    def test_runParallel(self):
+        argsList = [('job%d' % i, 1) for i in range(6)]
+        self.assertEqual(runParallel(self._run, argsList, 3),
+                         ['job%d' % i for i in range(6)])
+        self.assertEqual(self.peak, 3)
+        self.assertRaises(ValueError, runParallel, self._run,
+                          [('fail', 1)], 2)
+
+    def test_scheduleJobs(self):
+        jobs = [(cost, threads, (name, threads)) for cost, threads, name in
+                [(1, 2, 'cheap'), (10, 4, 'expensive'), (5, 2, 'medium'),
+                 (3, 2, 'small')]]
+        self.assertEqual(scheduleJobs(self._run, jobs, 6),
+                         ['cheap', 'expensive', 'medium', 'small'])
+        self.assertEqual(self.peak, 6)
+        self.assertEqual(self.started[:2], ['expensive', 'medium'])
+
+    def test_costOrder(self):
+        jobs = [(cost, 1, ('job%d' % cost, 1)) for cost in [2, 5, 1, 4]]
+        scheduleJobs(self._run, jobs, 1)
+        self.assertEqual(self.started, ['job5', 'job4', 'job2', 'job1'])
+        self.assertEqual(self.peak, 1)
+
+    def test_largeJob(self):
+        """ Jobs asking for more threads than the budget run alone. """
+        jobs = [(2, 8, ('large', 8)), (1, 1, ('small', 1))]
+        self.assertEqual(scheduleJobs(self._run, jobs, 4),
+                         ['large', 'small'])
+        self.assertEqual(self.started, ['large', 'small'])
+
+    def test_error(self):
+        jobs = [(3, 2, ('fail', 2)), (2, 2, ('job2', 2)),
+                (1, 2, ('job1', 2))]
+        self.assertRaises(ValueError, scheduleJobs, self._run, jobs, 2)
+        # No job is started after the error
+        self.assertEqual(self.started, ['fail'])
+        self.assertEqual(self.running, 0)
+
+
+class TestTerminateProcesses(unittest.TestCase):
+    def test_terminate(self):
+        tmpDir = tempfile.mkdtemp()
+        try:
+            runDir = os.path.join(tmpDir, 'run')
+            os.makedirs(runDir)
+            sleep = [sys.executable, '-c', 'import time; time.sleep(60)']
+            proc = subprocess.Popen(sleep, cwd=runDir)
+            other = subprocess.Popen(sleep, cwd=tmpDir)
+            time.sleep(0.2)
+            terminateProcesses(runDir, timeout=5)
+            self.assertIsNotNone(proc.poll())
+            self.assertIsNone(other.poll())
+            other.kill()
+            other.wait()
+        finally:
+            shutil.rmtree(tmpDir)
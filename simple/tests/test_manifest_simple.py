@@ -0,0 +1,121 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from simple.constants import SCREENING_FILE
+from simple.manifest import IterationManifest, PRIME_ARTIFACTS
+
+
+class TestIterationManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def _touch(self, *names):
+        for name in names:
+            with open(os.path.join(self.tmpDir, name), 'w') as f:
+                f.write('x')
+
+    def _kind(self, name):
+        for kind, regex in PRIME_ARTIFACTS:
+            if regex.match(name):
+                return kind
+
+    def test_artifacts(self):
+        self.assertEqual(self._kind('recvol_state01_iter12.spi'), 'recvol')
+        self.assertEqual(self._kind('recvol_state1_iter2_fullsize.spi'),
+                         'fullsize')
+        self.assertEqual(self._kind('recvol_state1_iter2.mrc'), 'mrc')
+        self.assertEqual(self._kind('recvol_state1_iter2.spi.gz'),
+                         'compressed')
+        self.assertEqual(self._kind('startvol_state2.spi'), 'startvol')
+        self.assertEqual(self._kind('prime3Ddoc_3.txt'), 'oritab')
+        self.assertEqual(self._kind('seed_oritab.txt'), 'seed')
+        self.assertEqual(self._kind('fsc_state01.txt'), 'doc')
+        for name in ['recvol_state1_iter2.spi.tmp', 'classes.spi',
+                     'recvol_state1.spi', 'prime.log']:
+            self.assertIsNone(self._kind(name), name)
+
+    def test_entries(self):
+        self._touch('recvol_state2_iter1.spi', 'recvol_state1_iter2.spi',
+                    'recvol_state1_iter1.spi', 'recvol_state2_iter2.spi',
+                    'prime3Ddoc_2.txt', 'classes.spi')
+        manifest = IterationManifest(self.tmpDir)
+        self.assertEqual(len(manifest.entries), 5)
+        self.assertEqual([(e['state'], e['iteration'])
+                          for e in manifest.getEntries('recvol')],
+                         [(1, 1), (2, 1), (1, 2), (2, 2)])
+        self.assertEqual(manifest.getFiles(iteration=2, state=2),
+                         [os.path.join(self.tmpDir,
+                                       'recvol_state2_iter2.spi')])
+        oritab = manifest.getEntries('oritab')[0]
+        self.assertEqual((oritab['state'], oritab['iteration'],
+                          oritab['size']), (None, 2, 1))
+        self.assertEqual(manifest.getLastIteration(), 2)
+
+    def test_lastIterationAfterRemove(self):
+        self._touch('recvol_state1_iter1.spi', 'recvol_state1_iter2.spi',
+                    'recvol_state2_iter3.spi')
+        manifest = IterationManifest(self.tmpDir)
+        # Only the volumes of the first state count
+        self.assertEqual(manifest.getLastIteration(), 2)
+        manifest.remove(manifest.getEntries(iteration=2))
+        self.assertFalse(os.path.exists(os.path.join(
+            self.tmpDir, 'recvol_state1_iter2.spi')))
+        self.assertEqual(manifest.getLastIteration(), 1)
+        manifest.scan()
+        self.assertEqual(len(manifest.entries), 2)
+
+    def test_missingFolder(self):
+        manifest = IterationManifest(os.path.join(self.tmpDir, 'none'))
+        self.assertEqual(manifest.entries, [])
+        self.assertEqual(manifest.getLastIteration(), 0)
+
+    def test_write(self):
+        self._touch('recvol_state1_iter1.spi')
+        fn = os.path.join(self.tmpDir, 'manifest.json')
+        IterationManifest(self.tmpDir).write(fn)
+        with open(fn) as f:
+            entries = json.load(f)
+        self.assertEqual([(e['name'], e['kind']) for e in entries],
+                         [('recvol_state1_iter1.spi', 'recvol')])
+
+    def test_cleanupKeepsProtocolFiles(self):
+        self._touch(SCREENING_FILE, 'seed_oritab.txt', 'fsc_state01.txt',
+                    'prime3Ddoc_1.txt')
+        manifest = IterationManifest(self.tmpDir)
+        # The cleanup of the protocol removes docs and alignment docs
+        manifest.remove(manifest.getEntries('doc') +
+                        manifest.getEntries('oritab'))
+        self.assertEqual(sorted(os.listdir(self.tmpDir)),
+                         sorted([SCREENING_FILE, 'seed_oritab.txt']))
@@ -0,0 +1,85 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from simple.metrics import PrimeLogFollower, readPrimeMetrics
+
+
+class TestPrimeLogFollower(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.logFile = os.path.join(self.tmpDir, 'prime.log')
+        self.metricsFile = os.path.join(self.tmpDir, 'metrics.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def _writeIteration(self, f, it):
+        f.write(">>> ITERATION %d\n" % it)
+        f.write("some progress output\n")
+        f.write(">>> CORRELATION: 0.%d\n" % it)
+        f.write(">>> RESOLUTION AT FSC=0.5: %d.0\n" % (30 - it))
+
+    def test_follow(self):
+        echoed = []
+        follower = PrimeLogFollower(self.logFile, self.metricsFile,
+                                    echo=echoed.append)
+        with open(self.logFile, 'w') as f:
+            self._writeIteration(f, 1)
+            self._writeIteration(f, 2)
+            f.write(">>> ITERATION 3\n>>> CORREL")
+        follower.poll()
+        # Iteration 3 has started, so the previous ones are complete
+        metrics = readPrimeMetrics(self.metricsFile)
+        self.assertEqual([m['iter'] for m in metrics], [1, 2])
+
+        with open(self.logFile, 'a') as f:
+            f.write("ATION: 0.3")
+        follower.stop()
+        metrics = readPrimeMetrics(self.metricsFile)
+        self.assertEqual([m['iter'] for m in metrics], [1, 2, 3])
+        self.assertEqual([m['corr'] for m in metrics], [0.1, 0.2, 0.3])
+        self.assertEqual(metrics[1]['res'], 28.0)
+        self.assertTrue(all(m['duration'] >= 0 for m in metrics))
+        self.assertEqual(len(echoed), 10)
+
+    def test_append(self):
+        with open(self.logFile, 'w') as f:
+            self._writeIteration(f, 1)
+        follower = PrimeLogFollower(self.logFile, self.metricsFile)
+        follower.stop()
+
+        follower = PrimeLogFollower(self.logFile, self.metricsFile,
+                                    append=True)
+        with open(self.logFile, 'a') as f:
+            self._writeIteration(f, 2)
+        follower.stop()
+        metrics = readPrimeMetrics(self.metricsFile)
+        self.assertEqual([m['iter'] for m in metrics], [1, 2])
@@ -0,0 +1,202 @@
+# **************************************************************************
+# *
+# * Authors:    Jose Luis Vilas (jlvilas@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+import numpy as np
+
+from simple.convert import writeSpiderVolume
+from simple.execution import terminateProcesses
+from simple.monitor import (IterationWatcher, RetentionPolicy,
+                            ConvergenceMonitor)
+
+
+class TestRetentionPolicy(unittest.TestCase):
+    """ Follow the iterations of a run whose volumes are written here. """
+    BOX = 8
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.watcher = IterationWatcher(self.tmpDir, 1, [])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def _runIterations(self, policy, iterations):
+        """ Write the volume and doc of every iteration and notify the
+        policy. Return the size of a volume. """
+        for it in range(1, iterations + 1):
+            fn = os.path.join(self.tmpDir, 'recvol_state1_iter%d.spi' % it)
+            writeSpiderVolume(fn, np.full((self.BOX,) * 3, it, np.float32))
+            open(os.path.join(self.tmpDir, 'prime3Ddoc_%d.txt' % it),
+                 'w').close()
+            policy.onIteration(self.watcher, it, [fn])
+        policy.close()
+        return os.path.getsize(fn)
+
+    def _getFiles(self):
+        return sorted(os.listdir(self.tmpDir))
+
+    def test_keepIterations(self):
+        policy = RetentionPolicy(keepIterations=2)
+        size = self._runIterations(policy, 4)
+        self.assertEqual(self._getFiles(),
+                         ['prime3Ddoc_3.txt', 'prime3Ddoc_4.txt',
+                          'recvol_state1_iter3.spi',
+                          'recvol_state1_iter4.spi'])
+        # Three iterations are on disk before the oldest is removed
+        self.assertEqual(policy.peakBytes, 3 * size)
+        self.assertEqual(policy.unretainedBytes, 4 * size)
+
+    def test_maxBytes(self):
+        policy = RetentionPolicy(maxBytes=1)
+        self._runIterations(policy, 3)
+        # The last iteration is never removed
+        self.assertEqual(self._getFiles(),
+                         ['prime3Ddoc_3.txt', 'recvol_state1_iter3.spi'])
+
+    def test_maxBytesAndKeep(self):
+        fn = os.path.join(self.tmpDir, 'volume.spi')
+        writeSpiderVolume(fn, np.zeros((self.BOX,) * 3, np.float32))
+        size = os.path.getsize(fn)
+        os.remove(fn)
+        policy = RetentionPolicy(keepIterations=3, maxBytes=2 * size)
+        self._runIterations(policy, 4)
+        self.assertEqual([fn for fn in self._getFiles()
+                          if fn.startswith('recvol')],
+                         ['recvol_state1_iter3.spi',
+                          'recvol_state1_iter4.spi'])
+
+    def test_compress(self):
+        policy = RetentionPolicy(keepIterations=2, compress=True)
+        self._runIterations(policy, 3)
+        self.assertEqual([fn for fn in self._getFiles()
+                          if fn.startswith('recvol')],
+                         ['recvol_state1_iter2.spi.gz',
+                          'recvol_state1_iter3.spi'])
+
+    def test_noRetention(self):
+        policy = RetentionPolicy()
+        size = self._runIterations(policy, 3)
+        self.assertEqual(len(self._getFiles()), 6)
+        self.assertEqual(policy.peakBytes, policy.unretainedBytes)
+        self.assertEqual(policy.peakBytes, 3 * size)
+
+
+class TestConvergenceMonitor(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.converged = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def _writeVolumes(self, iteration, seeds):
+        files = []
+        for state, seed in enumerate(seeds, 1):
+            fn = os.path.join(self.tmpDir, 'recvol_state%d_iter%d.spi'
+                              % (state, iteration))
+            data = np.random.RandomState(seed).rand(8, 8, 8)
+            writeSpiderVolume(fn, data.astype(np.float32))
+            files.append(fn)
+        return files
+
+    def test_consecutiveIterations(self):
+        monitor = ConvergenceMonitor(0.99, 2, self.converged.append)
+        # The second state changes at iteration 3, restarting the count
+        seeds = [(1, 2), (3, 4), (3, 5), (3, 5), (3, 5), (3, 5)]
+        for it, itSeeds in enumerate(seeds, 1):
+            monitor.onIteration(None, it, self._writeVolumes(it, itSeeds))
+        self.assertEqual(self.converged, [5])
+        self.assertEqual(monitor.convergedIter, 5)
+        # Iterations are not compared once converged
+        self.assertEqual([it for it, _ in monitor.correlations],
+                         [2, 3, 4, 5])
+        corrs = dict(monitor.correlations)
+        self.assertLess(min(corrs[3]), 0.99)
+        self.assertAlmostEqual(corrs[3][0], 1.)
+        self.assertAlmostEqual(min(corrs[5]), 1.)
+
+    def test_notConverged(self):
+        monitor = ConvergenceMonitor(0.99, 2, self.converged.append)
+        for it in range(1, 5):
+            monitor.onIteration(None, it, self._writeVolumes(it, [it]))
+        self.assertEqual(self.converged, [])
+        self.assertIsNone(monitor.convergedIter)
+        self.assertEqual(len(monitor.correlations), 3)
+
+    def test_retentionAfterConvergence(self):
+        """ Iterations written after the converged one are not notified, so
+        the retention policy keeps the converged volumes. """
+        for handlers in [['monitor', 'policy'], ['policy', 'monitor']]:
+            for it in range(1, 6):
+                self._writeVolumes(it, [1])
+            monitor = ConvergenceMonitor(0.9, 2, self.converged.append)
+            policy = RetentionPolicy(keepIterations=1)
+            objects = {'monitor': monitor, 'policy': policy}
+            watcher = IterationWatcher(self.tmpDir, 1,
+                                       [objects[h] for h in handlers])
+            # All the iterations are found in the same poll
+            watcher.poll()
+            self.assertEqual(monitor.convergedIter, 3)
+            self.assertEqual(watcher.convergedIter, 3)
+            self.assertEqual(watcher.nextIter, 4)
+            self.assertEqual(sorted(os.listdir(self.tmpDir)),
+                             ['recvol_state1_iter%d.spi' % it
+                              for it in [3, 4, 5]])
+            watcher.poll()
+            self.assertEqual(watcher.nextIter, 4)
+        self.assertEqual(self.converged, [3, 3])
+
+    def test_terminate(self):
+        """ The stand-in simple_prime is terminated as the protocol does
+        once its volumes stop changing. """
+        fnStack = os.path.join(self.tmpDir, 'classes.spi')
+        with open(fnStack, 'wb') as f:
+            f.write(np.array([0] * 25 + [10] + [0] * 230, '<f4').tobytes())
+        program = os.path.join(os.path.dirname(__file__),
+                               'fake_simple_prime.py')
+        env = dict(os.environ, FAKE_PRIME_ITERATIONS='30',
+                   FAKE_PRIME_ITER_TIME='0.2', FAKE_PRIME_CONVERGE='3')
+        monitor = ConvergenceMonitor(
+            0.999, 2, lambda it: terminateProcesses(self.tmpDir))
+        watcher = IterationWatcher(self.tmpDir, 1, [monitor], interval=0.1)
+        with open(os.devnull, 'w') as devnull:
+            proc = subprocess.Popen([sys.executable, program,
+                                     'stk=classes.spi', 'box=16'],
+                                    cwd=self.tmpDir, env=env, stdout=devnull)
+            watcher.start()
+            proc.wait()
+        watcher.stop()
+        self.assertNotEqual(proc.returncode, 0)
+        self.assertLessEqual(monitor.convergedIter, 5)
+        self.assertFalse(os.path.exists(os.path.join(
+            self.tmpDir, 'recvol_state1_iter30.spi')))
@@ -0,0 +1,119 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+
+from pyworkflow.tests import *
+from pyworkflow.em.protocol import ProtImportAverages
+
+from simple.constants import (REDUNDANT_FLAG, REDUNDANT_MERGE,
+                              REDUNDANT_REMOVE, SIMPLE_CACHE,
+                              SIMPLE_CACHE_SIZE, SIMPLE_HOME)
+from simple.protocols import ProtPrime
+from simple.tests.synthetic import writeSyntheticAverages
+from simple.tests.test_benchmark_simple import installFakeSimple
+
+
+class TestPrimeFake(BaseTest):
+    """ Run ProtPrime with the stand-in simple_prime. """
+    @classmethod
+    def setUpClass(cls):
+        setupTestProject(cls)
+        os.environ[SIMPLE_HOME] = installFakeSimple(
+            os.path.abspath(cls.getOutputPath('fake_simple')))
+        # Caches and calibrations of the stand-in runs stay in the project
+        os.environ[SIMPLE_CACHE] = os.path.abspath(
+            cls.getOutputPath('simple_cache'))
+        os.environ[SIMPLE_CACHE_SIZE] = '0'
+        os.environ['FAKE_PRIME_ITERATIONS'] = '3'
+        os.environ['FAKE_PRIME_ITER_TIME'] = '0.1'
+
+    def _importAverages(self, n=20):
+        fnAverages = writeSyntheticAverages(
+            os.path.abspath(self.getOutputPath('averages.stk')), 32, n)
+        protImport = self.newProtocol(ProtImportAverages,
+                                      filesPath=fnAverages,
+                                      samplingRate=3.0)
+        self.launchProtocol(protImport)
+        return protImport.outputAverages
+
+    def test_screeningAfterCleanup(self):
+        protPrime = self.newProtocol(ProtPrime,
+                                     doScreening=True,
+                                     screeningFraction=0.5,
+                                     keepIntermediate=False)
+        protPrime.inputClasses.set(self._importAverages())
+        self.launchProtocol(protPrime)
+
+        self.assertIsNotNone(protPrime.outputVol)
+        # The selection is still available once intermediate files are gone
+        selection = protPrime._getSelection()
+        self.assertIsNotNone(selection)
+        self.assertTrue(0 < len(selection) <= 10)
+
+    def test_resumeIteration(self):
+        protPrime = self.newProtocol(ProtPrime, keepIntermediate=True)
+        protPrime.inputClasses.set(self._importAverages())
+        self.launchProtocol(protPrime)
+
+        runDir = protPrime._getExtraPath()
+        self.assertEqual(protPrime._getResumeIteration(runDir), 3)
+        # A volume cut short by a killed job
+        fnVol = os.path.join(runDir, 'recvol_state1_iter3.spi')
+        with open(fnVol, 'r+b') as f:
+            f.truncate(os.path.getsize(fnVol) // 2)
+        self.assertEqual(protPrime._getResumeIteration(runDir), 2)
+        # An alignment doc without a line for every image
+        fnDoc = os.path.join(runDir, 'prime3Ddoc_2.txt')
+        with open(fnDoc) as f:
+            lines = f.readlines()
+        with open(fnDoc, 'w') as f:
+            f.writelines(lines[:-1])
+        self.assertEqual(protPrime._getResumeIteration(runDir), 1)
+
+    def test_redundantStates(self):
+        averages = self._importAverages()
+        # Every volume is redundant with the first one at any correlation
+        expected = {REDUNDANT_FLAG: 3, REDUNDANT_REMOVE: 1, REDUNDANT_MERGE: 1}
+        for redundantStates, size in expected.items():
+            protPrime = self.newProtocol(ProtPrime, Nvolumes=3,
+                                         stateThreshold=-1.0,
+                                         redundantStates=redundantStates)
+            protPrime.inputClasses.set(averages)
+            self.launchProtocol(protPrime)
+
+            self.assertEqual(protPrime.outputVolumes.getSize(), size)
+            comparison = protPrime.getStateComparison()
+            self.assertEqual(comparison['redundant'], [-1, 0, 0])
+            fnVolumes = [vol.getFileName() for vol in protPrime.outputVolumes]
+            merged = [os.path.basename(fn).startswith('merged_')
+                      for fn in fnVolumes]
+            self.assertEqual(all(merged),
+                             redundantStates == REDUNDANT_MERGE)
+            if redundantStates == REDUNDANT_MERGE:
+                self.assertIn("average of volumes 1 2 3",
+                              protPrime.outputVolumes.getFirstItem()
+                              .getObjComment())
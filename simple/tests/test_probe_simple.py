@@ -0,0 +1,96 @@
+# **************************************************************************
+# *
+# * Authors:    Jose Luis Vilas (jlvilas@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+from simple.probe import (checkProgramArgs, getArgKeys,
+                          getProgramCapabilities, probeProgram)
+
+
+class TestProbe(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        # simple_prime stand-in, that prints its usage without arguments
+        self.program = os.path.join(self.tmpDir, 'simple_prime')
+        fake = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                            'fake_simple_prime.py'))
+        with open(self.program, 'w') as f:
+            f.write("#!/bin/sh\nexec '%s' '%s' \"$@\"\n"
+                    % (sys.executable, fake))
+        os.chmod(self.program, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_getArgKeys(self):
+        args = ("stk=../classes.spi vol1=recvol_state1_iter4.spi "
+                "vol12=startvol.spi box=64 smpd=3.5 lp=20 dynlp=no "
+                "nthr=4 > prime.log 2>&1")
+        self.assertEqual(getArgKeys(args),
+                         {'stk', 'vol', 'box', 'smpd', 'lp', 'dynlp', 'nthr'})
+        # Options with dashes are not keys
+        self.assertEqual(getArgKeys("oritab=a.txt --opt=1 x-y=2"),
+                         {'oritab'})
+
+    def test_probeProgram(self):
+        capabilities = probeProgram(self.program)
+        self.assertEqual(capabilities['version'], '2.1')
+        for key in ['stk', 'vol', 'box', 'smpd', 'nstates', 'startit',
+                    'maxits', 'nthr']:
+            self.assertIn(key, capabilities['keys'])
+        missing = probeProgram(os.path.join(self.tmpDir, 'none'))
+        self.assertIn('error', missing)
+        self.assertEqual(missing['keys'], [])
+
+    def test_capabilitiesCache(self):
+        cacheFile = os.path.join(self.tmpDir, 'cache', 'capabilities.json')
+        capabilities = getProgramCapabilities(self.program, None, cacheFile)
+        self.assertEqual(getProgramCapabilities(self.program, None,
+                                                cacheFile), capabilities)
+        with open(cacheFile) as f:
+            self.assertEqual(len(json.load(f)), 1)
+        # Probed again when the program changes
+        with open(self.program, 'a') as f:
+            f.write('\n')
+        getProgramCapabilities(self.program, None, cacheFile)
+        with open(cacheFile) as f:
+            self.assertEqual(len(json.load(f)), 2)
+
+    def test_checkProgramArgs(self):
+        capabilities = probeProgram(self.program)
+        self.assertEqual(checkProgramArgs(capabilities,
+                                          "stk=a.spi vol1=b.spi box=64"), [])
+        self.assertEqual(checkProgramArgs(capabilities,
+                                          "stk=a.spi ncls=4 box=64 wfun=no"),
+                         ['ncls', 'wfun'])
+        # Nothing is rejected when the accepted keys are unknown
+        self.assertEqual(checkProgramArgs({'keys': []}, "ncls=4"), [])
+        self.assertEqual(checkProgramArgs({}, "ncls=4"), [])
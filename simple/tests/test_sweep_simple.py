@@ -0,0 +1,83 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+
+from pyworkflow.tests import *
+from pyworkflow.em.protocol import ProtImportAverages
+
+from simple.constants import SIMPLE_CACHE, SIMPLE_CACHE_SIZE, SIMPLE_HOME
+from simple.protocols import ProtPrimeSweep
+from simple.tests.synthetic import writeSyntheticAverages
+from simple.tests.test_benchmark_simple import installFakeSimple
+
+
+class TestPrimeSweep(BaseTest):
+    """ Run a small sweep with the stand-in simple_prime. """
+    @classmethod
+    def setUpClass(cls):
+        setupTestProject(cls)
+        os.environ[SIMPLE_HOME] = installFakeSimple(
+            os.path.abspath(cls.getOutputPath('fake_simple')))
+        # Caches and calibrations of the stand-in runs stay in the project
+        os.environ[SIMPLE_CACHE] = os.path.abspath(
+            cls.getOutputPath('simple_cache'))
+        os.environ[SIMPLE_CACHE_SIZE] = '0'
+        os.environ['FAKE_PRIME_ITERATIONS'] = '3'
+        os.environ['FAKE_PRIME_ITER_TIME'] = '0.1'
+
+    def test_sweep(self):
+        fnAverages = writeSyntheticAverages(
+            os.path.abspath(self.getOutputPath('averages.stk')), 32, 20)
+        protImport = self.newProtocol(ProtImportAverages,
+                                      filesPath=fnAverages,
+                                      samplingRate=3.0)
+        self.launchProtocol(protImport)
+
+        protSweep = self.newProtocol(ProtPrimeSweep,
+                                     symmetryGroups='c1 c2',
+                                     volumesList='1 2',
+                                     threadsPerRun=2,
+                                     numberOfThreads=4,
+                                     compareStates=False,
+                                     retainIterations=1)
+        protSweep.inputClasses.set(protImport.outputAverages)
+        self.launchProtocol(protSweep)
+
+        for i, nstates in enumerate([1, 2, 1, 2], 1):
+            volSet = getattr(protSweep, 'outputVolumes_%02d' % i, None)
+            self.assertIsNotNone(volSet, "Missing output of run %d" % i)
+            self.assertEqual(volSet.getSize(), nstates)
+        self.assertEqual(len(protSweep.sweepTimes.get().split()), 4)
+        # The retention settings apply to every run of the sweep
+        self.assertGreater(protSweep.unretainedDiskBytes.get(),
+                           protSweep.peakDiskBytes.get())
+
+        protInvalid = self.newProtocol(ProtPrimeSweep, volumesList='1 x')
+        protInvalid.inputClasses.set(protImport.outputAverages)
+        self.assertTrue(any('separated by spaces' in e
+                            for e in protInvalid._validate()))
+        protInvalid._summary()
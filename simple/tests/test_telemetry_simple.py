@@ -0,0 +1,103 @@
+# **************************************************************************
+# *
+# * Authors:    Jose Luis Vilas (jlvilas@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from simple.telemetry import StepTelemetry, readTelemetry, telemetryStep
+
+
+# Child allocating about the given MB of memory
+ALLOCATE = "x = bytearray(%d * 1024 * 1024); x[::4096] = b'1' * len(x[::4096])"
+
+
+class TestStepTelemetry(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpDir, 'telemetry.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def _runChild(self, mb):
+        subprocess.check_call([sys.executable, '-c', ALLOCATE % mb])
+
+    def _getTotals(self):
+        return dict((r['step'], r) for r in readTelemetry(self.filename)[1])
+
+    def test_records(self):
+        with StepTelemetry(self.filename, 'step1', 0.05):
+            self._runChild(1)
+        try:
+            with StepTelemetry(self.filename, 'step2', 0.05):
+                raise ValueError()
+        except ValueError:
+            pass
+        samples, totals = readTelemetry(self.filename)
+        self.assertEqual([r['step'] for r in totals], ['step1', 'step2'])
+        self.assertFalse(totals[0]['failed'])
+        self.assertTrue(totals[1]['failed'])
+        # A sample is always taken when the step ends
+        self.assertEqual(set(r['step'] for r in samples), {'step1', 'step2'})
+        for key in ['wall', 'cpuTime', 'peakRss', 'read', 'write']:
+            self.assertIn(key, totals[0])
+        self.assertGreater(totals[0]['peakRss'], 0)
+
+    def test_childrenPeak(self):
+        """ The memory of a child finished between samples is counted in
+        its step, but not in later steps. """
+        with StepTelemetry(self.filename, 'big', 60):
+            self._runChild(200)
+        with StepTelemetry(self.filename, 'small', 60):
+            self._runChild(1)
+        totals = self._getTotals()
+        self.assertGreater(totals['big']['peakRss'], 200 * 1024 ** 2)
+        self.assertLess(totals['small']['peakRss'], 200 * 1024 ** 2)
+
+    def test_decorator(self):
+        class Protocol(object):
+            def __init__(self, filename):
+                self.filename = filename
+
+            def _getStepTelemetry(self, stepName):
+                if self.filename:
+                    return StepTelemetry(self.filename, stepName, 1)
+
+            @telemetryStep
+            def convertStep(self, value):
+                return value * 2
+
+        self.assertEqual(Protocol(None).convertStep(2), 4)
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertEqual(Protocol(self.filename).convertStep(3), 6)
+        self.assertEqual(list(self._getTotals()), ['convertStep'])
+
+    def test_readMissing(self):
+        self.assertEqual(readTelemetry(self.filename), ([], []))
@@ -0,0 +1,77 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from simple.thumbnails import ThumbnailCache, VIEWS, createMosaic
+
+
+class TestThumbnailCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpDir, 'thumbnails.dat')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_pyramid(self):
+        volume = np.zeros((40, 40, 40), dtype=np.float32)
+        volume[10:30, 15:25, 5:35] = 1
+        cache = ThumbnailCache(self.filename)
+        for iteration in [1, 2]:
+            for state in [1, 2]:
+                cache.add(state, iteration, volume * iteration, 32, 5)
+        # A truncated last record is ignored
+        with open(self.filename, 'ab') as f:
+            f.write(b'THMB\x40')
+
+        reader = ThumbnailCache(self.filename)
+        reader.scan()
+        self.assertEqual(reader.getStates(), [1, 2])
+        self.assertEqual(reader.getIterations(), [1, 2])
+        self.assertEqual(reader.getSizes(), [20, 10, 5])
+        self.assertIsNone(reader.getImages(3, 1))
+
+        images = reader.getImages(2, 2)
+        self.assertEqual(images.shape, (len(VIEWS), 20, 20))
+        # The projection along z is the sum of the binned slices
+        np.testing.assert_allclose(images[VIEWS.index('proj_z')].sum(),
+                                   volume.sum() * 2 / 4., rtol=1e-5)
+        self.assertEqual(images[VIEWS.index('slice_z')].max(), 2)
+        self.assertEqual(reader.getImages(1, 1, 8).shape[-1], 10)
+        self.assertEqual(reader.getImages(1, 1, 64).shape[-1], 20)
+
+        mosaic, iterations, size = createMosaic(reader, 'slice_y',
+                                                maxWidth=30)
+        self.assertEqual(iterations, [1, 2])
+        self.assertEqual(size, 10)
+        self.assertEqual(mosaic.shape, (22, 22))
+        self.assertEqual(mosaic.max(), 1)
@@ -0,0 +1,92 @@
+# **************************************************************************
+# *
+# * Authors:    Jose Luis Vilas (jlvilas@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from simple.tuning import (ThreadsCache, chooseThreads, fitScaling,
+                           getCalibrationThreads, getSymmetryOrder)
+
+
+class TestThreadsTuning(unittest.TestCase):
+    def test_fitScaling(self):
+        threads = [2, 4, 8]
+        a, b = fitScaling(threads, [1. + 8. / t for t in threads])
+        self.assertAlmostEqual(a, 1.)
+        self.assertAlmostEqual(b, 8.)
+        # A single thread count can not tell serial from parallel time
+        self.assertEqual(fitScaling([4, 4], [3., 3.]), (3., 0.))
+
+    def test_fitScalingNoisy(self):
+        # Slower with more threads (oversubscribed host): no parallel part
+        a, b = fitScaling([1, 2, 4], [10., 11., 12.])
+        self.assertEqual(b, 0.)
+        self.assertGreater(a, 0.)
+        # Superlinear speedup would give a negative serial time
+        a, b = fitScaling([1, 2, 4], [10., 4., 1.5])
+        self.assertEqual(a, 0.)
+        self.assertGreater(b, 0.)
+
+    def test_chooseThreads(self):
+        # Perfectly parallel
+        self.assertEqual(chooseThreads(0., 10., 16), 16)
+        # Only serial time
+        self.assertEqual(chooseThreads(10., 0., 16), 1)
+        # Efficiency 10 / (t + 9) stays above 0.6 up to 7 threads
+        self.assertEqual(chooseThreads(1., 9., 16), 7)
+        self.assertEqual(chooseThreads(1., 9., 4), 4)
+        self.assertEqual(chooseThreads(1., 9., 16, minEfficiency=0.9), 2)
+        # Nothing measured
+        self.assertEqual(chooseThreads(0., 0., 8), 8)
+
+    def test_getCalibrationThreads(self):
+        self.assertEqual(getCalibrationThreads(16), [4, 8, 16])
+        self.assertEqual(getCalibrationThreads(2), [1, 2])
+        self.assertEqual(getCalibrationThreads(1), [1])
+
+    def test_getSymmetryOrder(self):
+        self.assertEqual(getSymmetryOrder('c1'), 1)
+        self.assertEqual(getSymmetryOrder('C4'), 4)
+        self.assertEqual(getSymmetryOrder('d7'), 14)
+        self.assertEqual(getSymmetryOrder('i'), 60)
+        self.assertEqual(getSymmetryOrder('x'), 1)
+
+    def test_threadsCache(self):
+        tmpDir = tempfile.mkdtemp()
+        try:
+            cache = ThreadsCache(os.path.join(tmpDir, 'tuning',
+                                              'threads.json'))
+            self.assertIsNone(cache.get(64, 2, 8))
+            cache.set(64, 2, 8, 6)
+            cache.set(128, 2, 8, 8)
+            self.assertEqual(ThreadsCache(cache.filename).get(64, 2, 8), 6)
+            self.assertIsNone(cache.get(64, 1, 8))
+            # Runs given fewer threads are calibrated again
+            self.assertIsNone(cache.get(64, 2, 4))
+        finally:
+            shutil.rmtree(tmpDir)
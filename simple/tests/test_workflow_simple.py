@@ -32,8 +32,7 @@ from simple.protocols import ProtPrime
 
 class TestSimpleBase(BaseTest):
     
-    def runInitialModel(self, samplingRate, symmetry, 
-                        numberOfIterations, numberOfModels):
+    def runInitialModel(self, samplingRate, symmetry, numberOfModels):
         print("Import Set of averages")
         protImportAvg = self.newProtocol(ProtImportAverages, 
                                          filesPath=self.averages, 
@@ -45,13 +44,14 @@ class TestSimpleBase(BaseTest):
 
         print("Run Simple")
         protIniModel = self.newProtocol(ProtPrime,
-                                        symmetry=symmetry,
-                                        numberOfIterations=numberOfIterations,
-                                        numberOfModels=numberOfModels,
+                                        symmetryGroup=symmetry,
+                                        Nvolumes=numberOfModels,
                                         numberOfThreads=4)
         protIniModel.inputClasses.set(protImportAvg.outputAverages)
         self.launchProtocol(protIniModel)
-        self.assertIsNotNone(protIniModel.outputVol,
+        outputName = 'outputVol' if numberOfModels == 1 else 'outputVolumes'
+        output = getattr(protIniModel, outputName, None)
+        self.assertIsNotNone(output,
                              "There was a problem with simple initial model protocol")
 
 
@@ -63,7 +63,7 @@ class TestSimpleMDA(TestSimpleBase):
         cls.averages = cls.dataset.getFile('averages')
         
     def test_mda(self):
-        self.runInitialModel(3.5, 'd6', 5, 2)
+        self.runInitialModel(3.5, 'd6', 2)
 
 
 class TestSimpleGroel(TestSimpleBase):
@@ -74,4 +74,4 @@ class TestSimpleGroel(TestSimpleBase):
         cls.averages = cls.dataset.getFile('averages')
         
     def test_groel(self):
-        self.runInitialModel(2.1, 'd7', 10, 10)
+        self.runInitialModel(2.1, 'd7', 10)
@@ -0,0 +1,188 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import json
+import struct
+
+import numpy as np
+
+
+# Images kept for every volume: central slices and projections along z, y
+# and x (of the (z, y, x) array)
+VIEWS = ['slice_z', 'slice_y', 'slice_x', 'proj_z', 'proj_y', 'proj_x']
+
+RECORD_MAGIC = b'THMB'
+RECORD_HEADER = struct.Struct('<4sI')
+
+# Slices of a volume read at once to compute the projections
+SLAB_SIZE = 16
+
+
+def _binImages(images):
+    """ Return the images (n, y, x) binned by 2, cropping odd sizes. """
+    n, ny, nx = images.shape
+    images = images[:, :ny - ny % 2, :nx - nx % 2]
+    return images.reshape(n, ny // 2, 2, nx // 2, 2).mean(axis=(2, 4))
+
+
+def getViewImages(volume):
+    """ Return an array (6, box, box) with the VIEWS of a cubic volume (or
+    memory mapped volume), that is read once in slabs of z slices. """
+    nz, ny, nx = volume.shape
+    projections = [np.zeros((ny, nx)), np.zeros((nz, nx)), np.zeros((nz, ny))]
+    for z0 in range(0, nz, SLAB_SIZE):
+        slab = np.asarray(volume[z0:z0 + SLAB_SIZE], dtype=np.float64)
+        projections[0] += slab.sum(axis=0)
+        projections[1][z0:z0 + len(slab)] = slab.sum(axis=1)
+        projections[2][z0:z0 + len(slab)] = slab.sum(axis=2)
+    slices = [volume[nz // 2], volume[:, ny // 2], volume[:, :, nx // 2]]
+    return np.array(slices + projections, dtype=np.float32)
+
+
+def createPyramid(volume, maxSize, minSize):
+    """ Return a list of arrays (6, size, size) with the VIEWS of the
+    volume at decreasing sizes: the first one binned by 2 until it is not
+    larger than maxSize, and each next one half the previous, down to
+    minSize. """
+    images = getViewImages(volume)
+    while images.shape[-1] > maxSize:
+        images = _binImages(images)
+    levels = [images]
+    while images.shape[-1] // 2 >= minSize:
+        images = _binImages(images)
+        levels.append(images.astype(np.float32))
+    return levels
+
+
+class ThumbnailCache(object):
+    """ Pyramids of the views of the volumes of a run, kept in a single
+    append-only file so they can be added while simple_prime runs.
+
+    Every record has a small json header with the state, iteration and
+    sizes of the pyramid followed by its float32 images. Readers index the
+    headers only, skip an incomplete last record and load just the level
+    they need. A volume added again replaces the previous one.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._index = {}
+        self._scanned = 0
+
+    def add(self, state, iteration, volume, maxSize, minSize):
+        levels = createPyramid(volume, maxSize, minSize)
+        header = json.dumps({'state': state, 'iteration': iteration,
+                             'sizes': [l.shape[-1] for l in levels]})
+        header = header.encode('utf-8')
+        data = b''.join(l.astype('<f4').tobytes() for l in levels)
+        with open(self.filename, 'ab') as f:
+            # A single write, so readers never see a partial header
+            f.write(RECORD_HEADER.pack(RECORD_MAGIC, len(header)) +
+                    header + data)
+
+    def scan(self):
+        """ Index the records written since the last scan. """
+        if not os.path.exists(self.filename):
+            return
+        size = os.path.getsize(self.filename)
+        with open(self.filename, 'rb') as f:
+            f.seek(self._scanned)
+            while self._scanned + RECORD_HEADER.size <= size:
+                magic, length = RECORD_HEADER.unpack(
+                    f.read(RECORD_HEADER.size))
+                if magic != RECORD_MAGIC:
+                    raise Exception("%s is corrupted at byte %d"
+                                    % (self.filename, self._scanned))
+                offset = self._scanned + RECORD_HEADER.size + length
+                if offset > size:
+                    break
+                header = json.loads(f.read(length).decode('utf-8'))
+                end = offset + sum(len(VIEWS) * s * s * 4
+                                   for s in header['sizes'])
+                if end > size:
+                    break
+                self._index[(header['state'], header['iteration'])] = \
+                    (offset, header['sizes'])
+                f.seek(end)
+                self._scanned = end
+
+    def getStates(self):
+        return sorted(set(state for state, _ in self._index))
+
+    def getIterations(self):
+        return sorted(set(iteration for _, iteration in self._index))
+
+    def getSizes(self):
+        """ Return the sizes of the pyramid levels of the first volume. """
+        if not self._index:
+            return []
+        return self._index[min(self._index)][1]
+
+    def getImages(self, state, iteration, size=None):
+        """ Return an array (6, s, s) with the VIEWS of a volume at the
+        smallest level not smaller than size (the largest one if size is
+        None or above all of them), or None if it is not cached. """
+        if (state, iteration) not in self._index:
+            return None
+        offset, sizes = self._index[(state, iteration)]
+        level = 0
+        if size is not None:
+            level = max([0] + [i for i, s in enumerate(sizes) if s >= size])
+        for s in sizes[:level]:
+            offset += len(VIEWS) * s * s * 4
+        s = sizes[level]
+        with open(self.filename, 'rb') as f:
+            f.seek(offset)
+            data = np.fromfile(f, dtype='<f4', count=len(VIEWS) * s * s)
+        return data.reshape(len(VIEWS), s, s)
+
+
+def createMosaic(cache, view, iterations=None, maxWidth=1600):
+    """ Return a 2D array with the given view of every state (rows) and
+    iteration (columns) in the cache, each image normalized to [0, 1] and
+    at the largest level that fits in maxWidth pixels, together with the
+    list of iterations and the size of the images. Missing volumes are
+    left blank. """
+    iterations = iterations or cache.getIterations()
+    states = cache.getStates()
+    sizes = cache.getSizes()
+    fitting = [s for s in sizes if (s + 1) * len(iterations) <= maxWidth]
+    size = fitting[0] if fitting else sizes[-1]
+    mosaic = np.zeros((len(states) * (size + 1), len(iterations) * (size + 1)),
+                      dtype=np.float32)
+    index = VIEWS.index(view)
+    for row, state in enumerate(states):
+        for col, iteration in enumerate(iterations):
+            images = cache.getImages(state, iteration, size)
+            if images is None or images.shape[-1] != size:
+                continue
+            image = images[index]
+            span = image.max() - image.min()
+            if span > 0:
+                image = (image - image.min()) / span
+            y, x = row * (size + 1), col * (size + 1)
+            mosaic[y:y + size, x:x + size] = image
+    return mosaic, iterations, size
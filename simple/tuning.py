@@ -0,0 +1,141 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import json
+import socket
+
+import psutil
+
+
+# Minimum parallel efficiency (speedup / threads) accepted when choosing
+# the number of threads
+MIN_EFFICIENCY = 0.6
+
+
+def getAvailableCores():
+    """ Return the number of cores this process is allowed to use. """
+    try:
+        return len(psutil.Process().cpu_affinity())
+    except (AttributeError, psutil.Error):
+        return psutil.cpu_count()
+
+
+def getSymmetryOrder(symmetryGroup):
+    """ Return the number of symmetry operations of a point group given
+    as cn, dn, t, o or i. """
+    group = symmetryGroup.strip().lower()
+    orders = {'t': 12, 'o': 24, 'i': 60}
+    if group in orders:
+        return orders[group]
+    try:
+        n = int(group[1:])
+    except ValueError:
+        return 1
+    return 2 * n if group.startswith('d') else n
+
+
+def estimatePrimeCost(box, samplingRate, lowPass, nstates, symmetryGroup):
+    """ Return a relative estimate of the cost of a simple_prime run: the
+    number of projection directions needed at the given resolution
+    (reduced by the symmetry) times the cost of comparing each of them
+    with every image, for every state. """
+    directions = (box * samplingRate / float(lowPass)) ** 2
+    return (nstates * directions * box ** 2 /
+            float(getSymmetryOrder(symmetryGroup)))
+
+
+def getCalibrationThreads(maxThreads):
+    """ Return up to 3 different thread counts to time, spread up to
+    maxThreads. """
+    return sorted(set(max(1, maxThreads // d) for d in [4, 2, 1]))
+
+
+def fitScaling(threads, times):
+    """ Fit the times measured with the given thread counts to Amdahl's
+    law, T(t) = a + b / t, by least squares. Return (a, b), where a is
+    the serial time and b the parallelizable time with one thread. """
+    n = float(len(threads))
+    xs = [1. / t for t in threads]
+    mx, my = sum(xs) / n, sum(times) / n
+    sxx = sum((x - mx) ** 2 for x in xs)
+    if sxx == 0:
+        return times[0], 0.
+    b = sum((x - mx) * (y - my) for x, y in zip(xs, times)) / sxx
+    a = my - b * mx
+    # Keep the model physically meaningful
+    b = max(b, 0.)
+    a = max(a, 0.)
+    return a, b
+
+
+def chooseThreads(a, b, maxThreads, minEfficiency=MIN_EFFICIENCY):
+    """ Return the largest number of threads (up to maxThreads) whose
+    predicted parallel efficiency is at least minEfficiency. """
+    if a + b <= 0:
+        return maxThreads
+    best = 1
+    for t in range(1, maxThreads + 1):
+        speedup = (a + b) / (a + b / t)
+        if speedup / t >= minEfficiency:
+            best = t
+    return best
+
+
+class ThreadsCache(object):
+    """ Json file with the number of threads chosen for each host, box
+    size, number of states and threads allocated to the run, so
+    calibration runs only once. """
+    def __init__(self, filename):
+        self.filename = filename
+
+    @staticmethod
+    def getKey(box, nstates, maxThreads):
+        return '%s:%d:%d:%d' % (socket.gethostname(), box, nstates,
+                                maxThreads)
+
+    def _load(self):
+        if os.path.exists(self.filename):
+            with open(self.filename) as f:
+                try:
+                    return json.load(f)
+                except ValueError:
+                    pass
+        return {}
+
+    def get(self, box, nstates, maxThreads):
+        return self._load().get(self.getKey(box, nstates, maxThreads))
+
+    def set(self, box, nstates, maxThreads, value):
+        data = self._load()
+        data[self.getKey(box, nstates, maxThreads)] = value
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        tmp = '%s.%d.tmp' % (self.filename, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.rename(tmp, self.filename)
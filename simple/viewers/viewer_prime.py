@@ -0,0 +1,96 @@
+# **************************************************************************
+# *
+# * Authors:     Carlos Oscar Sorzano (coss@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'scipion@cnb.csic.es'
+# *
+# **************************************************************************
+
+import pyworkflow.protocol.params as params
+from pyworkflow.viewer import ProtocolViewer, DESKTOP_TKINTER
+
+from simple.protocols import ProtPrime
+from simple.thumbnails import VIEWS, createMosaic
+
+
+class PrimeViewer(ProtocolViewer):
+    """ Browse the central slices or projections of the volumes of every
+    state and iteration of a prime run. They are read from the thumbnails
+    kept while simple_prime ran, so no volume is opened. """
+    _label = 'viewer prime'
+    _targets = [ProtPrime]
+    _environments = [DESKTOP_TKINTER]
+
+    def _defineParams(self, form):
+        form.addSection(label='Iterations')
+        form.addParam('runNumber', params.IntParam,
+                      default=0,
+                      label='Run',
+                      help="Run to display (among the independent runs or "
+                           "the runs of a sweep), 0 for the best one.")
+        form.addParam('viewKind', params.EnumParam,
+                      choices=['central slices', 'projections'],
+                      default=0,
+                      display=params.EnumParam.DISPLAY_HLIST,
+                      label='Display')
+        form.addParam('axis', params.EnumParam,
+                      choices=['z', 'y', 'x'],
+                      default=0,
+                      display=params.EnumParam.DISPLAY_HLIST,
+                      label='Along axis')
+        form.addParam('iterationsList', params.StringParam,
+                      default='',
+                      label='Iterations',
+                      help="Iterations to display, separated by spaces "
+                           "(e.g. '1 5 10'). Leave empty for all of them.")
+        form.addParam('displayIterations', params.LabelParam,
+                      label='Display states x iterations')
+
+    def _getVisualizeDict(self):
+        return {'displayIterations': self._showIterations}
+
+    def _getRunDir(self):
+        runNumber = self.runNumber.get()
+        if runNumber > 0:
+            return self.protocol._getRunDirs()[runNumber - 1]
+        return None
+
+    def _showIterations(self, paramName=None):
+        from pyworkflow.gui.plotter import Plotter
+
+        cache = self.protocol.getThumbnailCache(self._getRunDir())
+        if not cache.getStates():
+            return [self.errorMessage("No thumbnails found for this run.",
+                                      title="Missing thumbnails")]
+        view = VIEWS[3 * self.viewKind.get() + self.axis.get()]
+        iterations = [int(it) for it in
+                      (self.iterationsList.get() or '').split()]
+        mosaic, iterations, size = createMosaic(cache, view, iterations)
+
+        states = cache.getStates()
+        plotter = Plotter(windowTitle="Prime %s" % view.replace('_', ' '))
+        ax = plotter.createSubPlot("States x iterations", "Iteration", "State")
+        ax.imshow(mosaic, cmap='gray', interpolation='nearest')
+        ax.set_xticks([(size + 1) * (i + 0.5) for i in range(len(iterations))])
+        ax.set_xticklabels(iterations)
+        ax.set_yticks([(size + 1) * (i + 0.5) for i in range(len(states))])
+        ax.set_yticklabels(states)
+        return [plotter]